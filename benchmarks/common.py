@@ -0,0 +1,114 @@
+"""
+Shared setup and reporting for the benchmark scripts.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+BACKENDS = ('mongod', 'memory')
+
+
+def add_backend_args(parser):
+    parser.add_argument('--backend', choices=BACKENDS, default='mongod',
+                        help="Run against a local mongod or the in-memory storage backend.")
+    parser.add_argument('--uri', default='mongodb://localhost:27017')
+    parser.add_argument('--db', default='studyshare_bench')
+
+
+def make_app(args, **config):
+    """
+    Build the Flask app pointed at the benchmark database, or at the
+    in-memory storage backend
+    """
+    from flaskr import create_app
+
+    return create_app({
+        'TESTING': True,
+        'DEBUG': False,
+        'STORAGE_BACKEND': 'mongo' if args.backend == 'mongod' else 'memory',
+        'MONGO_URI': args.uri,
+        'DB_NAME': args.db,
+        'SECRET_KEY': 'benchmark-secret-key-0123456789abcdef',
+        'JWT_SECRET_KEY': 'benchmark-jwt-key-0123456789abcdef',
+        # Measure the work itself, not the caches in front of it
+        'RESPONSE_CACHE': False,
+        # The data is generated after the app, so benchmarks build the index themselves
+        'AUTOCOMPLETE_PRELOAD': False,
+        **config,
+    })
+
+
+def summarize(timings, elapsed=None):
+    """
+    Latency summary in milliseconds for a list of per-operation timings in seconds
+    """
+    ms = sorted(t * 1000 for t in timings)
+    if len(ms) >= 2:
+        cuts = statistics.quantiles(ms, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = ms[0] if ms else 0.0
+    total = elapsed if elapsed is not None else sum(timings)
+    return {
+        'n': len(ms),
+        'mean_ms': statistics.fmean(ms) if ms else 0.0,
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'max_ms': ms[-1] if ms else 0.0,
+        'ops_per_sec': len(ms) / total if total else 0.0,
+    }
+
+
+def run_timed(fn, iterations, warmup=3):
+    """
+    Call fn repeatedly and return the per-call timings in seconds
+    """
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def save_results(path, kind, args, results):
+    """
+    Write results with enough metadata to compare runs later
+    """
+    payload = {
+        'kind': kind,
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key != 'output'},
+        },
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    print(f"Saved results to {path}")
+
+
+def print_table(results):
+    print(f"{'benchmark':<32}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'errors':>8}")
+    for name, row in results.items():
+        print(f"{name:<32}{row['n']:>7}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}"
+              f"{row['p99_ms']:>10.2f}{row['ops_per_sec']:>10.1f}{row.get('errors', ''):>8}")
@@ -0,0 +1,41 @@
+"""
+Compare two saved benchmark results (from benchmarks.micro or benchmarks.load).
+
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def change(old, new):
+    return (new - old) / old * 100 if old else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--metric', default='p50_ms', choices=['mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'ops_per_sec'])
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    if baseline['kind'] != candidate['kind']:
+        raise SystemExit(f"Can't compare {baseline['kind']} results with {candidate['kind']} results")
+    print(f"{baseline['meta'].get('revision')} -> {candidate['meta'].get('revision')} ({args.metric})")
+    print(f"{'benchmark':<32}{'before':>12}{'after':>12}{'change':>10}")
+    for name in sorted(set(baseline['results']) | set(candidate['results'])):
+        old = baseline['results'].get(name, {}).get(args.metric)
+        new = candidate['results'].get(name, {}).get(args.metric)
+        if old is None or new is None:
+            print(f"{name:<32}{'-' if old is None else f'{old:.2f}':>12}{'-' if new is None else f'{new:.2f}':>12}")
+            continue
+        print(f"{name:<32}{old:>12.2f}{new:>12.2f}{change(old, new):>+9.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+Deterministic benchmark data: users, code-heavy Markdown notes, Zipf-skewed
+likes and long comment threads. The same seed always yields the same data,
+down to the ids, so an export of it is a reproducible fixture.
+
+    python -m benchmarks.data --users 500 --posts 5000 --thread-size 5000
+
+    # Save the data set as a fixture, then load it instead of generating it
+    python -m benchmarks.data --backend memory --export fixtures/default
+    python -m benchmarks.micro --fixture fixtures/default
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+from benchmarks.common import add_backend_args, make_app
+
+PASSWORD = 'password123'
+# Hash of PASSWORD with the app's default method, fixed so the data is reproducible
+PASSWORD_HASH = ('scrypt:32768:8:1$QwEC1ap0Ll5lOZzB$5206ea6c4dc89b4e84babf446f1cae206161e822bc9aeb11e6097'
+                 '2deeff623b8a7b0a58e7e25d812f1dbc12a26fd86d22d679a3425d68d9a5bfce3e5ee6cddc3')
+BASE_TIME = datetime(2025, 1, 1)
+BATCH_SIZE = 1000
+
+WORDS = ("algebra calculus derivative integral matrix vector eigenvalue theorem proof lemma "
+         "photosynthesis mitochondria enzyme protein genome chromosome neuron synapse "
+         "python function variable recursion pointer compiler runtime closure iterator "
+         "revolution empire treaty parliament monarchy dynasty renaissance industrial "
+         "entropy momentum velocity acceleration quantum photon electron magnetic").split()
+TAGS = ['python', 'math', 'exam', 'lecture', 'lab', 'review', 'homework', 'cheatsheet',
+        'chemistry', 'physics', 'history', 'biology', 'algorithms', 'sql', 'javascript']
+CATEGORIES = ['General', 'Technology', 'Science', 'Math', 'Physics', 'Chemistry', 'Biology', 'History']
+
+CODE_SAMPLES = {
+    'python': '''def fibonacci(n):
+    """Return the n-th Fibonacci number."""
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+
+
+class Matrix:
+    def __init__(self, rows):
+        self.rows = [list(row) for row in rows]
+
+    def __matmul__(self, other):
+        return Matrix([[sum(a * b for a, b in zip(row, col)) for col in zip(*other.rows)]
+                       for row in self.rows])
+''',
+    'javascript': '''async function loadComments(url) {
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error(`HTTP ${response.status}`);
+  }
+  const page = await response.json();
+  return page.comments.map((c) => ({ ...c, createdAt: new Date(c.created_at) }));
+}
+''',
+    'sql': '''SELECT s.name, AVG(g.score) AS average
+FROM students s
+JOIN grades g ON g.student_id = s.id
+WHERE g.term = 'Spring'
+GROUP BY s.name
+HAVING AVG(g.score) > 85
+ORDER BY average DESC;
+''',
+}
+
+
+def sentence(rng, low=8, high=20):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(low, high))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def make_note(rng, code_blocks):
+    """
+    A Markdown note with headings, lists, a table, math and fenced code blocks
+    """
+    parts = [f"# {sentence(rng, 2, 5)[:-1].title()}", '', ' '.join(sentence(rng) for _ in range(4)), '']
+    for i in range(code_blocks):
+        language = rng.choice(list(CODE_SAMPLES))
+        parts += [f"## Part {i + 1}", '', ' '.join(sentence(rng) for _ in range(3)), '',
+                  f"```{language}", CODE_SAMPLES[language].rstrip(), '```', '']
+    parts += ['- ' + sentence(rng, 4, 8) for _ in range(5)]
+    parts += ['', '| Term | Definition |', '| --- | --- |']
+    parts += [f"| {rng.choice(WORDS)} | {sentence(rng, 5, 10)} |" for _ in range(4)]
+    parts += ['', 'Inline math $e^{i\\pi} + 1 = 0$ and display math:', '', '$$\\int_0^1 x^2 dx = \\frac{1}{3}$$', '']
+    return '\n'.join(parts)
+
+
+def zipf_weights(count, exponent=1.1):
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def generate(storage, users=500, posts=5000, likes=50000, comments=20000, thread_size=2000,
+             code_blocks=(0, 6), seed=42, render=True):
+    """
+    Replace the storage's data with deterministic benchmark data and return a
+    summary with the ids benchmarks need (a hot post with a long thread, a login, ...)
+    """
+    from flaskr.auth import normalize_key
+    from flaskr.facets import rebuild_facets
+    from flaskr.render import render_fields
+    from flaskr.search import search_fields
+    from flaskr.trending import rescore_trending
+
+    rng = random.Random(seed)
+    storage.drop()
+    storage.init()
+    storage.categories.ensure([{'_id': ObjectId.from_datetime(BASE_TIME - timedelta(days=1, seconds=-i)),
+                                'name': name, 'description': f"Discussions about {name.lower()}."}
+                               for i, name in enumerate(CATEGORIES)])
+
+    user_ids = [ObjectId.from_datetime(BASE_TIME + timedelta(seconds=i)) for i in range(users)]
+    storage.users.insert_many([{
+        '_id': user_id,
+        'username': f"student{i:05d}",
+        'email': f"student{i:05d}@example.edu",
+        'username_lower': f"student{i:05d}",
+        'email_lower': normalize_key(f"student{i:05d}@example.edu"),
+        'password': PASSWORD_HASH,
+    } for i, user_id in enumerate(user_ids)], ordered=False, batch_size=BATCH_SIZE)
+
+    # Posts share a small set of notes, so each is rendered (and highlighted) once;
+    # without render the HTML is left to be rendered lazily on first view
+    notes = [make_note(random.Random(seed * 1000 + i), blocks)
+             for i, blocks in enumerate(range(code_blocks[0], code_blocks[1] + 1))]
+    rendered = {i: render_fields(note) if render else {} for i, note in enumerate(notes)}
+
+    post_ids = [ObjectId.from_datetime(BASE_TIME + timedelta(minutes=i)) for i in range(posts)]
+
+    def post_docs():
+        for i, post_id in enumerate(post_ids):
+            note_index = rng.randrange(len(notes))
+            title = sentence(rng, 2, 6)[:-1].title()
+            content = notes[note_index]
+            created_at = BASE_TIME + timedelta(minutes=i)
+            yield {
+                '_id': post_id,
+                'title': title,
+                'content': content,
+                'category': rng.choice(CATEGORIES),
+                'creator_id': str(rng.choice(user_ids)),
+                'created_at': created_at,
+                'updated_at': created_at,
+                'tags': rng.sample(TAGS, rng.randint(1, 4)),
+                'likes': 0,
+                'comments': 0,
+                **rendered[note_index],
+                **search_fields(title, content),
+            }
+    storage.posts.insert_many(post_docs(), ordered=False, batch_size=BATCH_SIZE)
+    rebuild_facets(storage, batch_size=BATCH_SIZE)
+
+    # Zipf-skewed likes: a few posts get most of them, each (post, user) once
+    weights = zipf_weights(posts)
+    like_pairs = set()
+    attempts = 0
+    while len(like_pairs) < min(likes, posts * users) and attempts < likes * 5:
+        attempts += 1
+        post_index = rng.choices(range(posts), weights=weights)[0]
+        like_pairs.add((post_index, rng.randrange(users)))
+    like_counts = [0] * posts
+    like_docs = []
+    for i, (post_index, user_index) in enumerate(sorted(like_pairs)):
+        like_counts[post_index] += 1
+        like_docs.append({'_id': ObjectId.from_datetime(BASE_TIME + timedelta(days=60, seconds=i)),
+                          'post_id': post_ids[post_index], 'user_id': str(user_ids[user_index])})
+    storage.likes.insert_many(like_docs, ordered=False, batch_size=BATCH_SIZE)
+
+    # Comments: one very long thread on the hot post plus a skewed spread
+    hot_post = 0
+    comment_counts = [0] * posts
+
+    def comment_docs():
+        for i in range(thread_size + comments):
+            post_index = hot_post if i < thread_size else rng.choices(range(posts), weights=weights)[0]
+            comment_counts[post_index] += 1
+            created_at = BASE_TIME + timedelta(days=30, seconds=i)
+            yield {
+                '_id': ObjectId.from_datetime(created_at),
+                'post_id': post_ids[post_index],
+                'creator_id': rng.choice(user_ids),
+                'created_at': created_at,
+                'updated_at': created_at,
+                'comment': sentence(rng, 5, 30),
+            }
+    storage.comments.insert_many(comment_docs(), ordered=False, batch_size=BATCH_SIZE)
+
+    storage.posts.update_many(((post_ids[i], {'likes': like_counts[i], 'comments': comment_counts[i]})
+                               for i in range(posts) if like_counts[i] or comment_counts[i]),
+                              batch_size=BATCH_SIZE)
+    rescore_trending(storage, batch_size=BATCH_SIZE)
+
+    return {
+        'users': users,
+        'posts': posts,
+        'likes': len(like_docs),
+        'comments': thread_size + comments,
+        'hot_post_id': str(post_ids[hot_post]),
+        'post_ids': [str(post_id) for post_id in post_ids],
+        'user_ids': [str(user_id) for user_id in user_ids],
+        'login': {'username': 'student00000', 'password': PASSWORD},
+    }
+
+
+def add_data_args(parser):
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--likes', type=int, default=50000)
+    parser.add_argument('--comments', type=int, default=20000)
+    parser.add_argument('--thread-size', type=int, default=2000,
+                        help="Comments on the single hot post used by the view benchmarks.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--fixture', help="Load this export (from --export) instead of generating data.")
+
+
+def generate_from_args(app, args):
+    from flaskr.storage import get_storage
+    with app.app_context():
+        if args.fixture:
+            return load_fixture(args.fixture)
+        return generate(get_storage(), users=args.users, posts=args.posts, likes=args.likes,
+                        comments=args.comments, thread_size=args.thread_size, seed=args.seed)
+
+
+def load_fixture(directory):
+    """
+    Replace the storage's data with an exported data set and return its summary
+    """
+    from flaskr.backup import read_manifest, restore_data
+
+    summary = read_manifest(directory).get('meta')
+    if not summary:
+        raise SystemExit(f"{directory} is not a benchmark fixture; make one with --export")
+    restore_data(directory, drop=True)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_backend_args(parser)
+    add_data_args(parser)
+    parser.add_argument('--export', help="Also export the data to this directory as a fixture.")
+    args = parser.parse_args()
+    if args.backend == 'memory' and not args.export:
+        raise SystemExit("In-memory data only lasts for the process; export it with --export, "
+                         "or use it through benchmarks.micro or benchmarks.load instead.")
+    app = make_app(args)
+    start = time.perf_counter()
+    summary = generate_from_args(app, args)
+    print(f"Generated {summary['users']} users, {summary['posts']} posts, {summary['likes']} likes, "
+          f"{summary['comments']} comments in {time.perf_counter() - start:.1f}s")
+    if args.export:
+        from flaskr.backup import export_data
+        with app.app_context():
+            manifest = export_data(args.export, meta=summary)
+        print(f"Exported {sum(entry['count'] for entry in manifest['collections'].values())} documents "
+              f"to {args.export}")
+
+
+if __name__ == '__main__':
+    main()
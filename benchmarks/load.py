@@ -0,0 +1,185 @@
+"""
+Concurrent load driver. Worker threads issue a weighted mix of requests
+(listing, search, view, like) for a fixed duration and report throughput and
+p50/p95/p99 latency per request type.
+
+In-process, against the deterministic data set (WSGI, no network):
+
+    python -m benchmarks.load --backend memory --workers 8 --duration 20 --output load.json
+
+Against a running server already loaded with benchmarks.data:
+
+    python -m benchmarks.load --url http://localhost:5000 --workers 32 --duration 60
+"""
+import argparse
+import http.cookiejar
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+from benchmarks.common import add_backend_args, make_app, print_table, save_results, summarize
+from benchmarks.data import PASSWORD, add_data_args, generate_from_args
+
+# (name, weight, needs login)
+MIX = [
+    ('index', 40, False),
+    ('index[popularity]', 10, False),
+    ('search', 10, False),
+    ('view', 30, False),
+    ('like', 10, True),
+]
+
+
+def pick_request(rng, data, mix=MIX):
+    name = rng.choices([name for name, _, _ in mix], weights=[weight for _, weight, _ in mix])[0]
+    # Views follow the same skew as likes: the hot post and its neighbours dominate
+    post_id = data['post_ids'][min(int(rng.paretovariate(1.2)) - 1, len(data['post_ids']) - 1)]
+    if name == 'index':
+        return name, 'GET', '/'
+    if name == 'index[popularity]':
+        return name, 'GET', '/?sort=popularity'
+    if name == 'search':
+        return name, 'GET', '/?' + urllib.parse.urlencode({'q': rng.choice(['matrix', 'enzyme', 'recursion', 'treaty'])})
+    if name == 'view':
+        return name, 'GET', f'/post/{post_id}/view'
+    return name, 'POST', f'/post/{post_id}/like'
+
+
+class WSGIClient:
+    """
+    Drives the app in-process through Flask's test client
+    """
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self, username, password):
+        self.client.post('/auth/login', data={'username': username, 'password': password})
+        # Follow the redirect like a browser; it caches the user in the session
+        self.client.get('/')
+
+    def request(self, method, path):
+        return self.client.open(path, method=method).status_code
+
+
+class HTTPClient:
+    """
+    Drives a running server over HTTP, keeping its session cookie
+    """
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+
+    def login(self, username, password):
+        self.request('POST', '/auth/login', {'username': username, 'password': password})
+        self.request('GET', '/')
+
+    def request(self, method, path, form=None):
+        body = urllib.parse.urlencode(form or {}).encode() if method == 'POST' else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def worker(index, make_client, data, args, deadline, results, lock, mix=MIX):
+    rng = random.Random(args.seed * 1000 + index)
+    client = make_client()
+    if any(needs_login for _, _, needs_login in mix):
+        client.login(f"student{index % args.users:05d}", PASSWORD)
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    while time.perf_counter() < deadline:
+        name, method, path = pick_request(rng, data, mix)
+        start = time.perf_counter()
+        try:
+            status = client.request(method, path)
+        except Exception:
+            status = None
+        timings[name].append(time.perf_counter() - start)
+        if status is None or status >= 400:
+            errors[name] += 1
+    with lock:
+        for name, values in timings.items():
+            results['timings'][name].extend(values)
+        for name, count in errors.items():
+            results['errors'][name] += count
+
+
+def run_load(make_client, data, args, mix=MIX):
+    results = {'timings': defaultdict(list), 'errors': defaultdict(int)}
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=worker, args=(i, make_client, data, args, deadline, results, lock, mix))
+               for i in range(args.workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return summarize_load(results, elapsed)
+
+
+def summarize_load(results, elapsed):
+    summary = {name: {**summarize(values, elapsed), 'errors': results['errors'][name]}
+               for name, values in sorted(results['timings'].items())}
+    everything = [value for values in results['timings'].values() for value in values]
+    summary['total'] = {**summarize(everything, elapsed), 'errors': sum(results['errors'].values())}
+    return summary
+
+
+def discover(base_url, args):
+    """
+    Post ids for a running server, read back from the same database it uses
+    """
+    from pymongo import MongoClient
+
+    db = MongoClient(args.uri)[args.db]
+    post_ids = [str(post['_id']) for post in db.posts.find({}, {'_id': 1}).sort('likes', -1).limit(10000)]
+    if not post_ids:
+        raise SystemExit(f"No posts in {args.db}; load it first with python -m benchmarks.data")
+    return {'post_ids': post_ids}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_backend_args(parser)
+    add_data_args(parser)
+    parser.add_argument('--url', help="Base URL of a running server; default runs the app in-process.")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run.")
+    parser.add_argument('--response-cache', action='store_true',
+                        help="Leave the response cache on for in-process runs.")
+    parser.add_argument('--output', help="Save the results as JSON to this path.")
+    args = parser.parse_args()
+
+    if args.url:
+        data = discover(args.url, args)
+        make_client = lambda: HTTPClient(args.url)
+    else:
+        app = make_app(args, RESPONSE_CACHE=args.response_cache)
+        data = generate_from_args(app, args)
+        make_client = lambda: WSGIClient(app)
+
+    print(f"Running {args.workers} workers for {args.duration:.0f}s...")
+    results = run_load(make_client, data, args)
+    print_table(results)
+    if args.output:
+        save_results(args.output, 'load', args, results)
+
+
+if __name__ == '__main__':
+    main()
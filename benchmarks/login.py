@@ -0,0 +1,83 @@
+"""
+Benchmark the auth.login user lookup as the user count grows, comparing the
+old case-insensitive $regex lookup with the normalized-key index seek.
+
+    python -m benchmarks.login --uri mongodb://localhost:27017 --sizes 1000 10000 100000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from pymongo import MongoClient
+
+from flaskr.auth import normalize_key
+from flaskr.db import INDEXES
+
+
+def seed(db, count):
+    db.users.drop()
+    for index in INDEXES['users']:
+        options = {key: value for key, value in index.items() if key != 'keys'}
+        db.users.create_index(index['keys'], **options)
+    batch = []
+    for i in range(count):
+        username = f"Student{i:07d}"
+        email = f"student{i:07d}@example.edu"
+        batch.append({'username': username, 'email': email,
+                      'username_lower': normalize_key(username), 'email_lower': normalize_key(email),
+                      'password': 'not-a-real-hash'})
+        if len(batch) == 5000:
+            db.users.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.users.insert_many(batch, ordered=False)
+
+
+def regex_lookup(db, login):
+    return db.users.find_one({"$or": [
+        {"username": {"$regex": f"^{login}$", "$options": "i"}},
+        {"email": {"$regex": f"^{login}$", "$options": "i"}}]})
+
+
+def key_lookup(db, login):
+    login_key = normalize_key(login)
+    return db.users.find_one({"$or": [{"username_lower": login_key}, {"email_lower": login_key}]})
+
+
+def time_lookups(db, logins, lookup):
+    timings = []
+    for login in logins:
+        start = time.perf_counter()
+        lookup(db, login)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default='mongodb://localhost:27017')
+    parser.add_argument('--db', default='studyshare_bench')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)[args.db]
+    rng = random.Random(args.seed)
+
+    print(f"{'users':>10}{'regex p50 ms':>15}{'key p50 ms':>15}")
+    for size in args.sizes:
+        seed(db, size)
+        # Mixed-case usernames and emails, plus some unknown logins
+        logins = []
+        for _ in range(args.lookups):
+            i = rng.randrange(size * 11 // 10)
+            logins.append(f"STUDENT{i:07d}" if rng.random() < 0.5 else f"Student{i:07d}@Example.edu")
+        regex_times = time_lookups(db, logins, regex_lookup)
+        key_times = time_lookups(db, logins, key_lookup)
+        print(f"{size:>10}{statistics.median(regex_times):>15.3f}{statistics.median(key_times):>15.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Micro-benchmarks of the hot paths: serialize_post, Markdown rendering,
+post.index under each sort, the facet counts, autocomplete, post.view on a
+long comment thread, like_post and auth.login. Data comes from benchmarks.data with a fixed seed, so runs
+on the same machine are comparable (see benchmarks.compare).
+
+    python -m benchmarks.micro --backend memory --posts 2000 --output micro.json
+    python -m benchmarks.micro --uri mongodb://localhost:27017 --iterations 200
+"""
+import argparse
+import random
+
+from benchmarks.common import add_backend_args, make_app, print_table, run_timed, save_results, summarize
+from benchmarks.data import add_data_args, generate_from_args, make_note
+
+INDEX_QUERIES = {
+    'index[created_at]': '/?sort=created_at',
+    'index[title]': '/?sort=title',
+    'index[popularity]': '/?sort=popularity',
+    'index[trending]': '/?sort=trending',
+    'index[relevance]': '/?sort=relevance&q=matrix',
+    'index[search]': '/?q=recursion',
+    'index[tags]': '/?tags=python&tags=exam&require_all_tags=true',
+}
+
+FACET_QUERIES = {
+    'facets': '/post/facets',
+    'facets[category]': '/post/facets?category=Math',
+    'facets[tag]': '/post/facets?tags=python',
+}
+
+AUTOCOMPLETE_QUERIES = {
+    'autocomplete[tags]': '/post/autocomplete?q=p&kind=tags',
+    'autocomplete[titles]': '/post/autocomplete?q=matr&kind=titles',
+}
+
+
+def login(client, credentials):
+    response = client.post('/auth/login', data=credentials)
+    assert response.status_code == 302, "benchmark login failed"
+    # Follow the redirect like a browser; it caches the user in the session
+    client.get(response.headers['Location'])
+
+
+def checked_get(client, url, headers=None):
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200, f"{url} returned {response.status_code}"
+    return response
+
+
+def bench_serialize(app, data, iterations):
+    from flaskr.post import serialize_post
+    from flaskr.storage import get_storage
+
+    with app.app_context():
+        posts = list(get_storage().posts.find({}, limit=100))
+    i = iter(range(10 ** 9))
+    return run_timed(lambda: serialize_post(posts[next(i) % len(posts)]), iterations)
+
+
+def bench_render(app, data, iterations, code_blocks):
+    from flaskr.render import block_cache, render_markdown
+
+    note = make_note(random.Random(code_blocks), code_blocks)
+
+    def render():
+        block_cache.clear()
+        render_markdown(note)
+    return run_timed(render, iterations)
+
+
+def bench_index(app, data, iterations, url):
+    client = app.test_client()
+    return run_timed(lambda: checked_get(client, url), iterations)
+
+
+def bench_view(app, data, iterations, cold, headers=None):
+    from flaskr.render import html_cache
+
+    client = app.test_client()
+    url = f"/post/{data['hot_post_id']}/view"
+
+    def view():
+        if cold:
+            html_cache.clear()
+        checked_get(client, url, headers)
+    return run_timed(view, iterations)
+
+
+def bench_comments_page(app, data, iterations):
+    client = app.test_client()
+    first = checked_get(client, f"/post/{data['hot_post_id']}/comments").get_json()
+    url = first['next']
+    return run_timed(lambda: checked_get(client, url), iterations)
+
+
+def bench_like(app, data, iterations, seed):
+    client = app.test_client()
+    login(client, data['login'])
+    rng = random.Random(seed)
+    post_ids = data['post_ids']
+
+    def like():
+        response = client.post(f"/post/{rng.choice(post_ids)}/like")
+        assert response.status_code == 302
+    return run_timed(like, iterations)
+
+
+def bench_login(app, data, iterations):
+    def fresh_login():
+        login(app.test_client(), data['login'])
+    return run_timed(fresh_login, iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_backend_args(parser)
+    add_data_args(parser)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--only', nargs='*', help="Run only benchmarks whose name starts with one of these.")
+    parser.add_argument('--output', help="Save the results as JSON to this path.")
+    args = parser.parse_args()
+
+    app = make_app(args)
+    data = generate_from_args(app, args)
+    n = args.iterations
+    from flaskr.autocomplete import get_autocomplete
+    with app.app_context():
+        # What AUTOCOMPLETE_PRELOAD does at startup, over the generated data
+        get_autocomplete().build()
+
+    benchmarks = {
+        'serialize_post': lambda: bench_serialize(app, data, n * 10),
+        'render[plain]': lambda: bench_render(app, data, n, 0),
+        'render[code x6]': lambda: bench_render(app, data, n, 6),
+        **{name: (lambda url=url: bench_index(app, data, n, url))
+           for name, url in {**INDEX_QUERIES, **FACET_QUERIES, **AUTOCOMPLETE_QUERIES}.items()},
+        'view[hot thread]': lambda: bench_view(app, data, n, cold=False),
+        'view[hot thread, cold render]': lambda: bench_view(app, data, n, cold=True),
+        'view[hot thread, compressed]': lambda: bench_view(app, data, n, cold=False,
+                                                           headers={'Accept-Encoding': 'br, gzip'}),
+        'comments[next page]': lambda: bench_comments_page(app, data, n),
+        'like_post': lambda: bench_like(app, data, n, args.seed),
+        'auth.login': lambda: bench_login(app, data, max(n // 5, 5)),
+    }
+
+    results = {}
+    for name, bench in benchmarks.items():
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        try:
+            results[name] = summarize(bench())
+        except Exception as e:
+            # e.g. relevance sort on a mongod without the text index
+            print(f"  {name}: skipped ({type(e).__name__}: {e})")
+            continue
+        print(f"  {name}: p50 {results[name]['p50_ms']:.2f} ms")
+
+    print()
+    print_table(results)
+    if args.output:
+        save_results(args.output, 'micro', args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Benchmark the related notes job (flask build-related) and its incremental
+path on synthetic corpora: Zipf-distributed words around a few hundred
+topics, so posts have realistic vocabularies and real neighbours.
+
+    python -m benchmarks.related --backend memory --posts 10000 100000
+    python -m benchmarks.related --uri mongodb://localhost:27017 --posts 10000 --trace-memory
+
+The job's peak memory is the growth of the process's maximum RSS, or with
+--trace-memory the peak of Python and NumPy allocations (slower).
+"""
+import argparse
+import itertools
+import random
+import resource
+import time
+import tracemalloc
+
+from benchmarks.common import add_backend_args, make_app, print_table, run_timed, save_results, summarize
+from benchmarks.data import BASE_TIME, BATCH_SIZE, TAGS, zipf_weights
+
+VOCABULARY = 30000
+TOPICS = 300
+TOPIC_WORDS = 40
+
+
+def make_words(rng, count):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(4, 10))))
+    return sorted(words)
+
+
+def seed(storage, posts, seed_value):
+    """
+    Replace the posts with a synthetic corpus: each post mixes words of its
+    topic with words drawn from the whole (Zipf-weighted) vocabulary
+    """
+    from bson.objectid import ObjectId
+    from datetime import timedelta
+
+    rng = random.Random(seed_value)
+    words = make_words(rng, VOCABULARY)
+    cum_weights = list(itertools.accumulate(zipf_weights(VOCABULARY)))
+    topics = [rng.sample(words, TOPIC_WORDS) for _ in range(TOPICS)]
+    storage.drop()
+    storage.init()
+
+    def docs():
+        for i in range(posts):
+            topic = topics[rng.randrange(TOPICS)]
+            body = rng.choices(words, cum_weights=cum_weights, k=rng.randint(80, 400))
+            body += rng.choices(topic, k=rng.randint(10, 40))
+            rng.shuffle(body)
+            created_at = BASE_TIME + timedelta(minutes=i)
+            yield {
+                '_id': ObjectId.from_datetime(created_at),
+                'title': ' '.join(rng.sample(topic, 3)).title(),
+                'content': ' '.join(body),
+                'category': 'General',
+                'creator_id': 'benchmark',
+                'created_at': created_at,
+                'updated_at': created_at,
+                'tags': rng.sample(TAGS, rng.randint(1, 3)),
+                'likes': 0,
+                'comments': 0,
+            }
+    storage.posts.insert_many(docs(), ordered=False, batch_size=BATCH_SIZE)
+    return topics
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_build(storage, trace_memory):
+    from flaskr.related import build_related
+
+    rss_before = max_rss_mb()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    posts, terms = build_related(storage)
+    elapsed = time.perf_counter() - start
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    else:
+        peak_mb = max_rss_mb() - rss_before
+    return {'posts': posts, 'terms': terms, 'seconds': elapsed, 'peak_mb': peak_mb}
+
+
+def bench_update(storage, topics, iterations, seed_value):
+    """
+    Time update_related for new posts on existing topics
+    """
+    from flaskr.related import update_related
+
+    rng = random.Random(seed_value + 1)
+
+    def update():
+        topic = rng.choice(topics)
+        post = {'title': ' '.join(rng.sample(topic, 3)), 'content': ' '.join(rng.choices(topic, k=60)),
+                'tags': [rng.choice(TAGS)]}
+        post_id = storage.posts.insert(dict(post, created_at=BASE_TIME, updated_at=BASE_TIME))
+        update_related(storage, post_id, post)
+    return run_timed(update, iterations)
+
+
+def bench_read(storage, iterations, seed_value):
+    """
+    Time reading a post's related notes, as the view does
+    """
+    from flaskr.related import related_posts
+
+    rng = random.Random(seed_value + 2)
+    posts = storage.posts.find({}, {'related': 1}, limit=1000)
+    return run_timed(lambda: related_posts(storage, rng.choice(posts)), iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_backend_args(parser)
+    parser.add_argument('--posts', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--trace-memory', action='store_true', help="Measure peak allocations with tracemalloc.")
+    parser.add_argument('--output', help="Save the results as JSON to this path.")
+    args = parser.parse_args()
+
+    from flaskr.storage import get_storage
+
+    app = make_app(args)
+    jobs = {}
+    results = {}
+    for posts in args.posts:
+        with app.app_context():
+            storage = get_storage()
+            start = time.perf_counter()
+            topics = seed(storage, posts, args.seed)
+            print(f"Seeded {posts} posts in {time.perf_counter() - start:.1f}s")
+
+            job = jobs[f"build[{posts}]"] = bench_build(storage, args.trace_memory)
+            print(f"  build[{posts}]: {job['seconds']:.1f}s, peak {job['peak_mb']:.0f} MB, {job['terms']} terms")
+            results[f"update[{posts}]"] = summarize(bench_update(storage, topics, args.iterations, args.seed))
+            results[f"read[{posts}]"] = summarize(bench_read(storage, args.iterations, args.seed))
+
+    print()
+    print(f"{'job':<32}{'posts':>9}{'terms':>9}{'seconds':>10}{'peak MB':>10}")
+    for name, job in jobs.items():
+        print(f"{name:<32}{job['posts']:>9}{job['terms']:>9}{job['seconds']:>10.1f}{job['peak_mb']:>10.0f}")
+    print()
+    print_table(results)
+    if args.output:
+        save_results(args.output, 'related', args, {**results, **jobs})
+
+
+if __name__ == '__main__':
+    main()
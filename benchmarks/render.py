@@ -0,0 +1,99 @@
+"""
+Benchmark block-by-block Markdown rendering on long, code-heavy notes
+against rendering them whole: a cold render serially and in the render
+pool, and a one-character edit of a note whose blocks are cached. Every
+output is checked to be byte-identical to markdown.markdown().
+
+    python -m benchmarks.render --code-blocks 20 50 100 --workers 4
+"""
+import argparse
+import random
+
+import markdown
+
+from benchmarks.common import print_table, run_timed, save_results, summarize
+from benchmarks.data import make_note
+
+
+def check(content):
+    from flaskr.render import MARKDOWN_EXTENSIONS, render_markdown
+
+    assert render_markdown(content) == markdown.markdown(content, extensions=MARKDOWN_EXTENSIONS), \
+        "block rendering differs from the whole-note rendering"
+
+
+def bench_whole(content, iterations):
+    from flaskr.render import MARKDOWN_EXTENSIONS
+
+    return run_timed(lambda: markdown.markdown(content, extensions=MARKDOWN_EXTENSIONS), iterations)
+
+
+def bench_cold(content, iterations, workers):
+    from flaskr.render import block_cache, render_markdown, render_pool
+
+    render_pool.workers = workers
+
+    def cold():
+        block_cache.clear()
+        render_markdown(content)
+    return run_timed(cold, iterations)
+
+
+def bench_edit(content, iterations, workers, seed):
+    """
+    Render the note after a one-character edit in a random code block, with
+    the note's other blocks cached (as after the edit page's first render)
+    """
+    from flaskr.render import block_cache, render_markdown, render_pool
+
+    render_pool.workers = workers
+    block_cache.clear()
+    render_markdown(content)
+    rng = random.Random(seed)
+    lines = content.split('\n')
+    code_lines = [i for i, line in enumerate(lines) if line.startswith('    ')]
+
+    def edit():
+        i = rng.choice(code_lines)
+        edited = lines[:i] + [lines[i] + ' '] + lines[i + 1:]
+        render_markdown('\n'.join(edited))
+    return run_timed(edit, iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--code-blocks', type=int, nargs='+', default=[20, 50, 100])
+    parser.add_argument('--workers', type=int, default=4, help="Render pool processes for the pooled runs.")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Save the results as JSON to this path.")
+    args = parser.parse_args()
+
+    from flaskr.render import render_pool
+
+    results = {}
+    try:
+        for code_blocks in args.code_blocks:
+            content = make_note(random.Random(args.seed + code_blocks), code_blocks)
+            check(content)
+            print(f"Note with {code_blocks} code blocks: {len(content)} characters")
+            runs = {
+                f"whole[{code_blocks}]": lambda: bench_whole(content, args.iterations),
+                f"blocks cold[{code_blocks}]": lambda: bench_cold(content, args.iterations, 0),
+                f"blocks cold, pool[{code_blocks}]": lambda: bench_cold(content, args.iterations, args.workers),
+                f"edit[{code_blocks}]": lambda: bench_edit(content, args.iterations, 0, args.seed),
+            }
+            for name, bench in runs.items():
+                results[name] = summarize(bench())
+                print(f"  {name}: p50 {results[name]['p50_ms']:.2f} ms")
+    finally:
+        render_pool.shutdown()
+
+    print()
+    print_table(results)
+    if args.output:
+        save_results(args.output, 'render', args, results)
+
+
+if __name__ == '__main__':
+    main()
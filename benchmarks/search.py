@@ -0,0 +1,99 @@
+"""
+Benchmark the gram-indexed substring search against the old unanchored
+$regex scan on a synthetic corpus.
+
+    python -m benchmarks.search --uri mongodb://localhost:27017 --posts 20000
+"""
+import argparse
+import random
+import re
+import statistics
+import time
+
+from pymongo import MongoClient
+
+from flaskr.search import contains_filter, search_fields
+
+WORDS = ("algebra calculus derivative integral matrix vector eigenvalue theorem proof lemma "
+         "photosynthesis mitochondria enzyme protein genome chromosome neuron synapse "
+         "python function variable recursion pointer compiler runtime closure iterator "
+         "revolution empire treaty parliament monarchy dynasty renaissance industrial "
+         "entropy momentum velocity acceleration quantum photon electron magnetic").split()
+
+
+def make_post(rng, i):
+    title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).title()
+    paragraphs = []
+    for _ in range(rng.randint(3, 12)):
+        paragraphs.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))))
+    content = '\n\n'.join(paragraphs) + f"\n\nnote-{i:07d}"
+    return {'title': title, 'content': content, **search_fields(title, content)}
+
+
+def seed(db, count, seed_value):
+    rng = random.Random(seed_value)
+    db.posts.drop()
+    batch = []
+    for i in range(count):
+        batch.append(make_post(rng, i))
+        if len(batch) == 1000:
+            db.posts.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.posts.insert_many(batch, ordered=False)
+    db.posts.create_index([('search_grams', 1)])
+
+
+def regex_filter(query):
+    escaped_query = re.escape(query)
+    return {'$or': [
+        {'title': {'$regex': escaped_query, '$options': 'i'}},
+        {'content': {'$regex': escaped_query, '$options': 'i'}}
+    ]}
+
+
+def time_queries(db, queries, build_filter, limit):
+    timings = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        ids = [doc['_id'] for doc in db.posts.find(build_filter(query), {'_id': 1}).limit(limit)]
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append(sorted(ids))
+    return timings, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default='mongodb://localhost:27017')
+    parser.add_argument('--db', default='studyshare_bench')
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--limit', type=int, default=0, help="Result limit per query (0 for all matches).")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skip-seed', action='store_true', help="Reuse the corpus from a previous run.")
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)[args.db]
+    if not args.skip_seed:
+        start = time.perf_counter()
+        seed(db, args.posts, args.seed)
+        print(f"Seeded {args.posts} posts in {time.perf_counter() - start:.1f}s")
+
+    # Rare (unique ids), mid-frequency (word fragments) and short queries
+    queries = [f"note-{i:07d}" for i in range(0, args.posts, max(args.posts // 10, 1))]
+    queries += ['eigenval', 'chondria', 'recurs', 'Quantum Photon', 'xyzzy', 'ne', 'q']
+
+    regex_times, regex_results = time_queries(db, queries, regex_filter, args.limit)
+    gram_times, gram_results = time_queries(db, queries, contains_filter, args.limit)
+
+    if args.limit == 0:
+        assert regex_results == gram_results, "gram search returned different posts than $regex"
+
+    print(f"{'query':<18}{'regex ms':>12}{'grams ms':>12}{'matches':>10}")
+    for query, r, g_, ids in zip(queries, regex_times, gram_times, gram_results):
+        print(f"{query:<18}{r:>12.2f}{g_:>12.2f}{len(ids):>10}")
+    print(f"{'median':<18}{statistics.median(regex_times):>12.2f}{statistics.median(gram_times):>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
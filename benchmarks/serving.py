@@ -0,0 +1,155 @@
+"""
+Sync vs async serving. Runs the read-only part of the load mix (listings,
+search and post views, anonymous) against one worker process twice: the
+Flask WSGI app driven by --workers threads, then the ASGI app from
+flaskr.asgi with --workers concurrent requests on one event loop. Reports
+requests/sec and latency for each.
+
+    python -m benchmarks.serving --backend mongod --workers 32 --duration 30 --output serving.json
+
+The memory backend answers instantly, which hides what the async path is for;
+--db-latency-ms adds a simulated round trip to every storage call:
+
+    python -m benchmarks.serving --backend memory --db-latency-ms 2
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+from benchmarks.common import add_backend_args, make_app, print_table, save_results
+from benchmarks.data import add_data_args, generate_from_args
+from benchmarks.load import MIX, WSGIClient, pick_request, run_load, summarize_load
+from flaskr.asgi import create_asgi_app
+from flaskr.storage import BACKENDS, register_backend
+
+READ_MIX = [entry for entry in MIX if not entry[2]]
+
+
+class ASGIClient:
+    """
+    Sends requests straight into an ASGI app, as a server would
+    """
+    def __init__(self, asgi):
+        self.asgi = asgi
+
+    async def request(self, method, path):
+        path, _, query = path.partition('?')
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+                 'headers': [(b'host', b'localhost')], 'http_version': '1.1', 'scheme': 'http',
+                 'server': ('localhost', 80)}
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        status = []
+
+        async def receive():
+            return messages.pop() if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await self.asgi(scope, receive, send)
+        return status[0]
+
+
+async def async_worker(index, client, data, args, deadline, results):
+    rng = random.Random(args.seed * 1000 + index)
+    while time.perf_counter() < deadline:
+        name, method, path = pick_request(rng, data, READ_MIX)
+        start = time.perf_counter()
+        try:
+            status = await client.request(method, path)
+        except Exception:
+            status = None
+        results['timings'][name].append(time.perf_counter() - start)
+        if status is None or status >= 400:
+            results['errors'][name] += 1
+
+
+async def run_async_load(asgi, data, args):
+    results = {'timings': defaultdict(list), 'errors': defaultdict(int)}
+    client = ASGIClient(asgi)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(async_worker(i, client, data, args, deadline, results) for i in range(args.workers)))
+    return summarize_load(results, time.perf_counter() - start)
+
+
+class SlowRepository:
+    """
+    Repository wrapper that sleeps for a simulated database round trip on every call
+    """
+    def __init__(self, repository, latency):
+        self.repository = repository
+        self.latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self.repository, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self.latency)
+            return attr(*args, **kwargs)
+        return call
+
+
+class SlowStorage:
+    REPOSITORIES = ('users', 'posts', 'comments', 'likes', 'categories', 'generations')
+
+    def __init__(self, storage, latency):
+        self.storage = storage
+        for name in self.REPOSITORIES:
+            setattr(self, name, SlowRepository(getattr(storage, name), latency))
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+
+def add_latency(app, latency_ms):
+    """
+    Point the app at its storage backend wrapped with simulated round trips
+    """
+    backend = app.config['STORAGE_BACKEND']
+    factory = BACKENDS[backend]
+    register_backend(f'{backend}+latency', lambda app: SlowStorage(factory(app), latency_ms / 1000))
+    app.config['STORAGE_BACKEND'] = f'{backend}+latency'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_backend_args(parser)
+    add_data_args(parser)
+    parser.add_argument('--workers', type=int, default=16,
+                        help="Threads for the sync app, concurrent requests for the async one.")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run each app.")
+    parser.add_argument('--db-latency-ms', type=float, default=0.0,
+                        help="Simulated round trip added to every storage call.")
+    parser.add_argument('--output', help="Save the results as JSON to this path.")
+    args = parser.parse_args()
+
+    app = make_app(args, ASYNC_IO_WORKERS=max(32, args.workers * 2))
+    data = generate_from_args(app, args)
+    if args.db_latency_ms:
+        add_latency(app, args.db_latency_ms)
+
+    print(f"Sync: {args.workers} threads for {args.duration:.0f}s...")
+    sync = run_load(lambda: WSGIClient(app), data, args, READ_MIX)
+    print_table(sync)
+
+    print(f"Async: {args.workers} concurrent requests for {args.duration:.0f}s...")
+    async_results = asyncio.run(run_async_load(create_asgi_app(app), data, args))
+    print_table(async_results)
+
+    sync_rate, async_rate = sync['total']['ops_per_sec'], async_results['total']['ops_per_sec']
+    print(f"requests/sec per worker: sync {sync_rate:.1f}, async {async_rate:.1f} "
+          f"({async_rate / sync_rate if sync_rate else 0:.2f}x)")
+    if args.output:
+        results = {f'sync.{name}': value for name, value in sync.items()}
+        results.update({f'async.{name}': value for name, value in async_results.items()})
+        save_results(args.output, 'serving', args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,20 +9,134 @@ config = configparser.ConfigParser()
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # Get the StudyShare directory
 config.read(os.path.join(base_dir, ".ini"))  # Read the .ini file
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__)
     app.config['DEBUG'] = True
     app.config['MONGO_URI'] = config['PROD']['DB_URI']
     app.config['DB_NAME'] = config['PROD']['DB_NAME']
     
+    # Connection pool settings for the process-wide MongoClient
+    prod = config['PROD']
+    app.config['STORAGE_BACKEND'] = prod.get('STORAGE_BACKEND', fallback='mongo')
+    app.config['MONGO_MAX_POOL_SIZE'] = prod.getint('DB_MAX_POOL_SIZE', fallback=100)
+    app.config['MONGO_MIN_POOL_SIZE'] = prod.getint('DB_MIN_POOL_SIZE', fallback=0)
+    app.config['MONGO_MAX_IDLE_TIME_MS'] = prod.getint('DB_MAX_IDLE_TIME_MS', fallback=None)
+    app.config['MONGO_WAIT_QUEUE_TIMEOUT_MS'] = prod.getint('DB_WAIT_QUEUE_TIMEOUT_MS', fallback=None)
+    app.config['MONGO_CONNECT_TIMEOUT_MS'] = prod.getint('DB_CONNECT_TIMEOUT_MS', fallback=20000)
+    app.config['MONGO_SOCKET_TIMEOUT_MS'] = prod.getint('DB_SOCKET_TIMEOUT_MS', fallback=None)
+    app.config['MONGO_SERVER_SELECTION_TIMEOUT_MS'] = prod.getint('DB_SERVER_SELECTION_TIMEOUT_MS', fallback=30000)
+    app.config['MONGO_READ_CONCERN'] = prod.get('DB_READ_CONCERN', fallback=None)
+    app.config['MONGO_WRITE_CONCERN'] = prod.get('DB_WRITE_CONCERN', fallback=None)
+    app.config['MONGO_WRITE_TIMEOUT_MS'] = prod.getint('DB_WRITE_TIMEOUT_MS', fallback=None)
+    
+    # Number of posts per page on the post index, and comments per page on a post
+    app.config['POSTS_PER_PAGE'] = prod.getint('POSTS_PER_PAGE', fallback=20)
+    app.config['COMMENTS_PER_PAGE'] = prod.getint('COMMENTS_PER_PAGE', fallback=20)
+    
+    # Size limit for the in-process cache of rendered note HTML
+    app.config['RENDER_CACHE_BYTES'] = prod.getint('RENDER_CACHE_BYTES', fallback=32 * 1024 * 1024)
+    
+    # Size limit for the cache of rendered blocks of notes, and processes that
+    # render the blocks of long notes in parallel (0 renders in the request)
+    app.config['RENDER_BLOCK_CACHE_BYTES'] = prod.getint('RENDER_BLOCK_CACHE_BYTES', fallback=16 * 1024 * 1024)
+    app.config['RENDER_WORKERS'] = prod.getint('RENDER_WORKERS', fallback=2)
+    
+    # Seconds reference data (categories) is served from memory before rechecking its generation
+    app.config['REFERENCE_CACHE_TTL'] = prod.getint('REFERENCE_CACHE_TTL', fallback=60)
+    
+    # Optional write-behind buffer that coalesces like counter updates
+    app.config['COUNTER_BUFFER'] = prod.getboolean('COUNTER_BUFFER', fallback=False)
+    app.config['COUNTER_BUFFER_INTERVAL'] = prod.getfloat('COUNTER_BUFFER_INTERVAL', fallback=1.0)
+    app.config['COUNTER_BUFFER_SIZE'] = prod.getint('COUNTER_BUFFER_SIZE', fallback=100)
+    
+    # Delete a deleted post's comments and likes in batches of this size, in the
+    # request or, with CASCADE_DELETE_QUEUE, on a background thread
+    app.config['CASCADE_DELETE_QUEUE'] = prod.getboolean('CASCADE_DELETE_QUEUE', fallback=False)
+    app.config['CASCADE_DELETE_INTERVAL'] = prod.getfloat('CASCADE_DELETE_INTERVAL', fallback=1.0)
+    app.config['CASCADE_DELETE_BATCH_SIZE'] = prod.getint('CASCADE_DELETE_BATCH_SIZE', fallback=1000)
+    
+    # Response cache for anonymous listing pages: in-process LRU plus an optional shared tier
+    app.config['RESPONSE_CACHE'] = prod.getboolean('RESPONSE_CACHE', fallback=True)
+    app.config['RESPONSE_CACHE_SIZE'] = prod.getint('RESPONSE_CACHE_SIZE', fallback=256)
+    app.config['RESPONSE_CACHE_TTL'] = prod.getint('RESPONSE_CACHE_TTL', fallback=300)
+    app.config['RESPONSE_CACHE_BACKEND'] = prod.get('RESPONSE_CACHE_BACKEND', fallback='')
+    
+    # Tag and title autocomplete: entries kept per worker for each of tags and
+    # titles, seconds between checks for posts changed by other workers, and
+    # whether to build the index in the background when the app starts
+    app.config['AUTOCOMPLETE_MAX_ENTRIES'] = prod.getint('AUTOCOMPLETE_MAX_ENTRIES', fallback=100000)
+    app.config['AUTOCOMPLETE_REFRESH'] = prod.getint('AUTOCOMPLETE_REFRESH', fallback=60)
+    app.config['AUTOCOMPLETE_PRELOAD'] = prod.getboolean('AUTOCOMPLETE_PRELOAD', fallback=True)
+    
+    # Hours for a post's likes and comments to count half as much in the trending sort.
+    # Run `flask rescore-trending` after changing it.
+    app.config['TRENDING_HALF_LIFE'] = prod.getfloat('TRENDING_HALF_LIFE', fallback=24.0)
+    
+    # Compress HTML and JSON responses of at least this many bytes (gzip, or brotli
+    # with the brotli package installed), keeping compressed bodies of hot pages
+    app.config['COMPRESS'] = prod.getboolean('COMPRESS', fallback=True)
+    app.config['COMPRESS_MIN_SIZE'] = prod.getint('COMPRESS_MIN_SIZE', fallback=1024)
+    app.config['COMPRESS_CACHE_BYTES'] = prod.getint('COMPRESS_CACHE_BYTES', fallback=8 * 1024 * 1024)
+    
+    # Log the explain() plan of query shapes slower than this many milliseconds (0 disables)
+    app.config['SLOW_QUERY_MS'] = prod.getint('SLOW_QUERY_MS', fallback=0)
+    
+    # Bearer token for /metrics and /metrics/slow-queries (unset disables them)
+    app.config['METRICS_TOKEN'] = prod.get('METRICS_TOKEN', fallback='')
+    
+    # ASGI serving mode (flaskr.asgi): threads for blocking storage calls and
+    # processes for Markdown rendered on reads (0 renders on the I/O threads)
+    app.config['ASYNC_IO_WORKERS'] = prod.getint('ASYNC_IO_WORKERS', fallback=32)
+    app.config['ASYNC_RENDER_WORKERS'] = prod.getint('ASYNC_RENDER_WORKERS', fallback=2)
+    
     # Set the secret keys from environment variables
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
     app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
 
+    # Overrides (tests, benchmarks) go in before the extensions read the config
+    if test_config:
+        app.config.update(test_config)
+
     from . import db
     db.init_app(app)
     
+    from . import metrics
+    metrics.init_app(app)
+    
+    # After metrics, so the request timings include compression
+    from . import compress
+    compress.init_app(app)
+    
+    from . import render
+    render.init_app(app)
+    
+    from . import search
+    search.init_app(app)
+    
+    from . import importer
+    importer.init_app(app)
+    
+    from . import backup
+    backup.init_app(app)
+    
+    from . import cleanup
+    cleanup.init_app(app)
+    
+    from . import facets
+    facets.init_app(app)
+
+    from . import related
+    related.init_app(app)
+
+    from . import trending
+    trending.init_app(app)
+
+    # Last, so the index is built with the rest of the app configured
+    from . import autocomplete
+    autocomplete.init_app(app)
+    
     from . import auth
+    auth.init_app(app)
     app.register_blueprint(auth.bp)
 
     from . import dashboard
@@ -0,0 +1,313 @@
+"""
+ASGI serving mode.
+
+The read-heavy endpoints (the post index and post view) run as coroutines so
+one worker process keeps many requests in flight while they wait on the
+database; every other route, including all writes, runs the regular Flask
+app on a thread pool through a2wsgi. Install the `asgi` extra and run it
+under any ASGI server, for example
+
+    pip install .[asgi]
+    uvicorn --factory flaskr.asgi:create_asgi_app --workers 4
+
+Storage calls are blocking (pymongo has no async API in the versions we
+support), so they run on a bounded I/O thread pool and a view's independent
+fetches are issued together. Markdown that has to be rendered on a read goes
+to a process pool so it doesn't hold up the event loop.
+"""
+import asyncio
+import contextvars
+import functools
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from bson.objectid import ObjectId
+from flask import current_app, g, make_response, request, request_started, session
+from werkzeug.exceptions import HTTPException, abort
+
+from flaskr import post as post_views
+from flaskr.cache import get_response_cache, listing_key
+from flaskr.conditional import add_validators, is_conditional, make_etag, not_modified
+from flaskr.db import POSTS_GENERATION, get_categories, get_generation
+from flaskr.facets import get_facets
+from flaskr.metrics import timed
+from flaskr.pagination import DEFAULT_PAGE_SIZE
+from flaskr.related import related_posts
+from flaskr.render import HTML_PROJECTION, cached_post_html, html_cache, is_current, render_fields
+from flaskr.storage import get_storage
+
+
+class WorkerPools:
+    """
+    Executors for one worker process: threads for blocking storage calls,
+    processes for rendering Markdown
+    """
+    def __init__(self, io_workers, render_workers):
+        self.pid = os.getpid()
+        self.io = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='asgi-io')
+        # Rendering is pure CPU, so threads would only contend for the GIL.
+        # Workers are spawned rather than forked since this process runs threads.
+        self.render = None
+        if render_workers:
+            self.render = ProcessPoolExecutor(max_workers=render_workers,
+                                              mp_context=multiprocessing.get_context('spawn'))
+
+    def shutdown(self):
+        self.io.shutdown()
+        if self.render is not None:
+            self.render.shutdown()
+
+
+def get_pools(app=None):
+    """
+    Return this process's worker pools for the app, creating them on first use
+    """
+    app = app or current_app._get_current_object()
+    pools = app.extensions.get('asgi_pools')
+    if pools is None or pools.pid != os.getpid():
+        pools = app.extensions['asgi_pools'] = WorkerPools(app.config.get('ASYNC_IO_WORKERS', 32),
+                                                           app.config.get('ASYNC_RENDER_WORKERS', 2))
+    return pools
+
+
+def run_io(fn, *args, **kwargs):
+    """
+    Run a blocking call on the I/O pool, inside the request's context so it
+    sees g, the session and the request timings
+    """
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(
+        get_pools().io, functools.partial(context.run, fn, *args, **kwargs))
+
+
+def run_cpu(fn, *args):
+    """
+    Run a CPU-bound call on the render pool (or the I/O pool when it is disabled)
+    """
+    pools = get_pools()
+    if pools.render is None:
+        return run_io(fn, *args)
+    return asyncio.get_running_loop().run_in_executor(pools.render, fn, *args)
+
+
+async def index():
+    """
+    Async post.index.
+    The listing page, the categories and the facet counts are fetched at the same time.
+    """
+    generation = await run_io(get_generation, POSTS_GENERATION)
+    etag = make_etag('index', generation, sorted(request.args.items(multi=True)))
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    cache = get_response_cache()
+    if cache is not None and g.user is None and not session.get('_flashes'):
+        # Anonymous pages are identical for everyone, so share them
+        key = f"index:{generation}:{listing_key(request.args)}"
+        html = cache.get_local(key)
+        if html is None:
+            html = await run_io(cache.get_or_compute, key, post_views.render_index)
+    else:
+        html, _ = await render_index()
+    return add_validators(make_response(html), etag)
+
+
+async def render_index():
+    params = post_views.listing_params()
+    posts = get_storage().posts
+    page, categories, facets = await asyncio.gather(run_io(post_views.fetch_index_page, posts, params),
+                                                    run_io(get_categories),
+                                                    run_io(get_facets, params['filters']))
+    return post_views.render_index_page(params, page, categories, facets)
+
+
+async def view(post_id):
+    """
+    Async post.view.
+    The post and its first page of comments are fetched at the same time, then
+    the creator's username and related notes alongside the note's HTML.
+    """
+    storage = get_storage()
+    post_oid = ObjectId(post_id)
+
+    if is_conditional():
+        meta = await run_io(storage.posts.get, post_oid, post_views.VALIDATOR_PROJECTION)
+        if meta is None:
+            abort(404, f"Post id {post_id} doesn't exist.")
+        response = not_modified(*post_views.post_validators(meta))
+        if response is not None:
+            return response
+
+    page_size = current_app.config.get('COMMENTS_PER_PAGE', DEFAULT_PAGE_SIZE)
+    post, page = await asyncio.gather(run_io(storage.posts.get, post_oid, post_views.VIEW_PROJECTION),
+                                      run_io(storage.comments.find_page, post_oid, page_size=page_size))
+    if post is None:
+        abort(404, f"Post id {post_id} doesn't exist.")
+
+    creator, rendered_content, related = await asyncio.gather(run_io(creator_name, storage, post.get('creator_id')),
+                                                              post_html(storage, post),
+                                                              run_io(related_posts, storage, post))
+    return post_views.render_view(post_id, post, creator, page, rendered_content, related)
+
+
+def creator_name(storage, creator_id):
+    """
+    Username of a post's creator; creator_id is stored as a string
+    """
+    if not ObjectId.is_valid(creator_id):
+        return None
+    user = storage.users.get(ObjectId(creator_id), {'username': 1})
+    return user.get('username') if user else None
+
+
+async def post_html(storage, post):
+    """
+    Async get_post_html: stale or missing HTML is rendered on the render pool
+    """
+    html = cached_post_html(post)
+    if html is not None:
+        return html
+
+    doc = await run_io(storage.posts.get, post['_id'], HTML_PROJECTION)
+    if doc is None:
+        return ''
+
+    if is_current(doc) and 'content_html' in doc:
+        html = doc['content_html']
+    else:
+        with timed('render'):
+            fields = await run_cpu(render_fields, doc.get('content', ''))
+        await run_io(storage.posts.update, doc['_id'], fields)
+        doc.update(fields)
+        html = fields['content_html']
+
+    html_cache.put(doc['content_hash'], html)
+    return html
+
+
+# Endpoints served by coroutines; everything else goes to the Flask app
+ASYNC_VIEWS = {
+    'post.index': index,
+    'post.view': view,
+}
+
+
+class AsyncApp:
+    """
+    ASGI application around the Flask app.
+    GET/HEAD requests for an endpoint in `views` are dispatched to its
+    coroutine with the usual request context, hooks and error handling;
+    all other requests go to the WSGI app through a2wsgi, on its own thread pool.
+    """
+    def __init__(self, app, views=None):
+        self.app = app
+        self.views = ASYNC_VIEWS if views is None else views
+        self.wsgi = WSGIMiddleware(app, workers=app.config.get('ASYNC_IO_WORKERS', 32))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+        environ = build_environ(scope, io.BytesIO())
+        view, view_args = self._match(environ)
+        if view is None:
+            return await self.wsgi(scope, receive, send)
+
+        environ['wsgi.input'] = io.BytesIO(await read_body(receive))
+        status, headers, body = await self._dispatch(environ, view, view_args)
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    def _match(self, environ):
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return None, None
+        try:
+            endpoint, view_args = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            # Redirects, 404s and 405s are left to Flask
+            return None, None
+        return self.views.get(endpoint), view_args
+
+    async def _dispatch(self, environ, view, view_args):
+        """
+        Flask's wsgi_app and full_dispatch_request, awaiting the view.
+        Before/after request hooks, error handlers, the session save and the
+        teardown callbacks all run as they would for the sync view.
+        """
+        app = self.app
+        ctx = app.request_context(environ)
+        error = None
+        try:
+            try:
+                ctx.push()
+                try:
+                    request_started.send(app)
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = await view(**view_args)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:
+                error = e
+                response = app.handle_exception(e)
+            app_iter, status, headers = response.get_wsgi_response(environ)
+            try:
+                body = b''.join(app_iter)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            return status, headers, body
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if error is not None and app.should_ignore_error(error):
+                error = None
+            ctx.pop(error)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                pools = self.app.extensions.pop('asgi_pools', None)
+                if pools is not None:
+                    pools.shutdown()
+                self.wsgi.executor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def create_asgi_app(app=None):
+    """
+    ASGI application for the given Flask app, or a new one from create_app
+    """
+    if app is None:
+        from flaskr import create_app
+        app = create_app()
+    return AsyncApp(app)
@@ -1,18 +1,72 @@
+import click
 import functools
 import re
 import datetime
 import jwt
 
 from flask import Blueprint, g, request, render_template, current_app, redirect, url_for, session, flash
-from .db import get_db
+from .storage import get_storage
 from werkzeug.security import generate_password_hash, check_password_hash
-from pymongo.errors import DuplicateKeyError
 from markupsafe import escape
 from bson.objectid import ObjectId
 
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+def normalize_key(value):
+    """
+    Case-insensitive lookup key for a username or email.
+    Stored on users as username_lower/email_lower so lookups are index seeks.
+    """
+    return str(value or '').strip().lower()
+
+def migrate_users(batch_size=500):
+    """
+    Add the normalized lookup keys to users created before they existed.
+    Users whose key collides with another user (same name in a different case)
+    are left without it and returned so they can be fixed by hand.
+    Returns (number migrated, list of conflicting users).
+    """
+    users = get_storage().users
+    taken = {'username_lower': set(), 'email_lower': set()}
+    for user in users.find({}, {'username_lower': 1, 'email_lower': 1}):
+        for field in taken:
+            if user.get(field):
+                taken[field].add(user[field])
+
+    conflicts = []
+    updates = []
+    for user in users.find({'$or': [{'username_lower': {'$exists': False}},
+                                    {'email_lower': {'$exists': False}}]},
+                           {'username': 1, 'email': 1}, batch_size=batch_size):
+        keys = {'username_lower': normalize_key(user.get('username')),
+                'email_lower': normalize_key(user.get('email'))}
+        if any(keys[field] in taken[field] for field in keys):
+            conflicts.append(user)
+            continue
+        for field in keys:
+            taken[field].add(keys[field])
+        updates.append((user['_id'], keys))
+    migrated = users.update_many(updates, batch_size=batch_size)
+    return migrated, conflicts
+
+@click.command('migrate-users')
+def migrate_users_command():
+    """
+    Command line interface to add normalized lookup keys to existing users
+    """
+    migrated, conflicts = migrate_users()
+    click.echo(f'Migrated {migrated} users.')
+    for user in conflicts:
+        click.echo(f"Skipped {user.get('username')} <{user.get('email')}>: "
+                   "username or email differs only in case from another user.")
+
+def init_app(app):
+    """
+    Initialize the Flask application with the user migration command
+    """
+    app.cli.add_command(migrate_users_command)
+
 def redirect_to_login():
     return redirect(url_for('auth.login'))
 
@@ -25,7 +79,7 @@ def login():
     Login a user with username and password.
     """
     if request.method == 'POST':
-        db = get_db()
+        users = get_storage().users
         
         username = escape(request.form.get('username'))
         password = escape(request.form.get('password'))
@@ -37,9 +91,8 @@ def login():
         
         else:
             # Make sure the user exists
-            user = db.users.find_one({"$or": [
-                {"username": {"$regex": f"^{username}$", "$options": "i"}},
-                {"email": {"$regex": f"^{username}$", "$options": "i"}}]})
+            login_key = normalize_key(username)
+            user = users.find_by_keys(login_key, login_key, username=username, email=username)
             
             if user is None:
                 error = "Incorrect username."
@@ -78,7 +131,7 @@ def register():
     Register a new user with username, email, and password.
     """
     if request.method == 'POST':
-        db = get_db()
+        users = get_storage().users
         error = None
         
         username = escape(request.form.get('username'))
@@ -96,12 +149,8 @@ def register():
         
         if error is None:
             # Check if username or email already exists (case-insensitive)
-            existing_user = db.users.find_one({
-                "$or": [
-                    {"username": {"$regex": f"^{username}$", "$options": "i"}},
-                    {"email": {"$regex": f"^{email}$", "$options": "i"}}
-                ]
-            })
+            existing_user = users.find_by_keys(normalize_key(username), normalize_key(email),
+                                               username=username, email=email)
             if existing_user:
                 error = "Username or email already exists."
         
@@ -109,9 +158,11 @@ def register():
         if error is None:
             hashed_password = generate_password_hash(password)
             try:
-                db.users.insert_one({
+                users.insert({
                     "username": username,
                     "email": email,
+                    "username_lower": normalize_key(username),
+                    "email_lower": normalize_key(email),
                     "password": hashed_password
                 })
             except Exception:
@@ -135,8 +186,7 @@ def load_logged_in_user():
         if 'user_data' in session:
             g.user = session['user_data']
         else:
-            db = get_db()
-            g.user = db.users.find_one({"_id": ObjectId(user_id)})
+            g.user = get_storage().users.get(ObjectId(user_id))
             if g.user:
                 session['user_data'] = {
                     'username': g.user['username'],
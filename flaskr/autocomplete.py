@@ -0,0 +1,341 @@
+"""
+Tag and title autocomplete from an in-process prefix index.
+
+Each worker keeps the normalized tags (weighted by how many posts use them)
+and post titles (weighted by likes) in sorted arrays searched with bisect, so
+suggestions never touch the database. The index is built in bulk in the
+background when the app starts (AUTOCOMPLETE_PRELOAD), updated in place by
+this worker's post writes, and rebuilt in the background when another worker
+has changed the posts.
+"""
+import bisect
+import heapq
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from flaskr.db import POSTS_GENERATION, get_generation
+from flaskr.search import normalize
+from flaskr.storage import open_storage
+
+KINDS = ('tags', 'titles')
+SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+# Titles can also be found from the start of each of their first few words
+TITLE_WORDS = 6
+BUILD_BATCH_SIZE = 1000
+
+# Rough per-entry overhead on top of the strings: the tuple, its list slot
+# and its weights dict entry
+ENTRY_OVERHEAD = sys.getsizeof((None, None)) + 8 + 100
+
+
+class PrefixIndex:
+    """
+    Weighted (key, value) entries in a sorted array.
+    complete() finds the entries whose key starts with a prefix by bisecting
+    to the first one and returns the values with the highest weight; answers
+    are memoized until the next change. At most max_entries are kept: a new
+    entry replaces the lightest one only if it is heavier. The lightest entry
+    is found from a min-heap of (weight, entry) pushes, whose stale pushes are
+    skipped when they reach the top.
+    """
+    def __init__(self, max_entries=100000, memo_size=1024):
+        self.max_entries = max_entries
+        self.memo_size = memo_size
+        self.entries = []
+        self.weights = {}
+        self.bytes = 0
+        self.evicted = 0
+        self._heap = []
+        self._memo = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _entry_bytes(entry):
+        return sys.getsizeof(entry[0]) + sys.getsizeof(entry[1]) + ENTRY_OVERHEAD
+
+    def build(self, items):
+        """
+        Replace the contents with (key, value, weight) items, keeping the heaviest
+        """
+        weights = {}
+        for key, value, weight in items:
+            entry = (key, value)
+            weights[entry] = weights.get(entry, 0) + weight
+        if len(weights) > self.max_entries:
+            kept = heapq.nlargest(self.max_entries, weights.items(), key=lambda item: item[1])
+            self.evicted += len(weights) - len(kept)
+            weights = dict(kept)
+        self.weights = weights
+        self.entries = sorted(weights)
+        self.bytes = sum(self._entry_bytes(entry) for entry in self.entries)
+        self._heap = [(weight, entry) for entry, weight in weights.items()]
+        heapq.heapify(self._heap)
+        self._memo.clear()
+
+    def _set_weight(self, entry, weight):
+        self.weights[entry] = weight
+        heapq.heappush(self._heap, (weight, entry))
+        # Every change pushes, so compact once stale pushes dominate
+        if len(self._heap) > 2 * len(self.weights) + 64:
+            self._heap = [(weight, entry) for entry, weight in self.weights.items()]
+            heapq.heapify(self._heap)
+
+    def _lightest(self):
+        heap = self._heap
+        while heap:
+            weight, entry = heap[0]
+            if self.weights.get(entry) == weight:
+                return entry
+            heapq.heappop(heap)
+        return None
+
+    def add(self, key, value, weight):
+        """
+        Add weight to an entry, creating it if needed; entries at or below zero are removed
+        """
+        entry = (key, value)
+        if entry in self.weights:
+            weight += self.weights[entry]
+            if weight <= 0:
+                return self.remove(key, value)
+            self._set_weight(entry, weight)
+        elif weight > 0:
+            if len(self.entries) >= self.max_entries:
+                lightest = self._lightest()
+                if self.weights[lightest] >= weight:
+                    self.evicted += 1
+                    return
+                self.remove(*lightest)
+                self.evicted += 1
+            self._set_weight(entry, weight)
+            bisect.insort(self.entries, entry)
+            self.bytes += self._entry_bytes(entry)
+        self._memo.clear()
+
+    def remove(self, key, value):
+        entry = (key, value)
+        if self.weights.pop(entry, None) is None:
+            return
+        i = bisect.bisect_left(self.entries, entry)
+        del self.entries[i]
+        self.bytes -= self._entry_bytes(entry)
+        self._memo.clear()
+
+    def complete(self, prefix, limit=SUGGESTIONS):
+        """
+        The `limit` heaviest values with a key starting with prefix, as
+        (value, weight) pairs; a value under several keys counts once
+        """
+        memo_key = (prefix, limit)
+        if memo_key in self._memo:
+            self._memo.move_to_end(memo_key)
+            return self._memo[memo_key]
+
+        best = {}
+        i = bisect.bisect_left(self.entries, (prefix,))
+        entries, weights = self.entries, self.weights
+        while i < len(entries) and entries[i][0].startswith(prefix):
+            entry = entries[i]
+            if weights[entry] > best.get(entry[1], 0):
+                best[entry[1]] = weights[entry]
+            i += 1
+        result = heapq.nsmallest(limit, best.items(), key=lambda item: (-item[1], item[0]))
+
+        self._memo[memo_key] = result
+        if len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        return result
+
+
+def title_keys(title):
+    """
+    Keys a title is found under: its normalized text from the start of each of its first words
+    """
+    words = normalize(title).strip().split(' ')
+    return {' '.join(words[i:]) for i in range(min(len(words), TITLE_WORDS)) if words[i]}
+
+
+class Autocomplete:
+    """
+    The tag and title indexes for one worker, with the posts generation they reflect
+    """
+    def __init__(self, app, max_entries=100000, refresh=60):
+        self.app = app
+        self.refresh = refresh
+        self.tags = PrefixIndex(max_entries)
+        self.titles = PrefixIndex(max_entries)
+        self.labels = {}
+        self.generation = None
+        self.built_at = None
+        self.checked_at = 0
+        self.builds = 0
+        self._lock = threading.RLock()
+        self._rebuilding = False
+        self._pid = None
+
+    def build(self, storage=None):
+        """
+        Load every tag count and post title in bulk and swap them in
+        """
+        storage = storage or open_storage(self.app)
+        generation = get_generation(POSTS_GENERATION, storage)
+        tags = PrefixIndex(self.tags.max_entries)
+        tags.build((row['tag'], row['tag'], row['count'])
+                   for row in storage.tag_stats.find({'category': None}, {'tag': 1, 'count': 1}))
+        titles = PrefixIndex(self.titles.max_entries)
+        labels = {}
+
+        def title_items():
+            for post in storage.posts.find({}, {'title': 1, 'likes': 1}, batch_size=BUILD_BATCH_SIZE):
+                post_id = str(post['_id'])
+                labels[post_id] = post.get('title') or ''
+                for key in title_keys(labels[post_id]):
+                    yield key, post_id, 1 + post.get('likes', 0)
+        titles.build(title_items())
+
+        with self._lock:
+            self.tags, self.titles = tags, titles
+            # Titles evicted by the bound can't be suggested, so drop their labels
+            self.labels = labels if not titles.evicted else {value: labels[value] for _, value in titles.entries}
+            self.generation = generation
+            self.built_at = self.checked_at = time.monotonic()
+            self.builds += 1
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception:
+            self.app.logger.exception("Failed to rebuild the autocomplete index")
+        finally:
+            self._rebuilding = False
+
+    def _building(self):
+        # A build thread started before a fork didn't come along to this process
+        return self._rebuilding and self._pid == os.getpid()
+
+    def start(self):
+        """
+        Build in a background thread, unless one is already building.
+        Returns whether a build was started.
+        """
+        with self._lock:
+            if self._building():
+                return False
+            self._rebuilding = True
+            self._pid = os.getpid()
+        threading.Thread(target=self._rebuild, name='autocomplete-build', daemon=True).start()
+        return True
+
+    def check(self, storage):
+        """
+        Until a build has landed, start one in the background if none is
+        running (the startup build failed or was cut off by a fork), and
+        answer from the empty index meanwhile. Afterwards, every `refresh`
+        seconds, rebuild in the background if another worker changed the posts.
+        """
+        if self.built_at is None:
+            self.start()
+            return
+        now = time.monotonic()
+        if now - self.checked_at < self.refresh or self._building():
+            return
+        self.checked_at = now
+        if get_generation(POSTS_GENERATION, storage) != self.generation:
+            self.start()
+
+    def post_changed(self, post_id, old=None, new=None, generation=None):
+        """
+        Apply one post write: old and new are the post's tags and title before and after.
+        `generation` is the posts generation the write bumped to; when it directly
+        follows the index's, no other worker has written in between.
+        """
+        post_id = str(post_id)
+        with self._lock:
+            if self.built_at is None:
+                return
+            old_tags = {tag for tag in (old or {}).get('tags') or [] if tag}
+            new_tags = {tag for tag in (new or {}).get('tags') or [] if tag}
+            for tag in old_tags - new_tags:
+                self.tags.add(tag, tag, -1)
+            for tag in new_tags - old_tags:
+                self.tags.add(tag, tag, 1)
+
+            old_title = (old or {}).get('title')
+            new_title = (new or {}).get('title')
+            if old_title != new_title:
+                weight = 1 + ((new or old or {}).get('likes') or 0)
+                for key in title_keys(old_title or ''):
+                    self.titles.remove(key, post_id)
+                if new is not None:
+                    for key in title_keys(new_title or ''):
+                        self.titles.add(key, post_id, weight)
+                    self.labels[post_id] = new_title
+            if new is None:
+                self.labels.pop(post_id, None)
+
+            if generation is not None and self.generation is not None and generation == self.generation + 1:
+                self.generation = generation
+
+    def suggest(self, prefix, kinds=KINDS, limit=SUGGESTIONS):
+        """
+        Suggestions for a typed prefix, as JSON-ready lists per kind
+        """
+        prefix = normalize(prefix).lstrip()
+        result = {}
+        with self._lock:
+            if 'tags' in kinds:
+                result['tags'] = [{'tag': tag, 'count': weight}
+                                  for tag, weight in (self.tags.complete(prefix, limit) if prefix else [])]
+            if 'titles' in kinds:
+                result['titles'] = [{'id': post_id, 'title': self.labels.get(post_id, '')}
+                                    for post_id, _ in (self.titles.complete(prefix, limit) if prefix else [])]
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tag_entries': len(self.tags),
+                'title_entries': len(self.titles),
+                'bytes': self.tags.bytes + self.titles.bytes,
+                'max_entries': self.tags.max_entries,
+                'evicted': self.tags.evicted + self.titles.evicted,
+                'builds': self.builds,
+            }
+
+
+def get_autocomplete(app=None):
+    """
+    Return the app's autocomplete index (empty until its first build lands)
+    """
+    app = app or current_app._get_current_object()
+    index = app.extensions.get('autocomplete')
+    if index is None:
+        index = app.extensions.setdefault('autocomplete', Autocomplete(
+            app,
+            max_entries=app.config.get('AUTOCOMPLETE_MAX_ENTRIES', 100000),
+            refresh=app.config.get('AUTOCOMPLETE_REFRESH', 60)))
+    return index
+
+
+def update_autocomplete(post_id, old=None, new=None, generation=None):
+    """
+    Reflect a post create (old=None), edit or delete (new=None) in this worker's index
+    """
+    get_autocomplete().post_changed(post_id, old, new, generation)
+
+
+def init_app(app):
+    """
+    Initialize the Flask application with the autocomplete index, built in
+    the background from startup when AUTOCOMPLETE_PRELOAD is on
+    """
+    if app.config.get('AUTOCOMPLETE_PRELOAD'):
+        get_autocomplete(app).start()
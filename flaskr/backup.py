@@ -0,0 +1,212 @@
+import gzip
+import json
+import os
+from datetime import datetime, timezone
+
+import bson
+import click
+from bson import json_util
+from bson.objectid import ObjectId
+
+from flaskr.db import POSTS_GENERATION, bump_generation, invalidate_categories
+from flaskr.facets import rebuild_facets
+from flaskr.render import html_cache
+from flaskr.storage import get_storage
+
+EXPORT_COLLECTIONS = ('users', 'categories', 'posts', 'comments', 'likes')
+FORMATS = ('ndjson', 'bson')
+EXPORT_BATCH_SIZE = 1000
+MANIFEST = 'manifest.json'
+
+# Date fields that mark a document as changed, for incremental exports.
+# New documents are also found through the creation time in their ObjectId,
+# which covers users and likes (never updated in place); categories are small
+# enough to always be exported in full.
+CHANGE_FIELDS = {
+    'users': (),
+    'posts': ('updated_at', 'activity_at'),
+    'comments': ('updated_at',),
+    'likes': (),
+}
+
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+
+
+def since_filter(collection, since):
+    """
+    Filter for the documents of a collection created or changed since a datetime
+    """
+    if since is None or collection not in CHANGE_FIELDS:
+        return {}
+    # Stored dates are naive UTC
+    since = since.astimezone(timezone.utc).replace(tzinfo=None) if since.tzinfo else since
+    clauses = [{'_id': {'$gte': ObjectId.from_datetime(since)}}]
+    clauses.extend({field: {'$gte': since}} for field in CHANGE_FIELDS[collection])
+    return {'$or': clauses}
+
+
+def write_documents(path, docs, fmt):
+    """
+    Stream documents to a gzip file, one batch of the cursor at a time.
+    The gzip header carries no name or time, so equal data gives equal bytes.
+    Returns the number of documents written.
+    """
+    count = 0
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as raw, gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) as out:
+        for doc in docs:
+            if next(iter(doc), '_id') != '_id':
+                # _id first, as MongoDB stores it, so equal documents give equal bytes
+                doc = {'_id': doc['_id'], **doc}
+            if fmt == 'bson':
+                out.write(bson.encode(doc))
+            else:
+                out.write(json_util.dumps(doc, json_options=JSON_OPTIONS).encode('utf-8'))
+                out.write(b'\n')
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def read_documents(path, fmt):
+    """
+    Stream documents back from an export file
+    """
+    with gzip.open(path, 'rb') as f:
+        if fmt == 'bson':
+            yield from bson.decode_file_iter(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json_util.loads(line, json_options=JSON_OPTIONS)
+
+
+def export_data(directory, fmt='ndjson', since=None, collections=EXPORT_COLLECTIONS,
+                batch_size=EXPORT_BATCH_SIZE, meta=None):
+    """
+    Export collections to <directory>/<collection>.<fmt>.gz in _id order, plus a
+    manifest. With `since`, only documents created or changed since then are
+    exported; deletions are not captured, so an incremental export is applied
+    on top of an earlier full one.
+    All collections are read from one storage snapshot, so likes and comments
+    match their posts. On MongoDB that is a snapshot session read from batched
+    cursors, so memory use doesn't grow with the data; a standalone server
+    can't serve one, and the manifest's 'snapshot' is then False.
+    Returns the manifest.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    storage = get_storage()
+    os.makedirs(directory, exist_ok=True)
+    manifest = {
+        'format': fmt,
+        'exported_at': datetime.now(timezone.utc).isoformat(),
+        'since': since.isoformat() if since else None,
+        'collections': {},
+    }
+    if meta:
+        manifest['meta'] = meta
+    queries = {collection: since_filter(collection, since) for collection in collections}
+    with storage.snapshot(queries, batch_size=batch_size) as (cursors, consistent):
+        manifest['snapshot'] = consistent
+        for collection in collections:
+            filename = f"{collection}.{fmt}.gz"
+            count = write_documents(os.path.join(directory, filename), cursors[collection], fmt)
+            manifest['collections'][collection] = {'file': filename, 'count': count}
+
+    # Written last: a directory without a manifest is an unfinished export
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        raise click.UsageError(f"{directory} has no {MANIFEST}; is it a finished export?")
+    with open(path) as f:
+        return json.load(f)
+
+
+def restore_data(directory, drop=False, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Load an export with bulk upserts by _id, so restoring the same export twice,
+    or an incremental export on top of a full one, is safe. With drop, the
+    existing data is removed first. Returns the number of documents written per collection.
+    """
+    manifest = read_manifest(directory)
+    storage = get_storage()
+    generations = {}
+    if drop:
+        generations = storage.generations.all()
+        storage.drop()
+    storage.init()
+    # Dropping reset the change generations too. Move them past their old
+    # values, or cached responses keyed on those values would be served again
+    for name, value in generations.items():
+        storage.generations.raise_to(name, value + 1)
+
+    written = {}
+    for collection, entry in manifest['collections'].items():
+        docs = read_documents(os.path.join(directory, entry['file']), manifest['format'])
+        written[collection] = getattr(storage, collection).upsert_many(docs, batch_size=batch_size)
+
+    # Facet counts are derived from the posts, so they aren't exported
+    rebuild_facets(storage, batch_size=batch_size)
+    invalidate_categories()
+    bump_generation(POSTS_GENERATION)
+    html_cache.clear()
+    return written
+
+
+def parse_since(value):
+    if value is None:
+        return None
+    try:
+        since = datetime.fromisoformat(value)
+    except ValueError:
+        raise click.BadParameter(f"{value} is not an ISO 8601 date or datetime.", param_hint='--since')
+    return since if since.tzinfo else since.replace(tzinfo=timezone.utc)
+
+
+@click.command('export')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='ndjson', show_default=True)
+@click.option('--since', help="Only documents created or changed since this ISO 8601 time (UTC unless given).")
+@click.option('--collection', 'collections', multiple=True, type=click.Choice(EXPORT_COLLECTIONS),
+              help="Export only this collection (repeatable).")
+@click.option('--batch-size', type=int, default=EXPORT_BATCH_SIZE, show_default=True)
+def export_command(directory, fmt, since, collections, batch_size):
+    """
+    Command line interface to export posts, comments, likes, users and categories.
+    The collections are read from one snapshot, except on a standalone MongoDB
+    server, where writes made during the export can be partly included.
+    """
+    manifest = export_data(directory, fmt=fmt, since=parse_since(since),
+                           collections=collections or EXPORT_COLLECTIONS, batch_size=batch_size)
+    for collection, entry in manifest['collections'].items():
+        click.echo(f"Exported {entry['count']} {collection} to {entry['file']}.")
+    if not manifest['snapshot']:
+        click.echo("Warning: the server can't serve snapshot reads, so writes made during the export "
+                   "may be partly included.")
+
+
+@click.command('restore')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--drop', is_flag=True, help="Remove all existing data before restoring.")
+@click.option('--batch-size', type=int, default=EXPORT_BATCH_SIZE, show_default=True)
+def restore_command(directory, drop, batch_size):
+    """
+    Command line interface to restore an export
+    """
+    written = restore_data(directory, drop=drop, batch_size=batch_size)
+    for collection, count in written.items():
+        click.echo(f"Restored {count} {collection}.")
+
+
+def init_app(app):
+    """
+    Initialize the Flask application with the export and restore commands
+    """
+    app.cli.add_command(export_command)
+    app.cli.add_command(restore_command)
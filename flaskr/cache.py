@@ -0,0 +1,297 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from flask import current_app
+
+# Query args that select a listing page, with the defaults post.index assumes
+LISTING_ARGS = {
+    'q': '',
+    'tags': None,
+    'require_all_tags': 'false',
+    'category': '',
+    'sort': 'created_at',
+    'after': '',
+    'before': '',
+    'per_page': '',
+}
+
+
+def listing_key(args):
+    """
+    Normalize listing query args into a cache key.
+    Unknown args are ignored, values are stripped and defaults are dropped so
+    equivalent URLs share one entry; tag order is kept since it is displayed.
+    """
+    parts = []
+    for name, default in LISTING_ARGS.items():
+        if default is None:
+            values = [value.strip() for value in args.getlist(name) if value.strip()]
+            if values:
+                parts.append(f"{name}={','.join(values)}")
+        else:
+            value = args.get(name, default).strip()
+            if value != default:
+                parts.append(f"{name}={value}")
+    return '&'.join(parts)
+
+
+class LocalCache:
+    """
+    In-process LRU tier, bounded by entry count
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._items[key] = (value, time.time() + ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SQLiteCache:
+    """
+    Shared tier backed by a SQLite file, so worker processes on one host share
+    entries. Stands in for a networked cache in tests and small deployments.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache "
+                         "(key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl):
+        self._connect().execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                                (key, pickle.dumps(value), time.time() + ttl))
+
+    def add(self, key, value, ttl):
+        """
+        Set the key only if it is absent or expired; returns whether it was set
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT expires FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] >= now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                         (key, pickle.dumps(value), now + ttl))
+            return True
+        finally:
+            conn.execute("COMMIT")
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache")
+
+
+# Shared tier factories by RESPONSE_CACHE_BACKEND URL scheme.
+# Register another (e.g. a networked cache client) with register_backend.
+BACKENDS = {
+    # sqlite:///relative/path.db or sqlite:////absolute/path.db
+    'sqlite': lambda url: SQLiteCache(url.path[1:]),
+}
+
+
+def register_backend(scheme, factory):
+    """
+    Make a shared cache tier available as RESPONSE_CACHE_BACKEND = '<scheme>://...'.
+    The factory gets the parsed URL and returns an object with get/set/add/delete.
+    """
+    BACKENDS[scheme] = factory
+
+
+class ResponseCache:
+    """
+    Two-tier cache for rendered responses: an in-process LRU in front of an
+    optional shared tier. Misses are single-flighted per key within the
+    process, and across processes through a short lease in the shared tier,
+    so a cold key is computed once instead of by every concurrent request.
+    """
+    def __init__(self, shared=None, max_entries=256, ttl=300, lock_timeout=5.0):
+        self.local = LocalCache(max_entries)
+        self.shared = shared
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self._key_locks = {}
+        self._locks_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.counts = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'waits': 0, 'uncacheable': 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.counts[name] += 1
+
+    @contextmanager
+    def _key_lock(self, key):
+        """
+        Hold the per-key lock. Each lock counts the threads holding or waiting
+        for it and is dropped with the last one, so a thread arriving while
+        others wait queues behind them instead of getting a lock of its own.
+        """
+        with self._locks_lock:
+            entry = self._key_locks.get(key)
+            if entry is None:
+                entry = self._key_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[key]
+
+    def _lookup(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local_hits')
+            return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self._count('shared_hits')
+                self.local.set(key, value, self.ttl)
+                return value
+        return None
+
+    def get_local(self, key):
+        """
+        Return the value from the in-process tier only, without touching the shared tier
+        """
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local_hits')
+        return value
+
+    def _wait_for_shared(self, key):
+        deadline = time.monotonic() + self.lock_timeout
+        self._count('waits')
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value, self.ttl)
+                return value
+        return None
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key, computing it on a miss.
+        compute() returns (value, cacheable); uncacheable values are returned
+        without being stored.
+        """
+        value = self._lookup(key)
+        if value is not None:
+            return value
+
+        with self._key_lock(key):
+            # Another thread may have filled it while we waited
+            value = self._lookup(key)
+            if value is not None:
+                return value
+
+            lease = f"lock:{key}"
+            leased = self.shared is None or self.shared.add(lease, os.getpid(), self.lock_timeout)
+            if not leased:
+                value = self._wait_for_shared(key)
+                if value is not None:
+                    return value
+
+            try:
+                self._count('misses')
+                value, cacheable = compute()
+                if cacheable:
+                    self.local.set(key, value, self.ttl)
+                    if self.shared is not None:
+                        self.shared.set(key, value, self.ttl)
+                else:
+                    self._count('uncacheable')
+                return value
+            finally:
+                if leased and self.shared is not None:
+                    self.shared.delete(lease)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self.counts)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['local_hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        stats['local_entries'] = len(self.local)
+        return stats
+
+
+def get_response_cache():
+    """
+    Return the app's response cache, or None when RESPONSE_CACHE is off
+    """
+    app = current_app._get_current_object()
+    if not app.config.get('RESPONSE_CACHE'):
+        return None
+    cache = app.extensions.get('response_cache')
+    if cache is None:
+        shared = None
+        backend = app.config.get('RESPONSE_CACHE_BACKEND')
+        if backend:
+            url = urlparse(backend)
+            if url.scheme not in BACKENDS:
+                raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND scheme: {url.scheme}")
+            shared = BACKENDS[url.scheme](url)
+        cache = app.extensions['response_cache'] = ResponseCache(
+            shared=shared,
+            max_entries=app.config.get('RESPONSE_CACHE_SIZE', 256),
+            ttl=app.config.get('RESPONSE_CACHE_TTL', 300))
+    return cache
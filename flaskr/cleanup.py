@@ -0,0 +1,182 @@
+"""
+Removal of the comments and likes that belong to deleted posts.
+
+Deleting a post deletes its dependents in bounded batches, either in the
+request or, with CASCADE_DELETE_QUEUE, on a background thread so a post with
+a long thread doesn't hold up the response. `flask gc-orphans` sweeps up
+dependents left behind by older versions or by writes that raced a delete.
+"""
+import click
+from flask import current_app
+
+from flaskr.flusher import BackgroundFlusher
+from flaskr.storage import get_storage, open_storage
+
+# Collections whose documents belong to a post through post_id
+DEPENDENTS = ('comments', 'likes')
+CLEANUP_BATCH_SIZE = 1000
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def delete_dependents(storage, post_ids, batch_size=CLEANUP_BATCH_SIZE, collections=DEPENDENTS):
+    """
+    Delete the comments and likes of the given posts, at most batch_size
+    documents per delete. Returns the number deleted per collection.
+    """
+    post_ids = list(post_ids)
+    deleted = {}
+    for collection in collections:
+        repository = getattr(storage, collection)
+        deleted[collection] = 0
+        for chunk in chunks(post_ids, batch_size):
+            while True:
+                count = repository.delete_many({'post_id': {'$in': chunk}}, limit=batch_size)
+                deleted[collection] += count
+                if count < batch_size:
+                    break
+    return deleted
+
+
+class CleanupQueue(BackgroundFlusher):
+    """
+    Background deletion of the dependents of deleted posts.
+    Post ids are queued by the request and their comments and likes deleted
+    in batches every `interval` seconds, or sooner once `max_size` posts are
+    pending. Pending posts are cleaned up when the process exits; anything
+    still missed is left for gc-orphans.
+    """
+    thread_name = 'cleanup-queue'
+
+    def __init__(self, app, interval=1.0, max_size=100, batch_size=CLEANUP_BATCH_SIZE):
+        super().__init__(app, interval, max_size)
+        self.batch_size = batch_size
+        self.runs = 0
+        self.deleted = 0
+        self._pending = set()
+
+    def add(self, post_id):
+        with self._lock:
+            self._pending.add(post_id)
+            self._queued(len(self._pending))
+
+    def flush(self):
+        """
+        Delete the dependents of every pending post.
+        Returns the number of documents deleted.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        if not pending:
+            return 0
+
+        try:
+            deleted = sum(delete_dependents(open_storage(self.app), pending, self.batch_size).values())
+        except Exception:
+            self.app.logger.exception("Failed to delete the dependents of %d posts; requeueing", len(pending))
+            with self._lock:
+                self._pending |= pending
+            return 0
+        self.runs += 1
+        self.deleted += deleted
+        return deleted
+
+
+def get_cleanup_queue():
+    """
+    Return the app's cleanup queue, or None when CASCADE_DELETE_QUEUE is off
+    """
+    app = current_app._get_current_object()
+    if not app.config.get('CASCADE_DELETE_QUEUE'):
+        return None
+    queue = app.extensions.get('cleanup_queue')
+    if queue is None:
+        queue = app.extensions['cleanup_queue'] = CleanupQueue(
+            app,
+            interval=app.config.get('CASCADE_DELETE_INTERVAL', 1.0),
+            batch_size=app.config.get('CASCADE_DELETE_BATCH_SIZE', CLEANUP_BATCH_SIZE))
+    return queue
+
+
+def cascade_delete(storage, post_id):
+    """
+    Delete a deleted post's comments and likes, through the cleanup queue when enabled
+    """
+    queue = get_cleanup_queue()
+    if queue is not None:
+        queue.add(post_id)
+    else:
+        delete_dependents(storage, [post_id],
+                          current_app.config.get('CASCADE_DELETE_BATCH_SIZE', CLEANUP_BATCH_SIZE))
+
+
+def find_orphans(storage, collection, batch_size=CLEANUP_BATCH_SIZE):
+    """
+    The post ids referenced from a dependent collection whose post no longer
+    exists, with the number of documents for each
+    """
+    counts = getattr(storage, collection).count_by('post_id')
+    post_ids = [post_id for post_id in counts if post_id is not None]
+    orphans = {}
+    for chunk in chunks(post_ids, batch_size):
+        found = {post['_id'] for post in storage.posts.find({'_id': {'$in': chunk}}, {'_id': 1})}
+        orphans.update((post_id, counts[post_id]) for post_id in chunk if post_id not in found)
+    return orphans
+
+
+def gc_orphans(batch_size=CLEANUP_BATCH_SIZE, dry_run=False):
+    """
+    Find and delete the comments and likes of posts that no longer exist.
+    Returns, per collection, the orphaned posts and documents, the number
+    deleted and the collection's stats before and after.
+    """
+    storage = get_storage()
+    report = {}
+    for collection in DEPENDENTS:
+        repository = getattr(storage, collection)
+        orphans = find_orphans(storage, collection, batch_size)
+        before = repository.stats()
+        deleted = 0
+        if orphans and not dry_run:
+            deleted = delete_dependents(storage, orphans, batch_size, collections=(collection,))[collection]
+        report[collection] = {'posts': len(orphans), 'orphans': sum(orphans.values()), 'deleted': deleted,
+                              'before': before, 'after': repository.stats() if deleted else before}
+    return report
+
+
+def format_bytes(size):
+    if size is None:
+        return 'n/a'
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if abs(size) < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+@click.command('gc-orphans')
+@click.option('--batch-size', type=int, default=CLEANUP_BATCH_SIZE, show_default=True)
+@click.option('--dry-run', is_flag=True, help="Only report the orphans.")
+def gc_orphans_command(batch_size, dry_run):
+    """
+    Command line interface to delete comments and likes of deleted posts
+    """
+    report = gc_orphans(batch_size=batch_size, dry_run=dry_run)
+    for collection, entry in report.items():
+        if dry_run:
+            click.echo(f"{collection}: {entry['orphans']} orphans of {entry['posts']} deleted posts.")
+            continue
+        before, after = entry['before'], entry['after']
+        index_freed = None if before['index_size'] is None else before['index_size'] - after['index_size']
+        click.echo(f"{collection}: deleted {entry['deleted']} orphans of {entry['posts']} deleted posts, "
+                   f"reclaimed {format_bytes(before['size'] - after['size'])} of documents and "
+                   f"{format_bytes(index_freed)} of indexes.")
+
+
+def init_app(app):
+    """
+    Initialize the Flask application with the gc-orphans command
+    """
+    app.cli.add_command(gc_orphans_command)
@@ -0,0 +1,179 @@
+"""
+Response compression and fingerprinted static files.
+
+HTML and JSON responses of at least COMPRESS_MIN_SIZE bytes are compressed
+with the best encoding the client accepts: brotli when the optional brotli
+package is installed, otherwise gzip. Compressed bodies are kept in an LRU
+keyed by a hash of the body and the encoding, so hot pages (cached listing
+pages, stored note HTML) are compressed once rather than on every request.
+
+Static files are linked with a hash of their content in the URL, and
+requests carrying the current hash are served as immutable for a year.
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import current_app, request
+from werkzeug.security import safe_join
+
+from flaskr.render import RenderCache
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'text/html', 'application/json'}
+MIN_SIZE = 1024
+GZIP_LEVEL = 6
+# Higher qualities compress little better for much more CPU on pages this size
+BROTLI_QUALITY = 5
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class Compressor:
+    """
+    Compresses response bodies, reusing earlier results for identical bodies
+    """
+    def __init__(self, min_size=MIN_SIZE, cache_bytes=8 * 1024 * 1024):
+        self.min_size = min_size
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+        self.cache = RenderCache(cache_bytes)
+        self._lock = threading.Lock()
+        self.counts = {'responses': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    def is_compressible(self, response):
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+            return False
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers:
+            return False
+        return not response.cache_control.no_transform
+
+    def compress(self, body, encoding):
+        key = f"{encoding}:{hashlib.sha1(body).hexdigest()}"
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = compress(body, encoding)
+            self.cache.put(key, compressed)
+        with self._lock:
+            self.counts['responses'] += 1
+            self.counts['bytes_in'] += len(body)
+            self.counts['bytes_out'] += len(compressed)
+        return compressed
+
+    def stats(self):
+        cache = self.cache.stats()
+        with self._lock:
+            stats = dict(self.counts)
+        stats.update({f'cache_{name}': value for name, value in cache.items()})
+        return stats
+
+
+def get_compressor():
+    """
+    Return the app's compressor, or None when COMPRESS is off
+    """
+    app = current_app._get_current_object()
+    if not app.config.get('COMPRESS', True):
+        return None
+    compressor = app.extensions.get('compressor')
+    if compressor is None:
+        compressor = app.extensions['compressor'] = Compressor(
+            min_size=app.config.get('COMPRESS_MIN_SIZE', MIN_SIZE),
+            cache_bytes=app.config.get('COMPRESS_CACHE_BYTES', 8 * 1024 * 1024))
+    return compressor
+
+
+def compress_response(response):
+    """
+    Compress the response body if it is worth it and the client accepts it
+    """
+    compressor = get_compressor()
+    if compressor is None or not compressor.is_compressible(response):
+        return response
+    body = response.get_data()
+    if len(body) < compressor.min_size:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(compressor.encodings)
+    if encoding is None:
+        return response
+    response.set_data(compressor.compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # The compressed bytes differ from the uncompressed ones, so the ETag
+    # becomes weak; If-None-Match uses weak comparison, so 304s still work
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+class StaticHashes:
+    """
+    Content hashes of the files in the static folder, recomputed when a file changes
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        path = safe_join(self.folder, filename)
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            return None
+        with self._lock:
+            entry = self._hashes.get(filename)
+        if entry is not None and entry[0] == (stat.st_mtime_ns, stat.st_size):
+            return entry[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:12]
+        with self._lock:
+            self._hashes[filename] = ((stat.st_mtime_ns, stat.st_size), digest)
+        return digest
+
+
+def add_static_hash(endpoint, values):
+    """
+    url_for('static', filename=...) links to the file's current content hash
+    """
+    if endpoint != 'static' or 'v' in values or 'filename' not in values:
+        return
+    digest = current_app.extensions['static_hashes'].get(values['filename'])
+    if digest is not None:
+        values['v'] = digest
+
+
+def cache_static(response):
+    """
+    Serve static files requested at their current hash as immutable
+    """
+    if request.endpoint != 'static' or response.status_code != 200:
+        return response
+    version = request.args.get('v')
+    if version and version == current_app.extensions['static_hashes'].get(request.view_args['filename']):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    """
+    Initialize the Flask application with response compression and static file fingerprints
+    """
+    app.extensions['static_hashes'] = StaticHashes(app.static_folder)
+    app.url_defaults(add_static_hash)
+    app.after_request(compress_response)
+    app.after_request(cache_static)
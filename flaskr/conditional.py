@@ -0,0 +1,49 @@
+import hashlib
+
+from flask import g, make_response, request, session
+from werkzeug.http import is_resource_modified
+
+
+def make_etag(*parts):
+    """
+    Build an ETag value from the parts that determine a response.
+    The viewer is always included since pages show who is logged in.
+    """
+    user = g.get('user')
+    # Right after login g.user is the user document rather than the session copy
+    user_id = str(user.get('user_id') or user.get('_id', '')) if user else ''
+    key = '|'.join(str(part) for part in parts + (user_id,))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def is_conditional():
+    """
+    Whether the request carries validators worth checking
+    """
+    return bool(request.if_none_match) or request.if_modified_since is not None
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Return a 304 response if the client's copy is current, otherwise None.
+    Pages with pending flash messages are always rendered so the messages show.
+    """
+    if session.get('_flashes'):
+        return None
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    response = make_response('', 304)
+    return add_validators(response, etag, last_modified)
+
+
+def add_validators(response, etag, last_modified=None):
+    """
+    Attach the ETag/Last-Modified validators and make clients revalidate on each use
+    """
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
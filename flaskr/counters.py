@@ -0,0 +1,119 @@
+from collections import defaultdict
+
+from flask import current_app
+from flaskr.db import POSTS_GENERATION, bump_generation
+from flaskr.flusher import BackgroundFlusher
+from flaskr.storage import open_storage
+from flaskr.trending import get_half_life
+
+
+class CounterBuffer(BackgroundFlusher):
+    """
+    Write-behind buffer for counter updates.
+    Deltas for the same document are coalesced in memory and written with one
+    bulk_write every `interval` seconds, or sooner once `max_size` documents
+    are pending. Pending deltas are flushed when the process exits.
+    `options` maps a repository to extra keyword arguments for its
+    increment_many and `generations` maps it to a change generation bumped
+    after each flush.
+    """
+    thread_name = 'counter-buffer'
+
+    def __init__(self, app, interval=1.0, max_size=100, options=None, generations=None):
+        super().__init__(app, interval, max_size)
+        self.options = options or {}
+        self.generations = generations or {}
+        self.flushes = 0
+        self.flushed_ops = 0
+        self._pending = defaultdict(lambda: defaultdict(int))
+
+    def add(self, collection, doc_id, field, delta):
+        with self._lock:
+            self._pending[(collection, doc_id)][field] += delta
+            self._queued(len(self._pending))
+
+    def pending(self, collection, doc_id, field):
+        """
+        The not yet flushed delta for a counter, so this process can show it
+        """
+        with self._lock:
+            fields = self._pending.get((collection, doc_id))
+            return fields.get(field, 0) if fields else 0
+
+    def flush(self):
+        """
+        Write all pending deltas with one bulk increment per repository.
+        Returns the number of documents updated.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: defaultdict(int))
+        if not pending:
+            return 0
+
+        ops = defaultdict(list)
+        for (collection, doc_id), fields in pending.items():
+            inc = {field: delta for field, delta in fields.items() if delta}
+            if inc:
+                ops[collection].append((doc_id, inc))
+
+        storage = open_storage(self.app)
+        written = 0
+        for collection, collection_ops in ops.items():
+            try:
+                getattr(storage, collection).increment_many(collection_ops, **self.options.get(collection, {}))
+            except Exception:
+                self.app.logger.exception("Failed to flush %d counter updates to %s; requeueing",
+                                          len(collection_ops), collection)
+                for (name, doc_id), fields in pending.items():
+                    if name == collection:
+                        for field, delta in fields.items():
+                            self.add(name, doc_id, field, delta)
+                continue
+            written += len(collection_ops)
+            # The counters are written, so a failure from here on must not requeue them
+            if collection in self.generations:
+                try:
+                    bump_generation(self.generations[collection], storage)
+                except Exception:
+                    self.app.logger.exception("Failed to bump the %s generation after a flush", collection)
+        self.flushes += 1
+        self.flushed_ops += written
+        return written
+
+
+def get_counter_buffer():
+    """
+    Return the app's counter buffer, or None when COUNTER_BUFFER is off
+    """
+    app = current_app._get_current_object()
+    if not app.config.get('COUNTER_BUFFER'):
+        return None
+    buffer = app.extensions.get('counter_buffer')
+    if buffer is None:
+        buffer = app.extensions['counter_buffer'] = CounterBuffer(
+            app,
+            interval=app.config.get('COUNTER_BUFFER_INTERVAL', 1.0),
+            max_size=app.config.get('COUNTER_BUFFER_SIZE', 100),
+            # Like counts move trending scores, so rescore in the same update
+            options={'posts': {'touch': 'activity_at', 'half_life': get_half_life(app)}},
+            generations={'posts': POSTS_GENERATION})
+    return buffer
+
+
+def increment(storage, collection, doc_id, field, delta):
+    """
+    Add delta to a counter field, through the write-behind buffer when enabled
+    """
+    buffer = get_counter_buffer()
+    if buffer is not None:
+        buffer.add(collection, doc_id, field, delta)
+    else:
+        getattr(storage, collection).increment(doc_id, {field: delta})
+
+
+def pending_delta(collection, doc_id, field):
+    """
+    The buffered delta for a counter that has not reached the database yet
+    """
+    buffer = get_counter_buffer()
+    return buffer.pending(collection, doc_id, field) if buffer is not None else 0
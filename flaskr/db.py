@@ -1,91 +1,304 @@
+import atexit
+import os
+import threading
+import time
+
 import click
 
 from flask import current_app, g
-from pymongo import MongoClient
+from bson.objectid import ObjectId
+from pymongo import MongoClient, monitoring
+
+from flaskr.storage import close_storage, get_storage
+
+# One MongoClient per (process, URI, options). MongoClient is thread-safe and
+# keeps its own connection pool, so requests share it instead of reconnecting.
+_clients = {}
+_clients_pid = os.getpid()
+_clients_lock = threading.Lock()
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Connection pool listener that keeps running counters for the pool stats
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.pools = 0
+            self.open_connections = 0
+            self.checked_out = 0
+            self.max_checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.pool_clears = 0
+            self.wait_time_total = 0.0
+            self.wait_time_max = 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'pools': self.pools,
+                'open_connections': self.open_connections,
+                'checked_out': self.checked_out,
+                'max_checked_out': self.max_checked_out,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'pool_clears': self.pool_clears,
+                'wait_time_total_ms': self.wait_time_total * 1000,
+                'wait_time_avg_ms': (self.wait_time_total / self.checkouts * 1000) if self.checkouts else 0.0,
+                'wait_time_max_ms': self.wait_time_max * 1000,
+            }
+
+    def _wait_time(self):
+        # Check-out started/finished events fire on the requesting thread
+        started = getattr(self._local, 'started', None)
+        self._local.started = None
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def pool_created(self, event):
+        with self._lock:
+            self.pools += 1
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        with self._lock:
+            self.pools = max(self.pools - 1, 0)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections = max(self.open_connections - 1, 0)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._wait_time()
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        waited = self._wait_time()
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+
+pool_stats = PoolStatsListener()
+
+
+def _client_options(app_config):
+    """
+    Build the MongoClient keyword arguments from the app config
+    """
+    options = {
+        'maxPoolSize': app_config.get('MONGO_MAX_POOL_SIZE'),
+        'minPoolSize': app_config.get('MONGO_MIN_POOL_SIZE'),
+        'maxIdleTimeMS': app_config.get('MONGO_MAX_IDLE_TIME_MS'),
+        'waitQueueTimeoutMS': app_config.get('MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+        'connectTimeoutMS': app_config.get('MONGO_CONNECT_TIMEOUT_MS'),
+        'socketTimeoutMS': app_config.get('MONGO_SOCKET_TIMEOUT_MS'),
+        'serverSelectionTimeoutMS': app_config.get('MONGO_SERVER_SELECTION_TIMEOUT_MS'),
+        'readConcernLevel': app_config.get('MONGO_READ_CONCERN'),
+        'w': app_config.get('MONGO_WRITE_CONCERN'),
+        'wTimeoutMS': app_config.get('MONGO_WRITE_TIMEOUT_MS'),
+    }
+    # Leave unset options to the driver defaults
+    options = {key: value for key, value in options.items() if value not in (None, '')}
+    if isinstance(options.get('w'), str) and options['w'].isdigit():
+        options['w'] = int(options['w'])
+    return options
+
+
+def _reset_after_fork():
+    """
+    Forget clients inherited from the parent process.
+    PyMongo clients are not fork-safe, so each prefork worker builds its own.
+    The parent's sockets are left alone instead of closed so the parent keeps working.
+    """
+    global _clients_pid, _clients_lock
+    _clients.clear()
+    _clients_pid = os.getpid()
+    _clients_lock = threading.Lock()
+    pool_stats.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_client(app=None):
+    """
+    Return the process-wide pooled MongoClient for the app's MONGO_URI
+    """
+    app = app or current_app
+    if os.getpid() != _clients_pid:
+        # Fallback for platforms without os.register_at_fork
+        _reset_after_fork()
+
+    options = _client_options(app.config)
+    key = (app.config['MONGO_URI'], tuple(sorted(options.items())))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = MongoClient(app.config['MONGO_URI'], event_listeners=[pool_stats], **options)
+                _clients[key] = client
+    return client
+
+
+def get_pool_stats():
+    """
+    Return the connection pool stats for this worker process
+    """
+    stats = pool_stats.snapshot()
+    stats['clients'] = len(_clients)
+    return stats
+
+
+def close_clients():
+    """
+    Close every pooled client owned by this process
+    """
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+atexit.register(close_clients)
+
+
+# Generation bumped on every write that can change a post listing
+POSTS_GENERATION = 'posts'
+
+
+def get_generation(name, storage=None):
+    """
+    Return the change generation for a named data set.
+    Generations live in storage so every worker process sees the same value.
+    """
+    storage = storage if storage is not None else get_storage()
+    return storage.generations.get(name)
+
+
+def bump_generation(name, storage=None):
+    """
+    Advance the change generation for a named data set and return the new value
+    """
+    storage = storage if storage is not None else get_storage()
+    return storage.generations.bump(name)
+
+
+class ReferenceCache:
+    """
+    Read-through cache for small, rarely changing reference data (e.g. categories).
+    Entries are served from memory until their TTL runs out; the shared
+    generation is then checked and the data is only reloaded if it changed.
+    """
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, loader, storage=None):
+        storage = storage if storage is not None else get_storage()
+        key = (storage.name, name)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry['checked_at'] < self.ttl:
+            return entry['value']
+
+        generation = get_generation(name, storage)
+        if entry is not None and entry['generation'] == generation:
+            entry['checked_at'] = now
+            return entry['value']
+
+        value = loader(storage)
+        with self._lock:
+            self._entries[key] = {'value': value, 'generation': generation, 'checked_at': now}
+        return value
+
+    def invalidate(self, name, storage=None):
+        storage = storage if storage is not None else get_storage()
+        with self._lock:
+            self._entries.pop((storage.name, name), None)
+        return bump_generation(name, storage)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+reference_cache = ReferenceCache()
+
+
+def get_categories():
+    """
+    Return all categories through the reference cache
+    """
+    return reference_cache.get('categories', lambda storage: storage.categories.all())
+
+
+def invalidate_categories():
+    """
+    Drop cached categories in every worker after categories change
+    """
+    return reference_cache.invalidate('categories')
+
 
 def get_db():
     """
-    Configuration method to return db instance
+    Configuration method to return db instance.
+    Only MongoDB-specific tooling uses this; the app goes through flaskr.storage.
     """
     if 'db' not in g:
-        # Create a new database connection if it doesn't exist yet
-        client = MongoClient(current_app.config['MONGO_URI'])
-        db_name = current_app.config['DB_NAME']
-        
-        g.db = client[db_name]
-        # Store the client in the Flask global context for later use
-        g.client = client
+        # Borrow the pooled client; connections are checked out per operation
+        g.db = get_client()[current_app.config['DB_NAME']]
     
     return g.db
 
 def close_db(e=None):
     """
-    Close the database connection
+    Release the request's database handle.
+    The pooled client stays open for the next request.
     """
     g.pop('db', None)
-    client = g.pop('client', None)
-
-    if client is not None:
-        client.close()
+    close_storage()
         
 def init_db():
     """
     Initialize the database with the schema and data
     """
-    db = get_db()
-
-    if 'users' not in db.list_collection_names():
-        # Create the 'users' collection
-        db.create_collection('users')
-        print("Created 'users' collection.")
-
-    # MongoDB will skip creating the index if it already exists
-    db.users.create_index([('username', 1)], unique=True)
-    db.users.create_index([('email', 1)], unique=True)
-    db.users.create_index([('password', 1)])
-    
-    
-    if 'posts' not in db.list_collection_names():
-        # Create the 'posts' collection
-        db.create_collection('posts')
-        print("Created 'posts' collection.")
-    
-    db.posts.create_index([('title', 1)])
-    db.posts.create_index([('category', 1)])
-    db.posts.create_index([('content', 1)])
-    db.posts.create_index([('creator_id', 1)])
-    db.posts.create_index([('created_at', 1)])
-    db.posts.create_index([('updated_at', 1)])
-    db.posts.create_index([('tags', 1)])
-    db.posts.create_index([('title', 'text'), ('content', 'text')]) # Full-text search index
-    db.posts.create_index([('likes', 1)])  # For sorting by likes
-    db.posts.create_index([('comments', 1)])  # For sorting by comments
-    
-    if 'comments' not in db.list_collection_names():
-        db.create_collection('comments')
-        print("Created 'comments' collection.")
-    
-    db.comments.create_index([('post_id', 1)])
-    db.comments.create_index([('creator_id', 1)])
-    db.comments.create_index([('content', 1)])
-    db.comments.create_index([('created_at', 1)])
-    db.comments.create_index([('updated_at', 1)])
-    db.comments.create_index([('likes', 1)])  # For furture use
-
-    if 'likes' not in db.list_collection_names():
-        db.create_collection('likes')
-        print("Created 'likes' collection.")
-    
-    db.likes.create_index([('post_id', 1)])
-    db.likes.create_index([('user_id', 1)])
-    db.likes.create_index([('post_id', 1), ('user_id', 1)], unique=True)  # Ensure a user can like a post only once
-
-    if 'categories' not in db.list_collection_names():
-        db.create_collection('categories')
-        print("Created 'categories' collection.")
-    
-    db.categories.create_index([('name', 1)], unique=True)
-    db.categories.create_index([('description', 1)])
+    storage = get_storage()
+    storage.init()
     
     categories = [
         {"name": "General", "description": "General discussions and topics."},
@@ -104,12 +317,285 @@ def init_db():
     ]
     
     # Insert categories if they don't exist
-    for category in categories:
-        if db.categories.count_documents({"name": category["name"]}) == 0:
-            db.categories.insert_one(category)
-            print(f"Inserted category: {category['name']}")
+    for name in storage.categories.ensure(categories):
+        print(f"Inserted category: {name}")
+    
+    invalidate_categories()
+
+    # Posts without grams would be missing from substring search
+    from flaskr.search import reindex_posts
+    indexed = reindex_posts()
+    if indexed:
+        print(f"Indexed {indexed} posts for search.")
     
     
+# Indexes each collection should have, derived from the query shapes below.
+# MongoDB will skip creating an index if it already exists.
+INDEXES = {
+    'users': [
+        {'keys': [('username', 1)], 'unique': True},
+        {'keys': [('email', 1)], 'unique': True},
+        # auth.login/register: case-insensitive lookups on normalized keys.
+        # Partial so users not yet migrated (no key) don't collide on null.
+        {'keys': [('username_lower', 1)], 'unique': True,
+         'partialFilterExpression': {'username_lower': {'$type': 'string'}}},
+        {'keys': [('email_lower', 1)], 'unique': True,
+         'partialFilterExpression': {'email_lower': {'$type': 'string'}}},
+    ],
+    'posts': [
+        # post.index: newest first, optionally behind a category or tag filter
+        {'keys': [('created_at', -1), ('_id', -1)]},
+        {'keys': [('category', 1), ('created_at', -1), ('_id', -1)]},
+        {'keys': [('tags', 1), ('created_at', -1), ('_id', -1)]},
+        # post.index: title and popularity sorts
+        {'keys': [('title', -1), ('_id', -1)]},
+        {'keys': [('likes', -1), ('_id', -1)]},
+        {'keys': [('category', 1), ('likes', -1), ('_id', -1)]},
+        {'keys': [('tags', 1), ('likes', -1), ('_id', -1)]},
+        # post.index: trending sort on the stored score (flaskr.trending)
+        {'keys': [('trending', -1), ('_id', -1)]},
+        {'keys': [('category', 1), ('trending', -1), ('_id', -1)]},
+        {'keys': [('tags', 1), ('trending', -1), ('_id', -1)]},
+        # post.index: relevance ($text) and substring search (flaskr.search)
+        {'keys': [('title', 'text'), ('content', 'text')]},
+        {'keys': [('search_grams', 1)]},
+        # flask import-notes: one post per imported file, looked up again on resume.
+        # Partial so posts created through the site (no key) don't collide on null.
+        {'keys': [('import_key', 1)], 'unique': True,
+         'partialFilterExpression': {'import_key': {'$type': 'string'}}},
+        # Related notes: posts sharing a new post's distinctive terms (flaskr.related)
+        {'keys': [('related_terms', 1)]},
+    ],
+    'comments': [
+        # post.view: a post's comments in posting order
+        {'keys': [('post_id', 1), ('created_at', 1), ('_id', 1)]},
+    ],
+    'likes': [
+        # like_post, and ensure a user can like a post only once
+        {'keys': [('post_id', 1), ('user_id', 1)], 'unique': True},
+    ],
+    'categories': [
+        {'keys': [('name', 1)], 'unique': True},
+    ],
+    # Materialized facet counts (flaskr.facets). A tag_stats row with a null
+    # category counts the tag across all categories.
+    'tag_stats': [
+        # Incremental updates, and category counts for a tag filter
+        {'keys': [('tag', 1), ('category', 1)], 'unique': True},
+        # Top tags overall or within a category
+        {'keys': [('category', 1), ('count', -1), ('tag', 1)]},
+    ],
+    'category_stats': [
+        {'keys': [('category', 1)], 'unique': True},
+    ],
+}
+
+# Representative queries the app runs, used by the index advisor.
+# 'small' marks reference collections where a collection scan is expected.
+QUERY_SHAPES = [
+    {'name': 'post.index newest', 'collection': 'posts',
+     'filter': {}, 'sort': [('created_at', -1), ('_id', -1)]},
+    {'name': 'post.index category newest', 'collection': 'posts',
+     'filter': {'category': 'General'}, 'sort': [('created_at', -1), ('_id', -1)]},
+    {'name': 'post.index tags newest', 'collection': 'posts',
+     'filter': {'tags': {'$in': ['python']}}, 'sort': [('created_at', -1), ('_id', -1)]},
+    {'name': 'post.index title', 'collection': 'posts',
+     'filter': {}, 'sort': [('title', -1), ('_id', -1)]},
+    {'name': 'post.index popularity', 'collection': 'posts',
+     'filter': {}, 'sort': [('likes', -1), ('_id', -1)]},
+    {'name': 'post.index category popularity', 'collection': 'posts',
+     'filter': {'category': 'General'}, 'sort': [('likes', -1), ('_id', -1)]},
+    {'name': 'post.index tags popularity', 'collection': 'posts',
+     'filter': {'tags': {'$in': ['python']}}, 'sort': [('likes', -1), ('_id', -1)]},
+    {'name': 'post.index trending', 'collection': 'posts',
+     'filter': {}, 'sort': [('trending', -1), ('_id', -1)]},
+    {'name': 'post.index category trending', 'collection': 'posts',
+     'filter': {'category': 'General'}, 'sort': [('trending', -1), ('_id', -1)]},
+    {'name': 'post.index tags trending', 'collection': 'posts',
+     'filter': {'tags': {'$in': ['python']}}, 'sort': [('trending', -1), ('_id', -1)]},
+    {'name': 'post.index search', 'collection': 'posts',
+     'filter': {'search_grams': {'$all': ['not', 'ote']}}, 'sort': [('created_at', -1), ('_id', -1)]},
+    {'name': 'post.index relevance', 'collection': 'posts',
+     'filter': {'$text': {'$search': 'notes'}}},
+    {'name': 'import-notes resume', 'collection': 'posts',
+     'filter': {'import_key': {'$in': ['course/notes.md']}}},
+    {'name': 'post.view', 'collection': 'posts',
+     'filter': {'_id': ObjectId()}},
+    {'name': 'post.view related', 'collection': 'posts',
+     'filter': {'_id': {'$in': [ObjectId()]}}},
+    {'name': 'related candidates', 'collection': 'posts',
+     'filter': {'related_terms': {'$in': ['matrix']}, '_id': {'$ne': ObjectId()}}},
+    {'name': 'post.view comments', 'collection': 'comments',
+     'filter': {'post_id': ObjectId()}, 'sort': [('created_at', 1), ('_id', 1)]},
+    {'name': 'post.like_post', 'collection': 'likes',
+     'filter': {'post_id': ObjectId(), 'user_id': 'user'}},
+    {'name': 'post.delete comments', 'collection': 'comments',
+     'filter': {'post_id': {'$in': [ObjectId()]}}},
+    {'name': 'post.delete likes', 'collection': 'likes',
+     'filter': {'post_id': {'$in': [ObjectId()]}}},
+    {'name': 'auth.login', 'collection': 'users',
+     'filter': {'$or': [{'username_lower': 'user'}, {'email_lower': 'user'}]}},
+    {'name': 'auth.load_logged_in_user', 'collection': 'users',
+     'filter': {'_id': ObjectId()}},
+    {'name': 'categories', 'collection': 'categories',
+     'filter': {}, 'small': True},
+    {'name': 'facets top tags', 'collection': 'tag_stats',
+     'filter': {'category': None, 'count': {'$gt': 0}}, 'sort': [('count', -1), ('tag', 1)]},
+    {'name': 'facets tag categories', 'collection': 'tag_stats',
+     'filter': {'tag': 'python', 'category': {'$ne': None}}},
+    {'name': 'facets categories', 'collection': 'category_stats',
+     'filter': {}, 'small': True},
+]
+
+
+def index_name(keys):
+    """
+    The name MongoDB gives an index with these keys
+    """
+    return '_'.join(f"{field}_{direction}" for field, direction in keys)
+
+
+def ensure_indexes(db):
+    """
+    Create the collections and indexes in INDEXES
+    """
+    existing = db.list_collection_names()
+    for collection, indexes in INDEXES.items():
+        if collection not in existing:
+            db.create_collection(collection)
+            print(f"Created '{collection}' collection.")
+        for index in indexes:
+            options = {key: value for key, value in index.items() if key != 'keys'}
+            db[collection].create_index(index['keys'], **options)
+
+
+def plan_stages(plan):
+    """
+    Walk an explain() plan tree and yield every stage
+    """
+    if not plan:
+        return
+    yield plan
+    for child in ('inputStage', 'queryPlan'):
+        yield from plan_stages(plan.get(child))
+    for stage in plan.get('inputStages', []):
+        yield from plan_stages(stage)
+
+
+def explain_shape(db, shape):
+    """
+    Explain a query shape and return the stages and index names of its winning plan
+    """
+    cursor = db[shape['collection']].find(shape['filter'])
+    if shape.get('sort'):
+        cursor = cursor.sort(shape['sort'])
+    plan = cursor.limit(20).explain()['queryPlanner']['winningPlan']
+    # Slot-based plans wrap the classic tree in a stage-less 'queryPlan' node
+    stages = [stage for stage in plan_stages(plan) if 'stage' in stage]
+    return {
+        'stages': [stage.get('stage') for stage in stages],
+        'indexes': sorted({stage['indexName'] for stage in stages if 'indexName' in stage}),
+    }
+
+
+def advise_indexes(db):
+    """
+    Compare the live indexes with INDEXES and the query shapes.
+    Returns a report with the explain result of each shape, the spec indexes
+    that are missing, and the live indexes that are outside the spec or unused.
+    """
+    report = {'shapes': [], 'missing': [], 'extra': [], 'unused': []}
+
+    used = set()
+    for shape in QUERY_SHAPES:
+        result = explain_shape(db, shape)
+        collscan = 'COLLSCAN' in result['stages'] and not shape.get('small')
+        used.update((shape['collection'], name) for name in result['indexes'])
+        report['shapes'].append({'name': shape['name'], 'collection': shape['collection'],
+                                 'collscan': collscan, **result})
+
+    for collection, indexes in INDEXES.items():
+        live = db[collection].index_information()
+        wanted = {index_name(index['keys']): index for index in indexes}
+        for name, index in wanted.items():
+            if name not in live:
+                report['missing'].append((collection, name))
+        for name in live:
+            if name == '_id_':
+                continue
+            if name not in wanted:
+                report['extra'].append((collection, name))
+            elif (collection, name) not in used and not index_serves_constraint(wanted[name]):
+                report['unused'].append((collection, name))
+    return report
+
+
+def index_serves_constraint(index):
+    """
+    Unique indexes earn their keep by enforcing a constraint even if no shape uses them
+    """
+    return index.get('unique', False)
+
+
+@click.command('index-advisor')
+@click.option('--create', is_flag=True, help="Create the spec indexes that are missing.")
+@click.option('--drop', is_flag=True, help="Drop live indexes that are not in the spec.")
+def index_advisor_command(create, drop):
+    """
+    Command line interface to check the indexes against the app's query shapes
+    """
+    if get_storage().backend != 'mongo':
+        click.echo('The index advisor only applies to the mongo storage backend.')
+        return
+    db = get_db()
+    report = advise_indexes(db)
+
+    for shape in report['shapes']:
+        flag = 'COLLSCAN' if shape['collscan'] else 'ok'
+        indexes = ', '.join(shape['indexes']) or '-'
+        click.echo(f"[{flag}] {shape['name']}: {' <- '.join(shape['stages'])} ({indexes})")
+    for collection, name in report['missing']:
+        click.echo(f"Missing index: {collection}.{name}")
+    for collection, name in report['extra']:
+        click.echo(f"Index not in spec: {collection}.{name}")
+    for collection, name in report['unused']:
+        click.echo(f"Index unused by any query shape: {collection}.{name}")
+
+    if create and report['missing']:
+        ensure_indexes(db)
+        click.echo(f"Created {len(report['missing'])} indexes.")
+    if drop:
+        for collection, name in report['extra']:
+            db[collection].drop_index(name)
+        click.echo(f"Dropped {len(report['extra'])} indexes.")
+
+def reconcile_counters(batch_size=500):
+    """
+    Recompute the 'likes' and 'comments' counters on posts from the likes and
+    comments collections, writing only the posts whose counters drifted.
+    Returns the number of posts corrected.
+    """
+    storage = get_storage()
+    like_counts = storage.likes.count_by('post_id')
+    comment_counts = storage.comments.count_by('post_id')
+
+    def drifted():
+        for post in storage.posts.find({}, {'likes': 1, 'comments': 1}, batch_size=batch_size):
+            likes = like_counts.get(post['_id'], 0)
+            comments = comment_counts.get(post['_id'], 0)
+            if post.get('likes') != likes or post.get('comments') != comments:
+                yield post['_id'], {'likes': likes, 'comments': comments}
+
+    return storage.posts.update_many(drifted(), batch_size=batch_size)
+
+@click.command('reconcile-counters')
+def reconcile_counters_command():
+    """
+    Command line interface to repair drifted like/comment counters
+    """
+    fixed = reconcile_counters()
+    click.echo(f'Reconciled counters on {fixed} posts.')
+
 @click.command('init-db')
 @click.option('--test', is_flag=True, help="Initialize the test database instead of the production database.")
 def init_db_command(test):
@@ -128,4 +614,7 @@ def init_app(app):
     Initialize the Flask application with the database
     """
     app.teardown_appcontext(close_db)
-    app.cli.add_command(init_db_command)
\ No newline at end of file
+    reference_cache.ttl = app.config.get('REFERENCE_CACHE_TTL', reference_cache.ttl)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(reconcile_counters_command)
+    app.cli.add_command(index_advisor_command)
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""
+Materialized tag and category counts for the post index.
+
+tag_stats has one row per (tag, category) pair plus one per tag with a null
+category for its count across all categories; category_stats has one row per
+category. Writes to a post's tags or category apply the difference to these
+counts, so facets for a listing are a couple of indexed reads instead of an
+$unwind over every post. `flask rebuild-facets` recomputes them from the posts.
+"""
+from collections import Counter
+
+import click
+from bson.objectid import ObjectId
+
+from flaskr.storage import get_storage
+
+FACET_TAGS = 30
+MAX_FACET_TAGS = 100
+REBUILD_BATCH_SIZE = 1000
+
+
+def post_tags(post):
+    return {tag for tag in post.get('tags') or [] if tag}
+
+
+def facet_deltas(removed=(), added=()):
+    """
+    Count changes for tag_stats and category_stats when the `removed` posts
+    (their old versions) are replaced by the `added` ones. Returns
+    ({(tag, category): delta}, {category: delta}) without zero deltas.
+    """
+    tag_deltas = Counter()
+    category_deltas = Counter()
+    for posts, sign in ((removed, -1), (added, 1)):
+        for post in posts:
+            category = post.get('category')
+            category_deltas[category] += sign
+            for tag in post_tags(post):
+                tag_deltas[(tag, category)] += sign
+                tag_deltas[(tag, None)] += sign
+    return ({key: delta for key, delta in tag_deltas.items() if delta},
+            {key: delta for key, delta in category_deltas.items() if delta})
+
+
+def update_facets(storage, removed=(), added=()):
+    """
+    Apply the count changes of a post write to the materialized facets
+    """
+    tag_deltas, category_deltas = facet_deltas(removed, added)
+    if tag_deltas:
+        storage.tag_stats.upsert_counts(({'tag': tag, 'category': category}, {'count': delta})
+                                        for (tag, category), delta in tag_deltas.items())
+    if category_deltas:
+        storage.category_stats.upsert_counts(({'category': category}, {'count': delta})
+                                             for category, delta in category_deltas.items())
+    # Drop the rows a write emptied, so the tables only hold tags in use
+    emptied_tags = sorted({tag for (tag, _), delta in tag_deltas.items() if delta < 0})
+    if emptied_tags:
+        storage.tag_stats.delete_many({'tag': {'$in': emptied_tags}, 'count': {'$lte': 0}})
+    if any(delta < 0 for delta in category_deltas.values()):
+        storage.category_stats.delete_many({'count': {'$lte': 0}})
+
+
+def rebuild_facets(storage=None, batch_size=REBUILD_BATCH_SIZE):
+    """
+    Recompute tag_stats and category_stats from the posts.
+    Only the tags and category of each post are read, one cursor batch at a
+    time; memory grows with the number of distinct (tag, category) pairs.
+    Returns the number of tag and category rows written.
+    """
+    storage = storage or get_storage()
+    cursor = storage.posts.find({}, {'tags': 1, 'category': 1}, batch_size=batch_size)
+    tag_counts, category_counts = facet_deltas(added=cursor)
+
+    # Overwrite the rows in place, tagged with this build, then drop the rows
+    # it didn't write, so listings never see the tables empty
+    build = ObjectId()
+    storage.tag_stats.upsert_fields((({'tag': tag, 'category': category}, {'count': count, 'build': build})
+                                     for (tag, category), count in tag_counts.items()), batch_size=batch_size)
+    storage.category_stats.upsert_fields((({'category': category}, {'count': count, 'build': build})
+                                          for category, count in category_counts.items()), batch_size=batch_size)
+    storage.tag_stats.delete_many({'build': {'$ne': build}})
+    storage.category_stats.delete_many({'build': {'$ne': build}})
+    return len(tag_counts), len(category_counts)
+
+
+def get_facets(filters, limit=FACET_TAGS):
+    """
+    Top tags and per-category post counts for listing filters.
+    Each facet ignores its own filter, so the counts show what choosing
+    another value would give: tag counts are narrowed by the category, and
+    category counts by a single tag. Counts can't be narrowed by a text query
+    or by more than one tag; then 'exact' is False and those filters are ignored.
+    """
+    storage = get_storage()
+    category = filters.get('category') or None
+    tags = filters.get('tags') or []
+    tag = tags[0] if len(tags) == 1 else None
+
+    top_tags = storage.tag_stats.find({'category': category, 'count': {'$gt': 0}}, {'tag': 1, 'count': 1},
+                                      sort=[('count', -1), ('tag', 1)], limit=limit)
+    if tag is not None:
+        rows = storage.tag_stats.find({'tag': tag, 'category': {'$ne': None}}, {'category': 1, 'count': 1})
+    else:
+        rows = storage.category_stats.find({}, {'category': 1, 'count': 1})
+    categories = sorted(((row['category'], row['count']) for row in rows if row['count'] > 0),
+                        key=lambda item: (-item[1], str(item[0])))
+
+    if tag is not None:
+        total_row = storage.tag_stats.find_one({'tag': tag, 'category': category}, {'count': 1})
+        total = total_row['count'] if total_row else 0
+    elif category is not None:
+        total = dict(categories).get(category, 0)
+    else:
+        total = sum(count for _, count in categories)
+
+    return {
+        'tags': [{'tag': row['tag'], 'count': row['count']} for row in top_tags],
+        'categories': [{'category': name, 'count': count} for name, count in categories],
+        'total': total,
+        'exact': not filters.get('q') and len(tags) <= 1,
+    }
+
+
+@click.command('rebuild-facets')
+def rebuild_facets_command():
+    """
+    Command line interface to recompute the tag and category counts
+    """
+    tags, categories = rebuild_facets()
+    click.echo(f"Rebuilt facet counts for {tags} tag rows and {categories} categories.")
+
+
+def init_app(app):
+    """
+    Initialize the Flask application with the facet rebuild command
+    """
+    app.cli.add_command(rebuild_facets_command)
@@ -0,0 +1,71 @@
+"""
+Background flushing shared by the write-behind queues (counter buffers and
+the cascade delete queue).
+"""
+import atexit
+import os
+import threading
+import weakref
+
+# Flushers in this process that haven't been stopped; one exit hook flushes them all
+_flushers = weakref.WeakSet()
+
+
+def _stop_flushers():
+    for flusher in list(_flushers):
+        flusher.stop()
+
+
+atexit.register(_stop_flushers)
+
+
+class BackgroundFlusher:
+    """
+    Base class for work queued in memory and written by a background thread.
+    Subclasses guard their pending work with self._lock, call _queued after
+    adding to it and implement flush, which runs every `interval` seconds, as
+    soon as `max_size` items are pending, and once more on stop or exit.
+    """
+    thread_name = 'flusher'
+
+    def __init__(self, app, interval=1.0, max_size=100):
+        self.app = app
+        self.interval = interval
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+        _flushers.add(self)
+
+    def _ensure_thread(self):
+        # Threads don't survive fork, so each worker starts its own flusher
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def _queued(self, size):
+        """
+        Start the thread if needed and wake it once `size` items are pending.
+        Called with self._lock held.
+        """
+        self._ensure_thread()
+        if size >= self.max_size:
+            self._wake.set()
+
+    def flush(self):
+        raise NotImplementedError
+
+    def stop(self):
+        _flushers.discard(self)
+        self._stopped = True
+        self._wake.set()
+        self.flush()
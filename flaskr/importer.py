@@ -0,0 +1,283 @@
+import multiprocessing
+import os
+import re
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import click
+from pymongo.errors import BulkWriteError
+
+from flaskr.auth import normalize_key
+from flaskr.db import POSTS_GENERATION, bump_generation, invalidate_categories
+from flaskr.facets import update_facets
+from flaskr.render import render_fields
+from flaskr.search import search_fields
+from flaskr.storage import get_storage
+from flaskr.trending import get_half_life, trending_score
+
+NOTE_SUFFIXES = ('.md', '.markdown')
+IMPORT_BATCH_SIZE = 500
+# Server error code of a unique index violation
+DUPLICATE_KEY = 11000
+
+FRONT_MATTER = re.compile(r'\A---[ \t]*\r?\n(.*?)\r?\n(?:---|\.\.\.)[ \t]*(?:\r?\n|\Z)', re.S)
+HEADING = re.compile(r'^#[ \t]+(.+?)[ \t#]*$', re.M)
+
+
+def parse_scalar(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+        return value[1:-1]
+    return value
+
+
+def parse_front_matter(text):
+    """
+    Split a note into its front-matter and body.
+    Understands the YAML subset notes use: `key: value`, `key: [a, b]` and
+    `key:` followed by `- item` lines. Returns (fields, body).
+    """
+    match = FRONT_MATTER.match(text)
+    if match is None:
+        return {}, text
+    fields = {}
+    key = None
+    for line in match.group(1).splitlines():
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        item = re.match(r'^\s+-\s*(.*)$', line) or re.match(r'^-\s*(.*)$', line)
+        if item and key is not None:
+            if not isinstance(fields[key], list):
+                fields[key] = []
+            fields[key].append(parse_scalar(item.group(1)))
+            continue
+        if ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        key = key.strip().lower()
+        value = value.strip()
+        if value.startswith('[') and value.endswith(']'):
+            fields[key] = [parse_scalar(part) for part in value[1:-1].split(',') if part.strip()]
+        else:
+            fields[key] = parse_scalar(value)
+    return fields, text[match.end():]
+
+
+def parse_tags(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    return [tag.strip().lower() for tag in value or [] if tag.strip()]
+
+
+def parse_date(value):
+    """
+    The front-matter date as an aware datetime, or None if it isn't ISO 8601
+    """
+    try:
+        date = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
+def prepare_note(note):
+    """
+    Build the post fields for one note: front-matter, rendered HTML and search grams.
+    Runs in the render processes, so it takes and returns plain data.
+    """
+    import_key, path, text, default_category = note
+    fields, content = parse_front_matter(text)
+    heading = HEADING.search(content)
+    title = str(fields.get('title') or '').strip() or (heading.group(1) if heading else '') \
+        or os.path.splitext(os.path.basename(path))[0]
+    date = parse_date(fields['date']) if fields.get('date') else None
+    return {
+        'import_key': import_key,
+        'title': title,
+        'content': content,
+        'category': str(fields.get('category') or '').strip() or default_category,
+        'tags': parse_tags(fields.get('tags')),
+        'date': date,
+        **render_fields(content),
+        **search_fields(title, content),
+    }
+
+
+def read_notes(source):
+    """
+    Yield (path, raw bytes) for every Markdown note in a directory or a
+    zip/tar archive, in path order. Paths are relative with '/' separators.
+    """
+    def wanted(path):
+        parts = path.split('/')
+        return path.lower().endswith(NOTE_SUFFIXES) and not any(
+            part.startswith('.') or part == '__MACOSX' for part in parts)
+
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, files in os.walk(source):
+            for name in files:
+                paths.append(os.path.relpath(os.path.join(root, name), source).replace(os.sep, '/'))
+        for path in sorted(filter(wanted, paths)):
+            with open(os.path.join(source, path), 'rb') as f:
+                yield path, f.read()
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for path in sorted(name for name in archive.namelist() if not name.endswith('/') and wanted(name)):
+                yield path, archive.read(path)
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source, 'r:*') as archive:
+            members = sorted((member for member in archive.getmembers()
+                              if member.isfile() and wanted(member_path(member))),
+                             key=member_path)
+            for member in members:
+                yield member_path(member), archive.extractfile(member).read()
+    else:
+        raise click.UsageError(f"{source} is not a directory, zip or tar archive.")
+
+
+def member_path(member):
+    return member.name[2:] if member.name.startswith('./') else member.name
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_notes(source, creator_id, default_category='General', workers=None,
+                 batch_size=IMPORT_BATCH_SIZE, source_name=None, progress=None):
+    """
+    Import the Markdown notes in a directory or archive as posts by creator_id.
+    Each post keeps an import_key (source name and path), so running the import
+    again resumes it: notes already imported are skipped before any rendering.
+    Notes are rendered in a process pool (workers=0 renders in this process) and
+    inserted with unordered batches.
+    Returns counts of the notes found, imported, skipped and failed.
+    """
+    storage = get_storage()
+    posts = storage.posts
+    source_name = source_name or os.path.basename(os.path.normpath(source))
+    counts = {'found': 0, 'imported': 0, 'skipped': 0, 'failed': 0}
+    categories = set()
+    half_life = get_half_life()
+
+    def insert(prepared):
+        now = datetime.now(timezone.utc)
+        docs = []
+        for note in prepared:
+            created_at = note.pop('date') or now
+            categories.add(note['category'])
+            doc = {**note, 'creator_id': creator_id, 'created_at': created_at,
+                   'updated_at': created_at, 'likes': 0, 'comments': 0}
+            doc['trending'] = trending_score(doc, half_life)
+            docs.append(doc)
+        inserted = docs
+        try:
+            counts['imported'] += posts.insert_many(docs, ordered=False, batch_size=batch_size)
+        except BulkWriteError as e:
+            # Duplicate keys are notes another import got to first (and
+            # counted in the facets); any other error is a note that failed
+            counts['imported'] += e.details['nInserted']
+            for error in e.details['writeErrors']:
+                if error.get('code') == DUPLICATE_KEY:
+                    counts['skipped'] += 1
+                else:
+                    counts['failed'] += 1
+                    click.echo(f"Failed {docs[error['index']]['import_key']}: {error.get('errmsg')}", err=True)
+            failed = {error['index'] for error in e.details['writeErrors']}
+            inserted = [doc for index, doc in enumerate(docs) if index not in failed]
+        update_facets(storage, added=inserted)
+        if progress is not None:
+            progress(counts)
+
+    # Rendering is pure CPU, so it goes to processes rather than threads
+    pool = None
+    if workers != 0:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        in_flight = None
+        for batch in batched(read_notes(source), batch_size):
+            counts['found'] += len(batch)
+            keys = [f"{source_name}:{path}" for path, _ in batch]
+            done = {post['import_key'] for post in posts.find({'import_key': {'$in': keys}}, {'import_key': 1})}
+
+            notes = []
+            for key, (path, data) in zip(keys, batch):
+                if key in done:
+                    counts['skipped'] += 1
+                    continue
+                try:
+                    text = data.decode('utf-8-sig')
+                except UnicodeDecodeError:
+                    click.echo(f"Skipped {path}: not UTF-8.", err=True)
+                    counts['failed'] += 1
+                    continue
+                notes.append((key, path, text, default_category))
+            if not notes:
+                continue
+
+            if pool is None:
+                insert(map(prepare_note, notes))
+                continue
+            # The pool renders this batch while the previous one is inserted
+            prepared = pool.map(prepare_note, notes, chunksize=16)
+            if in_flight is not None:
+                insert(in_flight)
+            in_flight = prepared
+        if in_flight is not None:
+            insert(in_flight)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if counts['imported']:
+        new = storage.categories.ensure([{'name': name, 'description': f"Imported notes about {name}."}
+                                         for name in sorted(categories)])
+        if new:
+            invalidate_categories()
+        bump_generation(POSTS_GENERATION)
+    return counts
+
+
+@click.command('import-notes')
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--user', 'username', required=True, help="Username or email the notes are posted as.")
+@click.option('--category', default='General', show_default=True,
+              help="Category for notes without one in their front-matter.")
+@click.option('--workers', type=int, default=None,
+              help="Render processes (default: one per CPU; 0 renders in this process).")
+@click.option('--batch-size', type=int, default=IMPORT_BATCH_SIZE, show_default=True)
+@click.option('--source-name', help="Name recorded for resuming (default: the directory or archive name).")
+def import_notes_command(source, username, category, workers, batch_size, source_name):
+    """
+    Command line interface to import a directory or archive of Markdown notes
+    """
+    login_key = normalize_key(username)
+    user = get_storage().users.find_by_keys(login_key, login_key, username=username, email=username)
+    if user is None:
+        raise click.UsageError(f"No user named {username}.")
+
+    def progress(counts):
+        click.echo(f"Imported {counts['imported']} of {counts['found']} notes so far "
+                   f"({counts['skipped']} already imported).")
+
+    counts = import_notes(source, str(user['_id']), default_category=category, workers=workers,
+                          batch_size=batch_size, source_name=source_name, progress=progress)
+    click.echo(f"Imported {counts['imported']} notes, skipped {counts['skipped']} already imported, "
+               f"{counts['failed']} failed.")
+
+
+def init_app(app):
+    """
+    Initialize the Flask application with the import command
+    """
+    app.cli.add_command(import_notes_command)
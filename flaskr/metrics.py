@@ -0,0 +1,376 @@
+import contextvars
+import hmac
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from flask import Blueprint, Response, abort, before_render_template, current_app, jsonify, request, template_rendered
+from pymongo import monitoring
+
+from flaskr.db import plan_stages, get_client, get_pool_stats
+
+# Metrics are kept per worker process; scrape each worker (or aggregate) accordingly.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Commands that are driver chatter rather than app queries
+IGNORED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'saslStart', 'saslContinue',
+                    'endSessions', 'killCursors', 'buildInfo', 'explain'}
+EXPLAINABLE_COMMANDS = {'find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify'}
+
+slow_query_logger = logging.getLogger('flaskr.slow_query')
+
+bp = Blueprint('metrics', __name__)
+
+# Time spent per request in the database, Markdown rendering and templates
+_request_times = contextvars.ContextVar('request_times', default=None)
+
+
+class Histogram:
+    """
+    Prometheus-style cumulative histogram
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Registry:
+    """
+    Thread-safe store of labelled histograms
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, name, labels, value):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self.histograms.setdefault(name, {}).get(key)
+            if histogram is None:
+                histogram = self.histograms[name][key] = Histogram()
+            histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def render(self, help_texts):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# HELP {name} {help_texts.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{name}_bucket{_labels(key + (('le', str(bound)),))} {count}")
+                    lines.append(f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_labels(key)} {histogram.count}")
+        return lines
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+registry = Registry()
+
+HELP = {
+    'studyshare_request_seconds': 'Request latency by endpoint.',
+    'studyshare_request_db_seconds': 'Time spent in MongoDB commands per request.',
+    'studyshare_request_render_seconds': 'Time spent rendering Markdown per request.',
+    'studyshare_request_template_seconds': 'Time spent rendering Jinja templates per request.',
+    'studyshare_mongo_command_seconds': 'MongoDB command latency by command and collection.',
+    'studyshare_mongo_query_shape_seconds': 'MongoDB command latency by normalized query shape.',
+}
+
+
+def query_shape(value):
+    """
+    Replace the values in a filter/pipeline with '?' so queries that differ
+    only in their parameters share a shape
+    """
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            return [query_shape(item) for item in value]
+        return '?'
+    return '?'
+
+
+def command_shape(command_name, command):
+    """
+    Normalized shape of a command, as a compact JSON string
+    """
+    if command_name == 'find':
+        shape = {'filter': query_shape(command.get('filter', {})), 'sort': list(command.get('sort', {}))}
+    elif command_name == 'aggregate':
+        shape = [{stage: query_shape(body)} if stage == '$match' else stage
+                 for step in command.get('pipeline', []) for stage, body in step.items()]
+    elif command_name in ('update', 'delete'):
+        statements = command.get('updates' if command_name == 'update' else 'deletes') or [{}]
+        shape = query_shape(statements[0].get('q', {}))
+    elif command_name in ('count', 'findAndModify', 'distinct'):
+        shape = query_shape(command.get('query', {}))
+    else:
+        shape = None
+    return json.dumps(shape, sort_keys=True, default=str)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """
+    Records the latency of each MongoDB command by command, collection and
+    query shape, adds it to the current request's DB time, and hands commands
+    over the slow-query threshold to the slow query log
+    """
+    def __init__(self):
+        self._started = {}
+        self._lock = threading.Lock()
+        self.slow_log = None
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = command.get('collection', '')
+        info = {
+            'collection': collection,
+            'shape': command_shape(event.command_name, command),
+            'command': command if self.slow_log is not None else None,
+        }
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = info
+
+    def _finished(self, event):
+        with self._lock:
+            info = self._started.pop((event.connection_id, event.request_id), None)
+        if info is None:
+            return
+        seconds = event.duration_micros / 1e6
+        registry.observe('studyshare_mongo_command_seconds',
+                         {'command': event.command_name, 'collection': info['collection']}, seconds)
+        registry.observe('studyshare_mongo_query_shape_seconds',
+                         {'collection': info['collection'], 'shape': info['shape']}, seconds)
+        add_request_time('db', seconds)
+        if self.slow_log is not None and info['command'] is not None:
+            self.slow_log.check(event, info, seconds)
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+
+class SlowQueryLog:
+    """
+    Opt-in log of commands slower than a threshold.
+    The explain() plan of each slow query shape is captured once, on a
+    background thread so the request that hit it isn't slowed further.
+    The max_shapes most recently seen shapes are remembered as explained.
+    """
+    def __init__(self, app, threshold_ms, max_entries=100, max_shapes=1000):
+        self.app = app
+        self.threshold = threshold_ms / 1000
+        self.entries = deque(maxlen=max_entries)
+        self.max_shapes = max_shapes
+        self._explained = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=100)
+        self._thread = threading.Thread(target=self._run, name='slow-query-log', daemon=True)
+        self._thread.start()
+
+    def check(self, event, info, seconds):
+        if seconds < self.threshold or event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        key = (info['collection'], info['shape'])
+        # Called from every thread that talks to MongoDB
+        with self._lock:
+            if key in self._explained:
+                self._explained[key] += 1
+                self._explained.move_to_end(key)
+                return
+            self._explained[key] = 1
+            if len(self._explained) > self.max_shapes:
+                self._explained.popitem(last=False)
+        command = {name: value for name, value in info['command'].items()
+                   if not name.startswith('$') and name not in ('lsid', 'txnNumber')}
+        try:
+            self._queue.put_nowait((event.database_name, info, command, seconds))
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            database_name, info, command, seconds = self._queue.get()
+            entry = {'collection': info['collection'], 'shape': info['shape'],
+                     'duration_ms': round(seconds * 1000, 3)}
+            try:
+                plan = get_client(self.app)[database_name].command(
+                    {'explain': command, 'verbosity': 'queryPlanner'})['queryPlanner']['winningPlan']
+                stages = [stage for stage in plan_stages(plan) if 'stage' in stage]
+                entry['stages'] = [stage['stage'] for stage in stages]
+                entry['indexes'] = sorted({stage['indexName'] for stage in stages if 'indexName' in stage})
+            except Exception as e:
+                entry['explain_error'] = str(e)
+            self.entries.append(entry)
+            slow_query_logger.warning("Slow query on %s (%.1f ms): %s plan=%s", entry['collection'],
+                                      entry['duration_ms'], entry['shape'], entry.get('stages'))
+
+
+command_metrics = CommandMetrics()
+monitoring.register(command_metrics)
+
+
+def add_request_time(kind, seconds):
+    """
+    Add time to one of the current request's buckets ('db', 'render', 'template')
+    """
+    times = _request_times.get()
+    if times is not None:
+        times[kind] += seconds
+
+
+@contextmanager
+def timed(kind):
+    """
+    Time a block and add it to the current request's bucket
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_request_time(kind, time.perf_counter() - start)
+
+
+def _start_request():
+    _request_times.set({'start': time.perf_counter(), 'db': 0.0, 'render': 0.0, 'template': 0.0,
+                        'template_started': None})
+
+
+def _finish_request(response):
+    times = _request_times.get()
+    if times is None:
+        return response
+    endpoint = request.endpoint or 'unknown'
+    labels = {'endpoint': endpoint, 'method': request.method}
+    registry.observe('studyshare_request_seconds', labels, time.perf_counter() - times['start'])
+    registry.observe('studyshare_request_db_seconds', labels, times['db'])
+    registry.observe('studyshare_request_render_seconds', labels, times['render'])
+    registry.observe('studyshare_request_template_seconds', labels, times['template'])
+    _request_times.set(None)
+    return response
+
+
+def _template_started(sender, template, context, **extra):
+    times = _request_times.get()
+    if times is not None:
+        times['template_started'] = time.perf_counter()
+
+
+def _template_finished(sender, template, context, **extra):
+    times = _request_times.get()
+    if times is not None and times['template_started'] is not None:
+        times['template'] += time.perf_counter() - times['template_started']
+        times['template_started'] = None
+
+
+def _gauges():
+    """
+    Point-in-time values from the connection pool and caches
+    """
+    from flaskr.cache import get_response_cache
+    from flaskr.compress import get_compressor
+    from flaskr.render import block_cache, html_cache
+
+    gauges = {}
+    for name, value in get_pool_stats().items():
+        if name != 'pid':
+            gauges[f'studyshare_mongo_pool_{name}'] = value
+    for name, value in html_cache.stats().items():
+        gauges[f'studyshare_render_cache_{name}'] = value
+    for name, value in block_cache.stats().items():
+        gauges[f'studyshare_render_block_cache_{name}'] = value
+    cache = get_response_cache()
+    if cache is not None:
+        for name, value in cache.stats().items():
+            gauges[f'studyshare_response_cache_{name}'] = value
+    compressor = get_compressor()
+    if compressor is not None:
+        for name, value in compressor.stats().items():
+            gauges[f'studyshare_compress_{name}'] = value
+    autocomplete = current_app.extensions.get('autocomplete')
+    if autocomplete is not None:
+        for name, value in autocomplete.stats().items():
+            gauges[f'studyshare_autocomplete_{name}'] = value
+    return gauges
+
+
+@bp.before_request
+def require_token():
+    """
+    The endpoints are off unless METRICS_TOKEN is set, and then need it as a bearer token
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        abort(404)
+    # compare_digest only takes ASCII str, so compare bytes: a non-ASCII header is a 403, not a 500
+    supplied = request.headers.get('Authorization', '').encode('utf-8', 'surrogateescape')
+    if not hmac.compare_digest(supplied, f"Bearer {token}".encode('utf-8', 'surrogateescape')):
+        abort(403)
+
+
+@bp.route('/metrics')
+def metrics():
+    """
+    Prometheus text exposition of this worker's metrics
+    """
+    lines = registry.render(HELP)
+    for name, value in sorted(_gauges().items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/metrics/slow-queries')
+def slow_queries():
+    """
+    Recent slow queries with their explain() plans, newest first
+    """
+    slow_log = command_metrics.slow_log
+    return jsonify(list(reversed(slow_log.entries)) if slow_log is not None else [])
+
+
+def init_app(app):
+    """
+    Initialize the Flask application with request timing and the metrics endpoints
+    """
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.register_blueprint(bp)
+
+    threshold = app.config.get('SLOW_QUERY_MS')
+    if threshold and command_metrics.slow_log is None:
+        command_metrics.slow_log = SlowQueryLog(app, threshold)
@@ -0,0 +1,105 @@
+import base64
+import json
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(value, doc_id):
+    """
+    Encode a (sort value, _id) pair into an opaque, URL-safe cursor string
+    """
+    if isinstance(value, datetime):
+        value = {'$date': value.isoformat()}
+    payload = json.dumps([value, str(doc_id)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Decode a cursor made by encode_cursor.
+    Returns None for an empty token and raises ValueError for a malformed one.
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        value, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if isinstance(value, dict) and '$date' in value:
+            value = datetime.fromisoformat(value['$date'])
+        return value, ObjectId(doc_id)
+    except Exception as e:
+        raise ValueError(f"Invalid page cursor: {token}") from e
+
+
+def keyset_match(field, direction, cursor):
+    """
+    Build the filter that resumes a (field, _id) ordering after the cursor
+    """
+    value, doc_id = cursor
+    op = '$lt' if direction < 0 else '$gt'
+    return {'$or': [
+        {field: {op: value}},
+        {field: value, '_id': {op: doc_id}},
+    ]}
+
+
+def page_pipeline(match, field, direction, page_size, after=None, before=None,
+                  add_fields=None, projection=None):
+    """
+    Build an aggregation pipeline that returns one keyset page (plus one extra
+    document to detect whether another page exists).
+    When paging backwards the order is flipped; finish_page flips it back.
+    """
+    if before is not None:
+        direction = -direction
+    cursor = before if before is not None else after
+
+    pipeline = [{'$match': match or {}}]
+    if add_fields:
+        pipeline.append({'$addFields': add_fields})
+    if cursor is not None:
+        pipeline.append({'$match': keyset_match(field, direction, cursor)})
+    pipeline.append({'$sort': {field: direction, '_id': direction}})
+    pipeline.append({'$limit': page_size + 1})
+    if projection:
+        pipeline.append({'$project': projection})
+    return pipeline
+
+
+def finish_page(docs, field, page_size, after=None, before=None):
+    """
+    Trim the extra document fetched by page_pipeline and work out the cursors.
+    Returns a dict with the page 'items' and the 'next'/'prev' cursors (or None).
+    """
+    docs = list(docs)
+    has_more = len(docs) > page_size
+    docs = docs[:page_size]
+
+    if before is not None:
+        docs.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+
+    next_cursor = prev_cursor = None
+    if docs and has_next:
+        next_cursor = encode_cursor(docs[-1].get(field), docs[-1]['_id'])
+    if docs and has_prev:
+        prev_cursor = encode_cursor(docs[0].get(field), docs[0]['_id'])
+
+    return {'items': docs, 'next': next_cursor, 'prev': prev_cursor}
+
+
+def get_page_size(args, default=DEFAULT_PAGE_SIZE):
+    """
+    Read the requested page size from the query args, clamped to MAX_PAGE_SIZE
+    """
+    try:
+        page_size = int(args.get('per_page', default))
+    except (TypeError, ValueError):
+        page_size = default
+    return max(1, min(page_size, MAX_PAGE_SIZE))
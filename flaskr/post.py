@@ -1,206 +1,315 @@
-from flask import Blueprint, render_template, request, redirect, url_for, g, flash
+from flask import (Blueprint, render_template, request, redirect, url_for, g, flash, current_app, jsonify,
+                   make_response, session)
 from werkzeug.exceptions import abort
 from datetime import datetime, timezone
 from bson.objectid import ObjectId
-import re
-import markdown
 
-from flaskr.db import get_db
+from flaskr.db import POSTS_GENERATION, bump_generation, get_categories, get_generation
+from flaskr.storage import get_storage
+from flaskr.cache import get_response_cache, listing_key
+from flaskr.conditional import add_validators, is_conditional, make_etag, not_modified
+from flaskr.cleanup import cascade_delete
+from flaskr.counters import get_counter_buffer, increment, pending_delta
+from flaskr.facets import FACET_TAGS, MAX_FACET_TAGS, get_facets, update_facets
+from flaskr.related import related_posts, update_related
 from flaskr.auth import login_required
+from flaskr.autocomplete import KINDS, MAX_SUGGESTIONS, SUGGESTIONS, get_autocomplete, update_autocomplete
+from flaskr.render import RENDERER_VERSION, get_post_html, render_fields
+from flaskr.search import search_fields
+from flaskr.trending import get_half_life, trending_score
+from flaskr.pagination import DEFAULT_PAGE_SIZE, decode_cursor, get_page_size
 
 
 
 bp = Blueprint('post', __name__, url_prefix='/post')
 
+# Listings only render titles and links, so never pull note bodies for them
+LIST_PROJECTION = {'content': 0, 'content_html': 0, 'search_grams': 0,
+                   'related': 0, 'related_terms': 0, 'related_weights': 0}
+# The view reads pre-rendered HTML through flaskr.render instead of the raw note
+VIEW_PROJECTION = {'content': 0, 'content_html': 0, 'search_grams': 0, 'related_terms': 0, 'related_weights': 0}
+# Just what post_validators needs to answer a conditional GET
+VALIDATOR_PROJECTION = {'updated_at': 1, 'activity_at': 1, 'related_at': 1, 'likes': 1, 'comments': 1}
+EMPTY_PAGE = {'items': [], 'next': None, 'prev': None}
+
 @bp.route('/')
 def index():
     """
     Display all posts.
     Allows searching by title, content, tags, and category.
-    Supports sorting by relevance, popularity, title, or created_at.
+    Supports sorting by relevance, popularity, trending, title, or created_at.
     """
-    search_query = request.args.get('q', '').strip()
-    require_all_tags = request.args.get('require_all_tags', 'false') == 'true'
-    search_tags = request.args.getlist('tags')
-    search_category = request.args.get('category', '')
-    search_sort = request.args.get('sort', 'created_at')
-    
-    mongo_query = {}
-    
-    if search_query:
-        escaped_query = re.escape(search_query)
-        mongo_query['$or'] = [
-            {'title': {'$regex': escaped_query, '$options': 'i'}},
-            {'content': {'$regex': escaped_query, '$options': 'i'}}
-        ]
-    
-    if search_tags:
-        cleaned_tags = [tag.strip().lower() for tag in search_tags if tag.strip()]
-        if cleaned_tags:
-            if require_all_tags:
-                mongo_query['tags'] = {'$all': cleaned_tags}
-            else:
-                mongo_query['tags'] = {'$in': cleaned_tags}
-    
-    if search_category:
-        mongo_query['category'] = search_category
-    
-    db = get_db()
-    posts = None
+    # Any write to posts bumps the generation, so it validates every listing
+    generation = get_generation(POSTS_GENERATION)
+    etag = make_etag('index', generation, sorted(request.args.items(multi=True)))
+    response = not_modified(etag)
+    if response is not None:
+        return response
     
-    final_query = mongo_query.copy()
+    cache = get_response_cache()
+    if cache is not None and g.user is None and not session.get('_flashes'):
+        # Anonymous pages are identical for everyone, so share them
+        html = cache.get_or_compute(f"index:{generation}:{listing_key(request.args)}", render_index)
+    else:
+        html, _ = render_index()
+    return add_validators(make_response(html), etag)
+
+def render_index():
+    """
+    Render the post index for the current request args.
+    Returns (html, cacheable); pages that flashed a message are not cacheable.
+    """
+    params = listing_params()
+    page = fetch_index_page(get_storage().posts, params)
+    return render_index_page(params, page, get_categories(), get_facets(params['filters']))
+
+def listing_params():
+    """
+    Parse the listing filters, sort, cursors and page size from the request args
+    """
+    params = {
+        'filters': listing_filters(),
+        'sort': request.args.get('sort', 'created_at'),
+    }
+    try:
+        params['after'] = decode_cursor(request.args.get('after'))
+        params['before'] = decode_cursor(request.args.get('before'))
+    except ValueError:
+        flash("Invalid page cursor. Showing the first page.")
+        params['after'] = params['before'] = None
+    params['page_size'] = get_page_size(request.args, current_app.config.get('POSTS_PER_PAGE', DEFAULT_PAGE_SIZE))
+    return params
+
+def listing_filters():
+    """
+    Parse the search, tag and category filters from the request args
+    """
+    # The tag box submits one comma separated value; links repeat the parameter
+    search_tags = [tag for value in request.args.getlist('tags') for tag in value.split(',')]
+    return {
+        'q': request.args.get('q', '').strip(),
+        'tags': [tag.strip().lower() for tag in search_tags if tag.strip()],
+        'require_all_tags': request.args.get('require_all_tags', 'false') == 'true',
+        'category': request.args.get('category', ''),
+    }
+
+def fetch_index_page(posts_repo, params):
+    """
+    Fetch the listing page for parsed params, falling back to time sort when the
+    requested sort fails. Problems are flashed; the page is empty if nothing worked.
+    """
+    filters = params['filters']
+    search_sort = params['sort']
+    after, before, page_size = params['after'], params['before'], params['page_size']
+    page = EMPTY_PAGE
     
     if search_sort == 'relevance':
-        if search_query:
-            text_search_query = final_query.copy()
-            # $or condition CANNOT be used with $text search in MongoDB
-            text_search_query.pop('$or', None)  # Remove the $or key if it exists
-            
-            text_search_query['$text'] = {'$search': search_query}
-            
-            try:    
-                posts = db.posts.find(
-                    text_search_query, 
-                    {'score': {'$meta': 'textScore'}}
-                ).sort([('score', {'$meta': 'textScore'})])
+        if filters['q']:
+            try:
+                page = fetch_posts_page(posts_repo, filters, 'relevance', after, before, page_size)
             except Exception as e:
                 flash(f"An error occurred while fetching posts sorted by relevance: {str(e)}")
                 try:
-                    posts = db.posts.find(mongo_query).sort('created_at', -1)
+                    page = fetch_posts_page(posts_repo, filters, 'created_at', None, None, page_size)
                 except Exception as e_fallback:
                     flash(f"An error occurred while fetching posts: {str(e_fallback)}")
-                    posts = []
         else:
             flash("Search query is empty. Defaulting to time sort.")
             try:
-                posts = db.posts.find(mongo_query).sort('created_at', -1)
+                page = fetch_posts_page(posts_repo, filters, 'created_at', after, before, page_size)
             except Exception as e:
                 flash(f"An error occurred while fetching posts: {str(e)}")
-                posts = []
         
     elif search_sort == 'popularity':
         try:
-            posts = db.posts.aggregate([
-                {'$match': mongo_query or {}},
-                {'$lookup': {
-                    'from': 'likes',
-                    'localField': '_id',
-                    'foreignField': 'post_id',
-                    'as': 'likes'
-                }},
-                {'$addFields': {'like_count': {'$size': '$likes'}}},
-                {'$sort': {'like_count': -1}}
-            ])
+            # posts.likes is kept as a counter by like_post, so sort on it directly
+            page = fetch_posts_page(posts_repo, filters, 'likes', after, before, page_size)
         except Exception as e:
             flash(f"An error occurred while fetching posts sorted by popularity: {str(e)}")
             try:
-                posts = db.posts.find(mongo_query).sort('created_at', -1)
+                page = fetch_posts_page(posts_repo, filters, 'created_at', None, None, page_size)
+            except Exception as e_fallback:
+                flash(f"An error occurred while fetching posts: {str(e_fallback)}")
+    
+    elif search_sort == 'trending':
+        try:
+            # Scores are stored and indexed, so this is a plain keyset scan
+            page = fetch_posts_page(posts_repo, filters, 'trending', after, before, page_size)
+        except Exception as e:
+            flash(f"An error occurred while fetching trending posts: {str(e)}")
+            try:
+                page = fetch_posts_page(posts_repo, filters, 'created_at', None, None, page_size)
             except Exception as e_fallback:
                 flash(f"An error occurred while fetching posts: {str(e_fallback)}")
-                posts = []
     
     elif search_sort in ['title', 'created_at']:
         try:
-            posts = db.posts.find(mongo_query).sort(search_sort, -1)
+            page = fetch_posts_page(posts_repo, filters, search_sort, after, before, page_size)
         except Exception as e:
             flash(f"An error occurred while fetching posts sorted by {search_sort}: {str(e)}")
-            posts = []
     else:
         flash("Invalid sort option. Defaulting to time sort.")
         try:
-            posts = db.posts.find(mongo_query).sort('created_at', -1)
+            page = fetch_posts_page(posts_repo, filters, 'created_at', after, before, page_size)
         except Exception as e:
             flash(f"An error occurred while fetching posts: {str(e)}")
-            posts = []
-    
-    search_query = request.args.get('q', '')
-    search_tags = request.args.getlist('tags')
+    return page
+
+def render_index_page(params, page, categories, facets):
+    """
+    Render a fetched listing page with its facet counts.
+    Returns (html, cacheable); pages that flashed a message are not cacheable.
+    """
+    posts = [serialize_post(post) for post in page['items']]
+    category_counts = {item['category']: item['count'] for item in facets['categories']}
     
-    posts = [serialize_post(post) for post in posts]
+    # Keep the current filters on the next/prev links, swapping only the cursor
+    page_args = request.args.to_dict(flat=False)
+    page_args.pop('after', None)
+    page_args.pop('before', None)
+    next_url = url_for('post.index', after=page['next'], **page_args) if page['next'] else None
+    prev_url = url_for('post.index', before=page['prev'], **page_args) if page['prev'] else None
     
-    return render_template('post/index.html',
+    cacheable = not session.get('_flashes')
+    html = render_template('post/index.html',
                            posts=posts,
-                           search_query=search_query,
-                           require_all_tags=require_all_tags,
-                           search_tags=search_tags,
-                           search_category=search_category,
-                           categories=list(db.categories.find()))
+                           search_query=request.args.get('q', ''),
+                           require_all_tags=params['filters']['require_all_tags'],
+                           search_tags=request.args.getlist('tags'),
+                           search_category=params['filters']['category'],
+                           search_sort=params['sort'],
+                           next_url=next_url,
+                           prev_url=prev_url,
+                           categories=categories,
+                           category_counts=category_counts,
+                           top_tags=facets['tags'])
+    return html, cacheable
+
+def fetch_posts_page(posts_repo, filters, sort, after, before, page_size):
+    """
+    Fetch one keyset page of posts ordered by sort (descending) then _id.
+    Post content is projected away since listings only show titles.
+    """
+    return posts_repo.find_page(filters, sort, after=after, before=before, page_size=page_size,
+                                projection=LIST_PROJECTION)
+
+@bp.route('/facets', methods=('GET',))
+def facets():
+    """
+    Return the top tags and per-category post counts for the listing filters
+    in the request args (q, tags, category) as JSON, from the materialized counts
+    """
+    generation = get_generation(POSTS_GENERATION)
+    etag = make_etag('facets', generation, sorted(request.args.items(multi=True)))
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    
+    limit = max(1, min(request.args.get('limit', FACET_TAGS, type=int), MAX_FACET_TAGS))
+    return add_validators(jsonify(get_facets(listing_filters(), limit=limit)), etag)
+
+@bp.route('/autocomplete', methods=('GET',))
+def autocomplete():
+    """
+    Suggest tags and post titles starting with the typed prefix (q) as JSON.
+    Answered from this worker's in-memory prefix index; `kind` narrows it to tags or titles.
+    """
+    index = get_autocomplete()
+    index.check(get_storage())
+    kinds = [kind for kind in request.args.getlist('kind') if kind in KINDS] or KINDS
+    limit = max(1, min(request.args.get('limit', SUGGESTIONS, type=int), MAX_SUGGESTIONS))
+    return jsonify(index.suggest(request.args.get('q', ''), kinds, limit))
 
 @bp.route('/<post_id>/view', methods=('GET',))
 def view(post_id):
     """
     View a specific post by its ID, but only if it was not created by the current user.
+    The post, its creator and the first page of comments come from one aggregation;
+    later comment pages are loaded from post.comments.
     """
-    db = get_db()
-    post = db.posts.find_one({'_id': ObjectId(post_id)})
+    storage = get_storage()
+    
+    if is_conditional():
+        # Answer revalidation from the post's counters before fetching anything heavy
+        meta = storage.posts.get(ObjectId(post_id), VALIDATOR_PROJECTION)
+        if meta is None:
+            abort(404, f"Post id {post_id} doesn't exist.")
+        response = not_modified(*post_validators(meta))
+        if response is not None:
+            return response
+    
+    page_size = current_app.config.get('COMMENTS_PER_PAGE', DEFAULT_PAGE_SIZE)
+    post = storage.posts.get_view(ObjectId(post_id), VIEW_PROJECTION, comments_page_size=page_size)
 
     if post is None:
         abort(404, f"Post id {post_id} doesn't exist.")
     
-    creator = "Unknown User"
-    creator_id = post.get('creator_id')
-    if creator_id:
-        try:
-            doc = db.users.find_one({'_id': ObjectId(creator_id)})
-            if doc:
-                creator = doc.get('username', 'Unknown User')
-        except Exception as e:
-            flash(f"An error occurred while fetching the creator's username for creator_id {creator_id}: {str(e)}")
-      
-    pipeline = [
-        {'$match': {'post_id': ObjectId(post_id)}},  # Match the specific post ID
-        {
-            '$lookup': {
-                'from': 'users',
-                'localField': 'creator_id',
-                'foreignField': '_id',
-                'as': 'creator'
-            }
-        },
-        {
-            '$unwind': {
-                'path': '$creator',
-                'preserveNullAndEmptyArrays': True  # Keep the comment even if there's no user match
-            }
-        },
-        {
-            '$sort': {'created_at': 1} 
-        },
-        {
-            '$project': {
-                '_id': 0,
-                'username': '$creator.username',
-                'content': '$comment',
-                'created_at': '$created_at',
-                'user_id': '$creator_id',
-            }
-        }
-    ]
+    # HTML is rendered at create/edit time; this only reads it (or the LRU)
+    return render_view(post_id, post, post['creator'], post['comment_page'], get_post_html(post),
+                       related_posts(storage, post))
+
+def render_view(post_id, post, creator, page, rendered_content, related=()):
+    """
+    Render a fetched post with its creator's username, first comment page
+    and related notes, with the validators for later conditional GETs
+    """
+    validators = post_validators(post)
     
-    comments = list(db.comments.aggregate(pipeline))
+    # Show likes this worker has buffered but not yet written
+    post['likes'] = post.get('likes', 0) + pending_delta('posts', post['_id'], 'likes')
     
-    if comments:
-        for comment in comments:
-            if not comment.get('username'):
-                comment['username'] = 'Unknown User'
-            
-            comment['content'] = comment.get('content', '')
-            comment['created_at'] = comment['created_at'].astimezone().strftime('%Y-%m-%d %H:%M:%S %Z')
-            
+    comments = [serialize_comment(comment) for comment in page['items']]
+    comments_url = url_for('post.comments', post_id=post_id, after=page['next']) if page['next'] else None
+    
+    response = make_response(render_template('post/view.html', post=serialize_post(post), comments=comments,
+                                              comments_url=comments_url, rendered_content=rendered_content,
+                                              creator=creator or "Unknown User", related=related))
+    return add_validators(response, *validators)
 
-            
-    raw_content = post.get('content', '')
-    rendered_content = ''
-    if raw_content:
-        rendered_content = markdown.markdown(
-            raw_content, extensions=['fenced_code', 'codehilite', 'tables', 'extra'])    
+def post_validators(post):
+    """
+    ETag and Last-Modified for a post's view page.
+    Likes, comments and related notes don't touch updated_at, so their counts
+    and times are part of the ETag and their latest change is part of Last-Modified.
+    """
+    likes = post.get('likes', 0) + pending_delta('posts', post['_id'], 'likes')
+    etag = make_etag('view', post['_id'], post.get('updated_at'), post.get('related_at'), post.get('comments', 0),
+                     likes, RENDERER_VERSION)
+    last_modified = max(filter(None, [post.get('updated_at'), post.get('activity_at'), post.get('related_at')]),
+                        default=None)
+    return etag, last_modified
+
+@bp.route('/<post_id>/comments', methods=('GET',))
+def comments(post_id):
+    """
+    Return a page of a post's comments as JSON, oldest first.
+    Pages are chained with the 'after' cursor returned as 'next'.
+    """
+    try:
+        after = decode_cursor(request.args.get('after'))
+    except ValueError as e:
+        abort(400, str(e))
+    page_size = get_page_size(request.args, current_app.config.get('COMMENTS_PER_PAGE', DEFAULT_PAGE_SIZE))
     
-    return render_template('post/view.html', post=serialize_post(post), comments=comments, rendered_content=rendered_content, creator=creator)  
+    page = get_storage().comments.find_page(ObjectId(post_id), after=after, page_size=page_size)
+    
+    next_url = url_for('post.comments', post_id=post_id, after=page['next'], per_page=page_size) if page['next'] else None
+    return jsonify({
+        'comments': [serialize_comment(comment) for comment in page['items']],
+        'next': next_url,
+    })
+
+def serialize_comment(comment):
+    return {
+        'username': comment.get('username') or 'Unknown User',
+        'content': comment.get('content', ''),
+        'created_at': comment['created_at'].astimezone().strftime('%Y-%m-%d %H:%M:%S %Z'),
+        'user_id': str(comment.get('user_id', '')),
+    }
 
 @bp.route('/create', methods=('GET', 'POST'))
 @login_required
 def create():
-    db = get_db()
     if request.method == 'POST':
         title = request.form['title']
         content  = request.form['content']
@@ -214,7 +323,8 @@ def create():
             flash(error)
         else:
             now = datetime.now(timezone.utc)
-            db.posts.insert_one({
+            storage = get_storage()
+            new_post = {
                 'title': title,
                 'content': content,
                 'category': request.form.get('category', 'General'),
@@ -223,17 +333,24 @@ def create():
                 'updated_at': now,
                 'tags': tags,
                 'likes': 0,
-                'comments': 0
-            })
+                'comments': 0,
+                **render_fields(content),
+                **search_fields(title, content)
+            }
+            new_post['trending'] = trending_score(new_post, get_half_life())
+            storage.posts.insert(new_post)
+            update_facets(storage, added=[new_post])
+            update_related(storage, new_post['_id'], new_post)
+            generation = bump_generation(POSTS_GENERATION)
+            update_autocomplete(new_post['_id'], new=new_post, generation=generation)
             flash('Post created successfully.')
             return redirect(url_for('post.index'))
 
-    return render_template('post/create.html', categories=list(db.categories.find()))
+    return render_template('post/create.html', categories=get_categories())
 
 @bp.route('/<post_id>/edit', methods=('GET', 'POST'))
 @login_required
 def edit(post_id):
-    db = get_db()
     post = get_post(post_id)
     
     
@@ -244,27 +361,38 @@ def edit(post_id):
         tags = request.form['tags'].split(',')
         
         now = datetime.now(timezone.utc)
-        db.posts.update_one(
-            {'_id': ObjectId(post_id)},
-            {'$set': {
-                'title': title,
-                'content': content,
-                'category': category,
-                'tags': [tag.strip() for tag in tags],
-                'updated_at': now
-            }}
-        )
+        storage = get_storage()
+        fields = {
+            'title': title,
+            'content': content,
+            'category': category,
+            # Normalized as on create, so edited tags match tag filters and facets
+            'tags': [tag.strip().lower() for tag in tags if tag.strip()],
+            'updated_at': now,
+            **render_fields(content),
+            **search_fields(title, content)
+        }
+        storage.posts.update(ObjectId(post_id), fields)
+        update_facets(storage, removed=[post], added=[fields])
+        update_related(storage, ObjectId(post_id), fields)
+        generation = bump_generation(POSTS_GENERATION)
+        update_autocomplete(post_id, old=post, new={**post, **fields}, generation=generation)
         flash('Post updated successfully.')
         return redirect(url_for('post.index'))
-    return render_template('post/edit.html', post=post, categories=list(db.categories.find()))
+    return render_template('post/edit.html', post=post, categories=get_categories())
 
 @bp.route('/<post_id>/delete', methods=('POST',))
 @login_required
 def delete(post_id):
-    get_post(post_id)
-    db = get_db()
+    post = get_post(post_id)
 
-    db.posts.delete_one({'_id': ObjectId(post_id)})
+    storage = get_storage()
+    post_oid = ObjectId(post_id)
+    if storage.posts.delete(post_oid):
+        update_facets(storage, removed=[post])
+    cascade_delete(storage, post_oid)
+    generation = bump_generation(POSTS_GENERATION)
+    update_autocomplete(post_id, old=post, generation=generation)
     
     flash('Post deleted successfully.')
     return redirect(url_for('post.index'))
@@ -272,35 +400,56 @@ def delete(post_id):
 @bp.route('/<post_id>/like', methods=('POST',))
 @login_required
 def like_post(post_id):
-    db = get_db()
-    post = db.posts.find_one({'_id': ObjectId(post_id)})
+    """
+    Toggle the current user's like on a post.
+    The likes write decides the sign of the counter update: inserting the like
+    counts +1, and if the unique (post_id, user_id) index rejects it the like is
+    deleted instead and counts -1 (or nothing, if a concurrent toggle deleted it
+    first). That update then moves likes, activity_at and trending in one
+    write. The likes write and the posts update are still two operations, so a
+    crash between them can leave the count one off.
+    """
+    storage = get_storage()
+    like_post_id = ObjectId(post_id)
+    user_id = g.user['user_id']
+    buffered = get_counter_buffer() is not None
     
-    if post is None:
+    # Buffered counter writes can't report a missing post, so check up front
+    if buffered and not storage.posts.exists(like_post_id):
         abort(404, f"Post id {post_id} doesn't exist.")
     
-    like = db.likes.find_one({'post_id': ObjectId(post_id), 'user_id': g.user['user_id']})
-    
-    if like:
-        # User already liked the post, so remove the like
-        db.likes.delete_one({'post_id': ObjectId(post_id), 'user_id': g.user['user_id']})
-        db.posts.update_one({'_id': ObjectId(post_id)}, {'$inc': {'likes': -1}})
-        flash('Post unliked successfully.')
+    if storage.likes.add(like_post_id, user_id):
+        delta = 1
+        message = 'Post liked successfully.'
     else:
-        # User has not liked the post yet, so add the like
-        db.likes.insert_one({'post_id': ObjectId(post_id), 'user_id': g.user['user_id']})
-        db.posts.update_one({'_id': ObjectId(post_id)}, {'$inc': {'likes': 1}})
-        flash('Post liked successfully.')
+        # User already liked the post, so the toggle removes the like
+        delta = -1 if storage.likes.remove(like_post_id, user_id) else 0
+        message = 'Post unliked successfully.'
+    
+    if buffered:
+        # Buffered counts rescore and bump the generation when flushed
+        increment(storage, 'posts', like_post_id, 'likes', delta)
+    elif delta and not storage.posts.increment(like_post_id, {'likes': delta}, touch='activity_at',
+                                               half_life=get_half_life()):
+        # No such post: undo the like change so no orphan is left behind
+        if delta > 0:
+            storage.likes.remove(like_post_id, user_id)
+        else:
+            storage.likes.add(like_post_id, user_id)
+        abort(404, f"Post id {post_id} doesn't exist.")
+    elif delta:
+        bump_generation(POSTS_GENERATION)
     
+    flash(message)
     return redirect(url_for('post.view', post_id = post_id))
 
 
 @bp.route('/<post_id>/comment', methods=('POST', 'GET'))
 @login_required
 def comment_post(post_id):
-    db = get_db()
+    storage = get_storage()
     
-    post_exists = db.posts.count_documents({'_id': ObjectId(post_id)}) > 0
-    if not post_exists:
+    if not storage.posts.exists(ObjectId(post_id)):
         abort(404, f"Post id {post_id} doesn't exist.")
     
     if request.method == 'POST':
@@ -309,14 +458,16 @@ def comment_post(post_id):
             flash('Comment cannot be empty.')
         else:
             now = datetime.now(timezone.utc)
-            db.comments.insert_one({
+            storage.comments.insert({
                 'post_id': ObjectId(post_id),
                 'creator_id': ObjectId(g.user['user_id']),
                 'created_at': now,
                 'updated_at': now,
                 'comment': comment_content,
             })
-            db.posts.update_one({'_id': ObjectId(post_id)}, {'$inc': {'comments': 1}})
+            storage.posts.increment(ObjectId(post_id), {'comments': 1}, touch='activity_at',
+                                    half_life=get_half_life())
+            bump_generation(POSTS_GENERATION)
             
             flash('Comment added successfully.')
     return redirect(url_for('post.view', post_id=post_id))
@@ -325,7 +476,7 @@ def serialize_post(post):
     return {
         'id': str(post['_id']),
         'title': post['title'],
-        'content': post['content'],
+        'content': post.get('content', ''),
         'category': post['category'],
         'creator_id': str(post['creator_id']),
         'created_at': post['created_at'].astimezone().strftime('%Y-%m-%d %H:%M:%S %Z'),
@@ -340,8 +491,7 @@ def get_post(post_id, check_auth=True):
     Retrieve a post by its ID.
     Optionally check if the current user is authorized to access the post.
     """
-    db = get_db()
-    post = db.posts.find_one({'_id': ObjectId(post_id)})
+    post = get_storage().posts.get(ObjectId(post_id))
     
     if post is None:
         abort(404, f"Post id {post_id} doesn't exist.")
@@ -0,0 +1,284 @@
+"""
+Related notes from precomputed TF-IDF similarity.
+
+`flask build-related` turns every post's title, content and tags into a
+TF-IDF vector, keeps its TERMS_PER_POST heaviest terms, and computes each
+post's nearest neighbours by cosine similarity with sparse matrix products,
+a chunk of rows at a time. The neighbours, the post's own terms and the
+inverse document frequencies ('terms') are stored, so the view only reads
+a list and new or edited posts are placed by comparing them with the posts
+that share their most distinctive terms.
+
+The batch job needs NumPy and SciPy; the incremental updates don't.
+"""
+import math
+import re
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+
+import click
+from bson.objectid import ObjectId
+
+from flaskr.storage import get_storage
+
+RELATED_NOTES = 5
+# Heaviest terms kept per post: bounds the cost of the similarity products
+TERMS_PER_POST = 32
+MIN_SCORE = 0.05
+# Terms in fewer posts can't relate two posts; terms in more than this share
+# of the posts don't tell them apart
+MIN_DF = 2
+MAX_DF = 0.5
+TITLE_WEIGHT = 2
+TAG_WEIGHT = 3
+# Incremental updates compare a post with at most CANDIDATES posts sharing one
+# of its QUERY_TERMS most distinctive terms
+QUERY_TERMS = 8
+CANDIDATES = 500
+BUILD_BATCH_SIZE = 1000
+# Similarity scores computed at once: rows per chunk = CHUNK_CELLS // posts
+CHUNK_CELLS = 1 << 23
+
+_words = re.compile(r'[^\W\d_][^\W_]+')
+
+
+def term_counts(post):
+    """
+    Term frequencies of a post, with title words and tags counting extra
+    """
+    counts = Counter(_words.findall((post.get('content') or '').lower()))
+    for word in _words.findall((post.get('title') or '').lower()):
+        counts[word] += TITLE_WEIGHT
+    for tag in post.get('tags') or []:
+        for word in _words.findall(tag.lower()):
+            counts[word] += TAG_WEIGHT
+    return counts
+
+
+def tfidf(count, idf):
+    return (1 + math.log(count)) * idf
+
+
+def post_vector(storage, post):
+    """
+    A post's truncated, normalized TF-IDF vector as {term: weight}, using the
+    idf from the last build; terms it didn't keep are ignored
+    """
+    counts = term_counts(post)
+    if not counts:
+        return {}
+    weights = {row['_id']: tfidf(counts[row['_id']], row['idf'])
+               for row in storage.terms.find({'_id': {'$in': sorted(counts)}})}
+    top = sorted(weights.items(), key=lambda item: (-item[1], item[0]))[:TERMS_PER_POST]
+    norm = math.sqrt(sum(weight * weight for _, weight in top))
+    return {term: weight / norm for term, weight in top}
+
+
+def vector_fields(vector):
+    """
+    Fields that store a vector on its post, heaviest term first
+    """
+    items = sorted(vector.items(), key=lambda item: (-item[1], item[0]))
+    return {'related_terms': [term for term, _ in items],
+            'related_weights': [round(float(weight), 6) for _, weight in items]}
+
+
+def stored_vector(post):
+    return dict(zip(post.get('related_terms') or [], post.get('related_weights') or []))
+
+
+def merge_related(related, post_id, score, limit=RELATED_NOTES):
+    """
+    A neighbour list with post_id placed at its score, if it makes the cut
+    """
+    entries = [entry for entry in related or [] if entry['_id'] != post_id]
+    if score >= MIN_SCORE:
+        entries.append({'_id': post_id, 'score': round(score, 4)})
+    entries.sort(key=lambda entry: -entry['score'])
+    return entries[:limit]
+
+
+def update_related(storage, post_id, post, limit=RELATED_NOTES):
+    """
+    Place a new or edited post among its neighbours: compute its vector,
+    score the posts that share its most distinctive terms, store its own list
+    and add it to theirs where it beats their weakest neighbour.
+    Posts that stop being similar after an edit keep it until the next build.
+    """
+    now = datetime.now(timezone.utc)
+    vector = post_vector(storage, post)
+    updates = []
+    scores = []
+    if vector:
+        query_terms = sorted(vector, key=lambda term: -vector[term])[:QUERY_TERMS]
+        candidates = storage.posts.find({'related_terms': {'$in': query_terms}, '_id': {'$ne': post_id}},
+                                        {'related': 1, 'related_terms': 1, 'related_weights': 1},
+                                        limit=CANDIDATES)
+        for candidate in candidates:
+            score = sum(weight * vector.get(term, 0) for term, weight in stored_vector(candidate).items())
+            if score < MIN_SCORE:
+                continue
+            scores.append((score, candidate['_id']))
+            related = candidate.get('related') or []
+            if len(related) < limit or score > related[-1]['score'] or \
+                    any(entry['_id'] == post_id for entry in related):
+                updates.append((candidate['_id'], {'related': merge_related(related, post_id, score, limit),
+                                                   'related_at': now}))
+    scores.sort(key=lambda item: (-item[0], str(item[1])))
+    own = [{'_id': other_id, 'score': round(score, 4)} for score, other_id in scores[:limit]]
+    updates.append((post_id, {'related': own, 'related_at': now, **vector_fields(vector)}))
+    storage.posts.update_many(updates)
+
+
+def related_posts(storage, post):
+    """
+    Titles and ids of a post's stored neighbours, best first; deleted ones are skipped
+    """
+    ids = [entry['_id'] for entry in post.get('related') or []]
+    if not ids:
+        return []
+    titles = {doc['_id']: doc.get('title') for doc in storage.posts.find({'_id': {'$in': ids}}, {'title': 1})}
+    return [{'id': str(post_id), 'title': titles[post_id]} for post_id in ids if post_id in titles]
+
+
+def load_numpy():
+    try:
+        import numpy
+        from scipy import sparse
+    except ImportError:
+        raise click.ClickException("Building related notes needs NumPy and SciPy: pip install -e \".[related]\"")
+    return numpy, sparse
+
+
+def term_matrix(storage, batch_size=BUILD_BATCH_SIZE):
+    """
+    Raw term counts of every post as a CSR matrix, read one cursor batch at a
+    time into compact arrays. Returns (post ids, vocabulary, matrix).
+    """
+    np, sparse = load_numpy()
+    post_ids = []
+    vocabulary = {}
+    indptr, indices, counts = array('q', [0]), array('i'), array('f')
+    for post in storage.posts.find({}, {'title': 1, 'content': 1, 'tags': 1}, sort=[('_id', 1)],
+                                   batch_size=batch_size):
+        post_ids.append(post['_id'])
+        post_counts = term_counts(post)
+        indices.extend([vocabulary.setdefault(term, len(vocabulary)) for term in post_counts])
+        counts.extend(post_counts.values())
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix((np.frombuffer(counts, dtype=np.float32), np.frombuffer(indices, dtype=np.int32),
+                                np.frombuffer(indptr, dtype=np.int64)), shape=(len(post_ids), len(vocabulary)))
+    return post_ids, list(vocabulary), matrix
+
+
+def weigh(matrix, vocabulary):
+    """
+    Prune the vocabulary by document frequency, apply sublinear TF-IDF, keep
+    the TERMS_PER_POST heaviest terms per row and normalize the rows, the
+    same way post_vector does for one post. Returns (matrix, terms, idf).
+    """
+    np, _ = load_numpy()
+    posts = matrix.shape[0]
+    df = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    vocabulary = np.array(vocabulary, dtype=object)
+    keep = np.flatnonzero((df >= MIN_DF) & (df <= max(MAX_DF * posts, MIN_DF)))
+    # Columns in term order, so equal weights are cut in the same order as in post_vector
+    keep = keep[np.argsort(vocabulary[keep], kind='stable')]
+    idf = np.log((1 + posts) / (1 + df[keep])) + 1
+    matrix = matrix[:, keep].tocsr()
+    matrix.sort_indices()
+    matrix.data = (1 + np.log(matrix.data)) * idf[matrix.indices].astype(np.float32)
+
+    # Keep the heaviest terms of each row
+    rows = np.repeat(np.arange(posts), np.diff(matrix.indptr))
+    kept = np.sort(top_per_row(rows, matrix.indices, matrix.data, posts, TERMS_PER_POST))
+    rows, columns, data = rows[kept], matrix.indices[kept], matrix.data[kept]
+    norms = np.sqrt(np.bincount(rows, weights=data.astype(np.float64) ** 2, minlength=posts))
+    data = (data / norms[rows]).astype(np.float32)
+    matrix = type(matrix)((data, (rows, columns)), shape=matrix.shape)
+    return matrix, vocabulary[keep], idf
+
+
+def top_per_row(rows, columns, values, row_count, limit):
+    """
+    Positions of the `limit` largest values of each row, ties going to the
+    lower column, ordered by row and then by value
+    """
+    np, _ = load_numpy()
+    order = np.lexsort((columns, -values, rows))
+    starts = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=row_count))[:-1]))
+    rank = np.arange(len(order)) - starts[rows[order]]
+    return order[rank < limit]
+
+
+def nearest(matrix, limit=RELATED_NOTES, chunk_cells=CHUNK_CELLS):
+    """
+    Yield (row, [(other row, score), ...]) with each row's `limit` most
+    similar rows, best first. Scores are computed as a sparse product for a
+    chunk of rows at a time against every row, so memory stays near
+    chunk_cells scores, and only the nonzero ones are ranked.
+    """
+    np, _ = load_numpy()
+    posts = matrix.shape[0]
+    transposed = matrix.T.tocsr()
+    chunk = max(1, chunk_cells // max(posts, 1))
+    for start in range(0, posts, chunk):
+        end = min(start + chunk, posts)
+        scores = matrix[start:end] @ transposed
+        rows = np.repeat(np.arange(end - start), np.diff(scores.indptr))
+        keep = (scores.data >= MIN_SCORE) & (scores.indices != rows + start)
+        rows, columns, values = rows[keep], scores.indices[keep], scores.data[keep]
+        top = top_per_row(rows, columns, values, end - start, limit)
+        bounds = np.searchsorted(rows[top], np.arange(end - start + 1))
+        for offset in range(end - start):
+            picked = top[bounds[offset]:bounds[offset + 1]]
+            yield start + offset, list(zip(columns[picked].tolist(), values[picked].tolist()))
+
+
+def build_related(storage=None, limit=RELATED_NOTES, batch_size=BUILD_BATCH_SIZE, chunk_cells=CHUNK_CELLS):
+    """
+    Recompute every post's vector and neighbours, and the idf used for
+    incremental updates. Returns the number of posts and terms.
+    """
+    storage = storage or get_storage()
+    post_ids, vocabulary, counts = term_matrix(storage, batch_size)
+    matrix, terms, idf = weigh(counts, vocabulary)
+    del counts
+    now = datetime.now(timezone.utc)
+
+    def updates():
+        indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+        for row, neighbours in nearest(matrix, limit, chunk_cells):
+            columns = slice(indptr[row], indptr[row + 1])
+            vector = dict(zip(terms[indices[columns]], data[columns].tolist()))
+            yield post_ids[row], {'related': [{'_id': post_ids[other], 'score': round(score, 4)}
+                                              for other, score in neighbours],
+                                  'related_at': now, **vector_fields(vector)}
+    storage.posts.update_many(updates(), batch_size=batch_size)
+
+    # Replace the idf table without emptying it first: write this build's
+    # terms over the old ones, then drop the terms it didn't write
+    build = ObjectId()
+    storage.terms.upsert_many(({'_id': term, 'idf': float(value), 'build': build}
+                               for term, value in zip(terms, idf)), batch_size=batch_size)
+    storage.terms.delete_many({'build': {'$ne': build}})
+    return len(post_ids), len(terms)
+
+
+@click.command('build-related')
+@click.option('--limit', type=int, default=RELATED_NOTES, show_default=True, help="Related notes per post.")
+@click.option('--batch-size', type=int, default=BUILD_BATCH_SIZE, show_default=True)
+def build_related_command(limit, batch_size):
+    """
+    Command line interface to recompute the related notes of every post
+    """
+    posts, terms = build_related(limit=limit, batch_size=batch_size)
+    click.echo(f"Computed related notes for {posts} posts over {terms} terms.")
+
+
+def init_app(app):
+    """
+    Initialize the Flask application with the related notes command
+    """
+    app.cli.add_command(build_related_command)
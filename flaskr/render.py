@@ -0,0 +1,330 @@
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import click
+import markdown
+import pygments
+from markdown.extensions.attr_list import get_attrs_and_remainder
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+from markdown.postprocessors import Postprocessor
+from markdown.preprocessors import NormalizeWhitespace
+from flaskr.metrics import timed
+from flaskr.storage import get_storage
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'codehilite', 'tables', 'extra']
+
+# Bump RENDERER_REVISION when the output changes for reasons the library
+# versions and extension list don't capture.
+RENDERER_REVISION = 1
+RENDERER_VERSION = hashlib.sha1(
+    f"{RENDERER_REVISION}|{markdown.__version__}|{pygments.__version__}|{','.join(MARKDOWN_EXTENSIONS)}".encode()
+).hexdigest()[:12]
+
+RENDER_BATCH_SIZE = 500
+
+# A note's blocks are rendered in the process pool once this many miss the block cache
+PARALLEL_BLOCKS = 8
+
+# Markdown that applies across blocks: reference link, footnote and abbreviation
+# definitions, and raw HTML blocks (which can run past a code block)
+WHOLE_NOTE_RE = re.compile(r'^(?: {0,3}\[[^\]\n]*\]:|\*\[| {0,3}<)', re.MULTILINE)
+# A definition right after a code block takes the code block as its term
+DEFINITION_RE = re.compile(r'\n*[ ]{0,3}:[ ]{1,3}')
+
+# What get_post_html needs to serve or refresh a post's stored HTML
+HTML_PROJECTION = {'content': 1, 'content_html': 1, 'content_hash': 1, 'renderer_version': 1}
+
+
+def size_of(value):
+    return len(value) if isinstance(value, bytes) else len(value.encode('utf-8'))
+
+
+class RenderCache:
+    """
+    Thread-safe LRU of rendered HTML (or other str/bytes values), bounded by
+    their total size in bytes
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._items.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        cost = size_of(html)
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= size_of(old)
+            self._items[key] = html
+            self.size += cost
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= size_of(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._items), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+html_cache = RenderCache(32 * 1024 * 1024)
+# HTML of single blocks of notes, so an edit only re-renders the blocks it changed
+block_cache = RenderCache(16 * 1024 * 1024)
+
+
+class RenderPool:
+    """
+    Processes for rendering the blocks of a note in parallel, created on first use
+    """
+    def __init__(self, workers=0):
+        self.workers = workers
+        self.pid = None
+        self.executor = None
+        self._lock = threading.Lock()
+
+    def get_executor(self):
+        with self._lock:
+            if self.executor is None or self.pid != os.getpid():
+                # Spawned rather than forked since the app runs threads
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+                self.pid = os.getpid()
+            return self.executor
+
+    def map(self, fn, items):
+        if self.workers < 1 or len(items) < PARALLEL_BLOCKS:
+            return [fn(item) for item in items]
+        try:
+            return list(self.get_executor().map(fn, items, chunksize=max(1, len(items) // (self.workers * 4))))
+        except BrokenProcessPool:
+            self.shutdown()
+            return [fn(item) for item in items]
+
+    def shutdown(self):
+        with self._lock:
+            if self.executor is not None and self.pid == os.getpid():
+                self.executor.shutdown()
+            self.executor = None
+
+
+render_pool = RenderPool()
+
+
+class OutputRecorder(Postprocessor):
+    """
+    Keeps the output before convert() strips it: the newline a code block's
+    HTML ends with is part of the whole note's output
+    """
+    output = ''
+
+    def run(self, text):
+        self.output = text
+        return text
+
+
+_converters = threading.local()
+
+
+def get_converter():
+    """
+    This thread's Markdown instance, reset between notes
+    """
+    md = getattr(_converters, 'md', None)
+    if md is None:
+        md = _converters.md = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+        md.recorder = OutputRecorder(md)
+        md.postprocessors.register(md.recorder, 'recorder', 0)
+    return md
+
+
+def content_hash(content):
+    """
+    Hash of the raw Markdown, used to tell whether stored HTML is still current
+    """
+    return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+
+
+def render_block(text):
+    """
+    Render Markdown to HTML with the app's extension set, unstripped
+    """
+    md = get_converter()
+    html = md.reset().convert(text)
+    return md.recorder.output if html else ''
+
+
+def split_blocks(content):
+    """
+    Split Markdown into blocks that render the same alone as in the whole
+    note: each fenced code block with the text before it, found the way the
+    fenced_code extension finds them, and the text after the last one.
+    Returns None if the note has to be rendered whole.
+    """
+    text = '\n'.join(NormalizeWhitespace(get_converter()).run(content.split('\n')))
+    blocks = []
+    texts = []
+    start = index = 0
+    while True:
+        m = FencedBlockPreprocessor.FENCED_BLOCK_RE.search(text, index)
+        if m is None:
+            break
+        if m.group('attrs') and get_attrs_and_remainder(m.group('attrs'))[1]:
+            index = m.end('attrs')
+            continue
+        texts.append(text[start:m.start()])
+        blocks.append(text[start:m.end()])
+        start = index = m.end()
+    texts.append(text[start:])
+    blocks.append(text[start:])
+
+    if any(WHOLE_NOTE_RE.search(block) for block in texts) or \
+            any(DEFINITION_RE.match(block) for block in texts[1:]):
+        return None
+    return [block for block in blocks if block.strip()]
+
+
+def render_blocks(blocks):
+    """
+    HTML of each block, from the block cache or rendered (in the pool when
+    enough of them miss)
+    """
+    keys = [content_hash(block) for block in blocks]
+    html = [block_cache.get(key) for key in keys]
+    missing = [i for i, part in enumerate(html) if part is None]
+    for i, part in zip(missing, render_pool.map(render_block, [blocks[i] for i in missing])):
+        html[i] = part
+        block_cache.put(keys[i], part)
+    return html
+
+
+def render_markdown(content):
+    """
+    Render Markdown to HTML with the app's extension set.
+    Notes with code blocks are rendered block by block, byte for byte the same
+    as rendering them whole.
+    """
+    if not content:
+        return ''
+    with timed('render'):
+        blocks = split_blocks(content)
+        if blocks is None or len(blocks) < 2:
+            return render_block(content).strip()
+        return '\n'.join(render_blocks(blocks)).strip()
+
+
+def render_fields(content):
+    """
+    Fields to store on a post alongside its content so views can skip rendering
+    """
+    return {
+        'content_html': render_markdown(content),
+        'content_hash': content_hash(content),
+        'renderer_version': RENDERER_VERSION,
+    }
+
+
+def is_current(post):
+    """
+    Whether the post's stored HTML was made by this renderer version
+    """
+    return post.get('renderer_version') == RENDERER_VERSION and 'content_hash' in post
+
+
+def cached_post_html(post):
+    """
+    The post's HTML from the LRU, or None if it isn't cached (or is from another renderer)
+    """
+    if is_current(post):
+        return html_cache.get(post['content_hash'])
+    return None
+
+
+def get_post_html(post):
+    """
+    Return the rendered HTML for a post.
+    Expects the post without its 'content'/'content_html' fields; the LRU is checked
+    first, then the stored HTML. Posts from before pre-rendering (or from an older
+    renderer) are rendered once here and written back.
+    """
+    html = cached_post_html(post)
+    if html is not None:
+        return html
+
+    posts = get_storage().posts
+    doc = posts.get(post['_id'], HTML_PROJECTION)
+    if doc is None:
+        return ''
+
+    if is_current(doc) and 'content_html' in doc:
+        html = doc['content_html']
+    else:
+        fields = render_fields(doc.get('content', ''))
+        posts.update(doc['_id'], fields)
+        doc.update(fields)
+        html = fields['content_html']
+
+    html_cache.put(doc['content_hash'], html)
+    return html
+
+
+def render_all_posts(force=False, batch_size=RENDER_BATCH_SIZE):
+    """
+    Re-render stored HTML in bulk.
+    Only posts rendered by another renderer version are touched unless force is set.
+    Returns the number of posts updated.
+    """
+    posts = get_storage().posts
+    query = {} if force else {'renderer_version': {'$ne': RENDERER_VERSION}}
+    cursor = posts.find(query, {'content': 1}, batch_size=batch_size)
+    updated = posts.update_many(((post['_id'], render_fields(post.get('content', ''))) for post in cursor),
+                                batch_size=batch_size)
+
+    html_cache.clear()
+    block_cache.clear()
+    return updated
+
+
+@click.command('render-posts')
+@click.option('--force', is_flag=True, help="Re-render every post, not just ones from an older renderer.")
+def render_posts_command(force):
+    """
+    Command line interface to re-render the stored HTML of all posts
+    """
+    updated = render_all_posts(force=force)
+    click.echo(f'Re-rendered {updated} posts (renderer {RENDERER_VERSION}).')
+
+
+def init_app(app):
+    """
+    Initialize the Flask application with the render caches, pool and commands
+    """
+    html_cache.max_bytes = app.config.get('RENDER_CACHE_BYTES', html_cache.max_bytes)
+    block_cache.max_bytes = app.config.get('RENDER_BLOCK_CACHE_BYTES', block_cache.max_bytes)
+    render_pool.workers = app.config.get('RENDER_WORKERS', render_pool.workers)
+    app.cli.add_command(render_posts_command)
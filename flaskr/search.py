@@ -0,0 +1,103 @@
+import re
+
+import click
+
+from flaskr.db import POSTS_GENERATION, bump_generation
+from flaskr.storage import get_storage
+
+# Posts carry the distinct trigrams of their normalized title and content in
+# 'search_grams' (a multikey index). A substring query is narrowed through
+# that index and then confirmed with the original case-insensitive regex,
+# which now only runs on the candidate posts. Queries shorter than a trigram
+# can't be narrowed this way and fall back to the regex alone.
+GRAM_SIZE = 3
+MAX_QUERY_GRAMS = 32
+REINDEX_BATCH_SIZE = 500
+
+_whitespace = re.compile(r'\s+')
+
+
+def normalize(text):
+    """
+    Lowercase the text and collapse runs of whitespace into single spaces
+    """
+    return _whitespace.sub(' ', (text or '').lower())
+
+
+def tokenize(text):
+    """
+    Split text into the trigrams stored in the inverted index
+    """
+    text = normalize(text)
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def query_grams(query):
+    """
+    Grams every post containing the query must have: its trigrams, spread
+    evenly and capped at MAX_QUERY_GRAMS. Queries shorter than GRAM_SIZE
+    have none, so they are matched by regex alone.
+    """
+    query = normalize(query)
+    grams = list(dict.fromkeys(query[i:i + GRAM_SIZE] for i in range(len(query) - GRAM_SIZE + 1)))
+    if len(grams) > MAX_QUERY_GRAMS:
+        step = len(grams) / MAX_QUERY_GRAMS
+        grams = [grams[int(i * step)] for i in range(MAX_QUERY_GRAMS)]
+    return grams
+
+
+def search_fields(title, content):
+    """
+    Fields to store on a post so it can be found by contains_filter
+    """
+    return {'search_grams': sorted(tokenize(f"{title or ''}\n{content or ''}"))}
+
+
+def contains_filter(query):
+    """
+    Build a filter matching posts whose title or content contains the query
+    (case-insensitive), resolved through the gram index
+    """
+    grams = query_grams(query)
+    escaped_query = re.escape(query)
+    search_filter = {'$or': [
+        {'title': {'$regex': escaped_query, '$options': 'i'}},
+        {'content': {'$regex': escaped_query, '$options': 'i'}}
+    ]}
+    if grams:
+        search_filter['search_grams'] = {'$all': grams}
+    return search_filter
+
+
+def reindex_posts(force=False, batch_size=REINDEX_BATCH_SIZE):
+    """
+    Rebuild the search grams of posts in bulk.
+    Only posts without grams are indexed unless force is set.
+    Returns the number of posts updated.
+    """
+    posts = get_storage().posts
+    query = {} if force else {'search_grams': {'$exists': False}}
+    cursor = posts.find(query, {'title': 1, 'content': 1}, batch_size=batch_size)
+    updated = posts.update_many(((post['_id'], search_fields(post.get('title'), post.get('content')))
+                                 for post in cursor), batch_size=batch_size)
+    if updated:
+        # Cached search pages were built without these posts
+        bump_generation(POSTS_GENERATION)
+    return updated
+
+
+@click.command('reindex-search')
+@click.option('--force', is_flag=True, help="Rebuild the grams of every post, not just unindexed ones.")
+def reindex_search_command(force):
+    """
+    Command line interface to rebuild the post search index
+    """
+    updated = reindex_posts(force=force)
+    click.echo(f'Indexed {updated} posts for search.')
+
+
+def init_app(app):
+    """
+    Initialize the Flask application with the search commands
+    """
+    app.cli.add_command(reindex_search_command)
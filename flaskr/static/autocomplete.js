@@ -0,0 +1,35 @@
+// Suggestions for inputs marked data-autocomplete="tags" or "titles", from
+// the URL in data-url. Tag inputs hold a comma separated list, so only the
+// tag being typed is completed.
+document.querySelectorAll('input[data-autocomplete]').forEach(function (input) {
+  var kind = input.dataset.autocomplete;
+  var list = document.createElement('datalist');
+  list.id = input.id + '-suggestions';
+  input.setAttribute('list', list.id);
+  input.setAttribute('autocomplete', 'off');
+  input.after(list);
+
+  var timer = null;
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      var parts = kind === 'tags' ? input.value.split(',') : [input.value];
+      var prefix = parts.pop().trim();
+      if (!prefix) {
+        list.replaceChildren();
+        return;
+      }
+      var head = parts.map(function (part) { return part.trim(); }).filter(Boolean).join(', ');
+      fetch(input.dataset.url + '?' + new URLSearchParams({q: prefix, kind: kind}))
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          list.replaceChildren.apply(list, (data[kind] || []).map(function (item) {
+            var option = document.createElement('option');
+            var value = kind === 'tags' ? item.tag : item.title;
+            option.value = head ? head + ', ' + value : value;
+            return option;
+          }));
+        });
+    }, 150);
+  });
+});
@@ -0,0 +1,80 @@
+"""
+Storage backends.
+
+The app reads and writes through a Storage object whose repositories
+(users, posts, comments, likes, categories, tag_stats, category_stats,
+terms, generations) hide the database.
+STORAGE_BACKEND picks the implementation:
+
+    mongo   MongoDB through the pooled client in flaskr.db (the default)
+    memory  Indexed, thread-safe in-memory engine for tests, benchmarks and
+            single-process development; data lives as long as the app object
+
+Every repository offers get/find_one/find/count/insert/insert_many/update/
+update_many/upsert_many/upsert_counts/increment/increment_many/delete/
+delete_many/count_by/stats. Filters are a portable subset of MongoDB query
+syntax: equality (including array membership), $eq, $ne, $in, $nin, $all,
+$exists, $gt/$gte/$lt/$lte, $regex/$options, $or and $and.
+Collection-specific queries (post listings, the post view, comment pages,
+like toggles, login lookups) are methods on the repositories themselves.
+"""
+from flask import current_app, g, has_app_context
+
+
+def _mongo(app):
+    from flaskr.db import get_client
+    from flaskr.storage.mongo import MongoStorage
+    return MongoStorage(get_client(app)[app.config['DB_NAME']])
+
+
+def _memory(app):
+    # One engine per app, shared by every request and thread
+    storage = app.extensions.get('memory_storage')
+    if storage is None:
+        from flaskr.storage.memory import MemoryStorage
+        storage = app.extensions.setdefault('memory_storage', MemoryStorage())
+    return storage
+
+
+# Storage factories by STORAGE_BACKEND name; add more with register_backend
+BACKENDS = {
+    'mongo': _mongo,
+    'memory': _memory,
+}
+
+
+def register_backend(name, factory):
+    """
+    Make a storage backend available as STORAGE_BACKEND = name.
+    The factory gets the app and returns a Storage.
+    """
+    BACKENDS[name] = factory
+
+
+def open_storage(app):
+    """
+    Build the storage for an app, outside of any request
+    """
+    backend = app.config.get('STORAGE_BACKEND') or 'mongo'
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return BACKENDS[backend](app)
+
+
+def get_storage(app=None):
+    """
+    Return the storage for the current app (or the given one).
+    Within an app context it is kept on g for the rest of the request.
+    """
+    if app is not None and not (has_app_context() and app is current_app._get_current_object()):
+        return open_storage(app)
+    if 'storage' not in g:
+        g.storage = open_storage(current_app._get_current_object())
+    return g.storage
+
+
+def close_storage(e=None):
+    """
+    Release the request's storage handle
+    """
+    g.pop('storage', None)
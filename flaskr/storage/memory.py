@@ -0,0 +1,921 @@
+"""
+In-memory storage: plain dicts with equality, unique and sorted indexes kept
+up to date on every write, behind one lock per storage. Documents are stored
+the way MongoDB returns them (datetimes as naive UTC, millisecond precision)
+so both backends page, sort and compare the same way.
+"""
+import bisect
+import re
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import bson
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from flaskr.pagination import DEFAULT_PAGE_SIZE, finish_page
+from flaskr.search import normalize, query_grams
+from flaskr.trending import trending_score
+
+_MISSING = object()
+
+_words = re.compile(r'\w+')
+
+
+def _store(value):
+    """
+    Copy a value the way MongoDB would store and return it
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    if isinstance(value, dict):
+        return {key: _store(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_store(item) for item in value]
+    return value
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def project(doc, projection=None):
+    """
+    Copy of doc with a MongoDB-style inclusion or exclusion projection applied
+    """
+    if not projection:
+        return _copy(doc)
+    included = [field for field, value in projection.items() if value and field != '_id']
+    if included:
+        result = {field: _copy(doc[field]) for field in included if field in doc}
+        if projection.get('_id', 1) and '_id' in doc:
+            result['_id'] = doc['_id']
+        return result
+    return {field: _copy(value) for field, value in doc.items() if projection.get(field, 1)}
+
+
+def sort_key(value):
+    """
+    Order values across types the way MongoDB does (null < numbers < strings
+    < objects < arrays < ObjectId < booleans < dates)
+    """
+    if value is None or value is _MISSING:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (8, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, dict):
+        return (3, tuple(sorted((key, sort_key(item)) for key, item in value.items())))
+    if isinstance(value, list):
+        return (4, tuple(sort_key(item) for item in value))
+    if isinstance(value, ObjectId):
+        return (7, value)
+    if isinstance(value, datetime):
+        return (9, value)
+    return (10, str(value))
+
+
+def _field(doc, name):
+    value = doc
+    for part in name.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _equals(value, operand):
+    if value is _MISSING:
+        return operand is None
+    if isinstance(value, list) and not isinstance(operand, list):
+        return operand in value
+    return value == operand
+
+
+def _compare(value, operand, test):
+    values = value if isinstance(value, list) else [value]
+    for item in values:
+        if item is _MISSING or sort_key(item)[0] != sort_key(operand)[0]:
+            continue
+        if test(item, operand):
+            return True
+    return False
+
+
+def _regex(value, pattern, options):
+    flags = re.IGNORECASE if 'i' in options else 0
+    flags |= re.MULTILINE if 'm' in options else 0
+    flags |= re.DOTALL if 's' in options else 0
+    values = value if isinstance(value, list) else [value]
+    return any(isinstance(item, str) and re.search(pattern, item, flags) for item in values)
+
+
+_OPERATORS = {
+    '$eq': lambda value, operand, options: _equals(value, operand),
+    '$ne': lambda value, operand, options: not _equals(value, operand),
+    '$in': lambda value, operand, options: any(_equals(value, item) for item in operand),
+    '$nin': lambda value, operand, options: not any(_equals(value, item) for item in operand),
+    '$all': lambda value, operand, options: (isinstance(value, list)
+                                             and all(item in value for item in operand)),
+    '$exists': lambda value, operand, options: (value is not _MISSING) == bool(operand),
+    '$gt': lambda value, operand, options: _compare(value, operand, lambda a, b: a > b),
+    '$gte': lambda value, operand, options: _compare(value, operand, lambda a, b: a >= b),
+    '$lt': lambda value, operand, options: _compare(value, operand, lambda a, b: a < b),
+    '$lte': lambda value, operand, options: _compare(value, operand, lambda a, b: a <= b),
+    '$regex': lambda value, operand, options: _regex(value, operand, options),
+}
+
+
+def matches(doc, query):
+    """
+    Whether doc matches a filter in the portable query subset
+    """
+    for key, condition in query.items():
+        if key == '$or':
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+        elif key == '$and':
+            if not all(matches(doc, clause) for clause in condition):
+                return False
+        elif key.startswith('$'):
+            raise ValueError(f"Unsupported query operator: {key}")
+        elif isinstance(condition, dict) and condition and all(name.startswith('$') for name in condition):
+            value = _field(doc, key)
+            options = condition.get('$options', '')
+            for name, operand in condition.items():
+                if name == '$options':
+                    continue
+                if name not in _OPERATORS:
+                    raise ValueError(f"Unsupported query operator: {name}")
+                if not _OPERATORS[name](value, _store(operand), options):
+                    return False
+        elif not _equals(_field(doc, key), _store(condition)):
+            return False
+    return True
+
+
+def _now():
+    return _store(datetime.now(timezone.utc))
+
+
+class SortedIndex:
+    """
+    (value, _id) keys of one field in ascending order, for sorting and keyset paging
+    """
+    def __init__(self, field):
+        self.field = field
+        self.keys = []
+        self.key_of = {}
+
+    def add(self, doc):
+        key = (sort_key(doc.get(self.field)), doc['_id'])
+        bisect.insort(self.keys, key)
+        self.key_of[doc['_id']] = key
+
+    def remove(self, doc_id):
+        key = self.key_of.pop(doc_id, None)
+        if key is not None:
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def walk(keys, after=None, before=None, descending=True):
+    """
+    Yield document ids from sorted keys in page order, resuming after (or,
+    paging backwards, before) a (value, _id) cursor the way page_pipeline does
+    """
+    if before is not None:
+        # Backwards pages run in the opposite order; finish_page flips them back
+        key = (sort_key(_store(before[0])), before[1])
+        if descending:
+            indexes = range(bisect.bisect_right(keys, key), len(keys))
+        else:
+            indexes = range(bisect.bisect_left(keys, key) - 1, -1, -1)
+    elif after is not None:
+        key = (sort_key(_store(after[0])), after[1])
+        if descending:
+            indexes = range(bisect.bisect_left(keys, key) - 1, -1, -1)
+        else:
+            indexes = range(bisect.bisect_right(keys, key), len(keys))
+    else:
+        indexes = range(len(keys) - 1, -1, -1) if descending else range(len(keys))
+    for i in indexes:
+        yield keys[i][1]
+
+
+class MemoryRepository:
+    """
+    A collection held in a dict, with the indexes declared by the subclass:
+    `unique` field tuples (documents missing a field are not constrained),
+    `indexed` fields with an equality index (multikey for arrays) and
+    `sorted_fields` with a SortedIndex.
+    """
+    unique = ()
+    indexed = ()
+    sorted_fields = ()
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.lock = storage.lock
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.docs = {}
+            self._unique = {fields: {} for fields in self.unique}
+            self._index = {field: defaultdict(set) for field in self.indexed}
+            self.sorted = {field: SortedIndex(field) for field in self.sorted_fields}
+
+    # Index maintenance
+
+    def _unique_key(self, doc, fields):
+        key = tuple(doc.get(field) for field in fields)
+        return None if any(value is None for value in key) else key
+
+    def _check_unique(self, doc):
+        for fields, keys in self._unique.items():
+            key = self._unique_key(doc, fields)
+            if key is not None and keys.get(key, doc['_id']) != doc['_id']:
+                raise DuplicateKeyError(f"E11000 duplicate key error: {dict(zip(fields, key))}")
+
+    def _index_doc(self, doc, changed=None):
+        """
+        Add doc to the indexes; with `changed`, only to those on the changed fields
+        """
+        for fields, keys in self._unique.items():
+            key = self._unique_key(doc, fields)
+            if key is not None and (changed is None or changed.intersection(fields)):
+                keys[key] = doc['_id']
+        for field, index in self._index.items():
+            if changed is not None and field not in changed:
+                continue
+            value = doc.get(field, _MISSING)
+            for item in (value if isinstance(value, list) else [value]):
+                if item is not _MISSING and not isinstance(item, (dict, list)):
+                    index[item].add(doc['_id'])
+        for field, index in self.sorted.items():
+            if changed is None or field in changed:
+                index.add(doc)
+
+    def _unindex_doc(self, doc, changed=None):
+        for fields, keys in self._unique.items():
+            key = self._unique_key(doc, fields)
+            if key is not None and keys.get(key) == doc['_id'] and (changed is None or changed.intersection(fields)):
+                del keys[key]
+        for field, index in self._index.items():
+            if changed is not None and field not in changed:
+                continue
+            value = doc.get(field, _MISSING)
+            for item in (value if isinstance(value, list) else [value]):
+                if item is not _MISSING and not isinstance(item, (dict, list)):
+                    ids = index.get(item)
+                    if ids is not None:
+                        ids.discard(doc['_id'])
+                        if not ids:
+                            del index[item]
+        for field, index in self.sorted.items():
+            if changed is None or field in changed:
+                index.remove(doc['_id'])
+
+    def _replace(self, old, new):
+        # Counter updates touch a field or two; leave the other indexes alone
+        changed = {field for field in old.keys() | new.keys()
+                   if old.get(field, _MISSING) != new.get(field, _MISSING)}
+        self._check_unique(new)
+        self._unindex_doc(old, changed)
+        self.docs[new['_id']] = new
+        self._index_doc(new, changed)
+
+    def _candidates(self, query):
+        """
+        Ids that may match the query according to the _id and equality
+        indexes, or None when the indexes can't narrow it down
+        """
+        sets = []
+        for field, condition in query.items():
+            if field == '_id':
+                index = None
+            elif field in self._index:
+                index = self._index[field]
+            else:
+                continue
+            lookup = (lambda value: {value} if value in self.docs else set()) if index is None \
+                else (lambda value, index=index: index.get(value, set()))
+            if isinstance(condition, dict):
+                if set(condition) == {'$eq'}:
+                    sets.append(lookup(condition['$eq']))
+                elif set(condition) == {'$in'}:
+                    sets.append(set().union(*(lookup(value) for value in condition['$in'])))
+                elif set(condition) == {'$all'} and condition['$all']:
+                    sets.extend(lookup(value) for value in condition['$all'])
+            elif not isinstance(condition, list):
+                try:
+                    sets.append(lookup(_store(condition)))
+                except TypeError:
+                    continue
+        if not sets:
+            return None
+        sets.sort(key=len)
+        result = set(sets[0])
+        for ids in sets[1:]:
+            result &= ids
+        return result
+
+    # Repository interface
+
+    def get(self, doc_id, projection=None):
+        with self.lock:
+            doc = self.docs.get(doc_id)
+            return project(doc, projection) if doc is not None else None
+
+    def find_one(self, query=None, projection=None):
+        return next(iter(self.find(query, projection, limit=1)), None)
+
+    def find(self, query=None, projection=None, sort=None, limit=0, batch_size=None):
+        query = query or {}
+        with self.lock:
+            candidates = self._candidates(query)
+            if candidates is None:
+                docs = self.docs.values()
+            else:
+                docs = [self.docs[doc_id] for doc_id in self.docs if doc_id in candidates] \
+                    if len(candidates) * 8 > len(self.docs) else \
+                    sorted((self.docs[doc_id] for doc_id in candidates), key=lambda doc: sort_key(doc['_id']))
+            found = [doc for doc in docs if matches(doc, query)]
+            if sort:
+                for field, direction in reversed(list(sort.items() if isinstance(sort, dict) else sort)):
+                    found.sort(key=lambda doc: sort_key(_field(doc, field)), reverse=direction < 0)
+            if limit:
+                found = found[:limit]
+            return [project(doc, projection) for doc in found]
+
+    def count(self, query=None, limit=0):
+        if not query:
+            return min(len(self.docs), limit) if limit else len(self.docs)
+        return len(self.find(query, {'_id': 1}, limit=limit))
+
+    def exists(self, doc_id):
+        return doc_id in self.docs
+
+    def insert(self, doc):
+        """
+        Insert a document and return its _id (also set on doc, as pymongo does).
+        Raises DuplicateKeyError when a unique index is violated.
+        """
+        doc.setdefault('_id', ObjectId())
+        stored = _store(doc)
+        with self.lock:
+            if stored['_id'] in self.docs:
+                raise DuplicateKeyError(f"E11000 duplicate key error: _id {stored['_id']}")
+            self._check_unique(stored)
+            self.docs[stored['_id']] = stored
+            self._index_doc(stored)
+        return stored['_id']
+
+    def insert_many(self, docs, ordered=True, batch_size=None):
+        """
+        Insert documents and return how many were inserted.
+        Unordered inserts skip duplicates and raise one BulkWriteError at
+        the end, like MongoRepository.insert_many.
+        """
+        inserted = 0
+        write_errors = []
+        for index, doc in enumerate(docs):
+            try:
+                self.insert(doc)
+                inserted += 1
+            except DuplicateKeyError as e:
+                if ordered:
+                    raise
+                write_errors.append({'index': index, 'code': 11000, 'errmsg': str(e)})
+        if write_errors:
+            raise BulkWriteError({'nInserted': inserted, 'writeErrors': write_errors})
+        return inserted
+
+    def update(self, doc_id, fields):
+        """
+        Set fields on a document; returns whether it exists
+        """
+        with self.lock:
+            old = self.docs.get(doc_id)
+            if old is None:
+                return False
+            self._replace(old, {**old, **_store(fields)})
+            return True
+
+    def update_many(self, updates, batch_size=None):
+        """
+        Apply (doc_id, fields) updates and return the number of documents modified
+        """
+        modified = 0
+        with self.lock:
+            for doc_id, fields in updates:
+                old = self.docs.get(doc_id)
+                if old is None:
+                    continue
+                new = {**old, **_store(fields)}
+                if new != old:
+                    self._replace(old, new)
+                    modified += 1
+        return modified
+
+    def upsert_many(self, docs, batch_size=None):
+        """
+        Insert or replace documents by _id; returns the number inserted or changed
+        """
+        written = 0
+        for doc in docs:
+            stored = _store(doc)
+            with self.lock:
+                old = self.docs.get(stored['_id'])
+                if old is None:
+                    self._check_unique(stored)
+                    self.docs[stored['_id']] = stored
+                    self._index_doc(stored)
+                elif old != stored:
+                    self._replace(old, stored)
+                else:
+                    continue
+            written += 1
+        return written
+
+    def _incremented(self, old, deltas, touch):
+        new = dict(old)
+        for field, delta in deltas.items():
+            new[field] = new.get(field, 0) + delta
+        if touch:
+            new[touch] = _now()
+        return new
+
+    def increment(self, doc_id, deltas, touch=None):
+        """
+        Add deltas to counter fields, setting the `touch` date field to now.
+        Returns whether the document exists.
+        """
+        with self.lock:
+            old = self.docs.get(doc_id)
+            if old is None:
+                return False
+            self._replace(old, self._incremented(old, deltas, touch))
+            return True
+
+    def increment_many(self, items, touch=None, batch_size=None):
+        """
+        Apply (doc_id, deltas) increments and return the number of documents modified
+        """
+        modified = 0
+        with self.lock:
+            for doc_id, deltas in items:
+                old = self.docs.get(doc_id)
+                if old is not None:
+                    self._replace(old, self._incremented(old, deltas, touch))
+                    modified += 1
+        return modified
+
+    def upsert_counts(self, items, batch_size=None):
+        """
+        Apply (key, deltas) increments to the document matching the key fields,
+        creating it when missing; returns the number of documents written
+        """
+        written = 0
+        with self.lock:
+            for key, deltas in items:
+                doc = self.find_one(key, {'_id': 1})
+                if doc is None:
+                    self.insert({**key, **deltas})
+                else:
+                    old = self.docs[doc['_id']]
+                    self._replace(old, self._incremented(old, deltas, None))
+                written += 1
+        return written
+
+    def upsert_fields(self, items, batch_size=None):
+        """
+        Set fields on the document matching the key fields of each (key, fields)
+        pair, creating it when missing; returns the number of documents written
+        """
+        written = 0
+        with self.lock:
+            for key, fields in items:
+                doc = self.find_one(key, {'_id': 1})
+                if doc is None:
+                    self.insert({**key, **fields})
+                else:
+                    old = self.docs[doc['_id']]
+                    self._replace(old, _store({**old, **fields}))
+                written += 1
+        return written
+
+    def delete(self, doc_id):
+        with self.lock:
+            doc = self.docs.pop(doc_id, None)
+            if doc is None:
+                return False
+            self._unindex_doc(doc)
+            return True
+
+    def delete_many(self, query, limit=0):
+        """
+        Delete the documents matching query, at most `limit` of them when given.
+        Returns the number deleted.
+        """
+        with self.lock:
+            ids = [doc['_id'] for doc in self.find(query, {'_id': 1}, limit=limit)]
+            for doc_id in ids:
+                self._unindex_doc(self.docs.pop(doc_id))
+        return len(ids)
+
+    def count_by(self, field):
+        """
+        Number of documents per value of field
+        """
+        with self.lock:
+            return dict(Counter(doc.get(field) for doc in self.docs.values()))
+
+    def stats(self):
+        """
+        Document count and the BSON size of the documents. The indexes are
+        Python sets and dicts with no comparable size, so index_size is None.
+        """
+        with self.lock:
+            return {'count': len(self.docs), 'size': sum(len(bson.encode(doc)) for doc in self.docs.values()),
+                    'index_size': None}
+
+
+class MemoryPosts(MemoryRepository):
+    unique = (('import_key',),)
+    indexed = ('category', 'tags', 'search_grams', 'creator_id', 'import_key', 'related_terms')
+    sorted_fields = ('created_at', 'title', 'likes', 'trending')
+
+    def _rescored(self, old, deltas, touch, half_life):
+        new = self._incremented(old, deltas, touch)
+        if half_life is not None:
+            new['trending'] = trending_score(new, half_life)
+        return new
+
+    def increment(self, doc_id, deltas, touch=None, half_life=None):
+        """
+        Add deltas to counter fields, setting the `touch` date field to now.
+        With half_life the trending score is recomputed in the same update.
+        Returns whether the post exists.
+        """
+        with self.lock:
+            old = self.docs.get(doc_id)
+            if old is None:
+                return False
+            self._replace(old, self._rescored(old, deltas, touch, half_life))
+            return True
+
+    def increment_many(self, items, touch=None, half_life=None, batch_size=None):
+        """
+        Apply (doc_id, deltas) increments, rescoring each post when half_life
+        is given; returns the number of posts modified
+        """
+        modified = 0
+        with self.lock:
+            for doc_id, deltas in items:
+                old = self.docs.get(doc_id)
+                if old is not None:
+                    self._replace(old, self._rescored(old, deltas, touch, half_life))
+                    modified += 1
+        return modified
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+            # Word index standing in for the $text index used by relevance sort,
+            # with each post's (word counts, word total) per text field
+            self._words = defaultdict(set)
+            self._term_counts = {}
+
+    def _index_doc(self, doc, changed=None):
+        super()._index_doc(doc, changed)
+        if changed is not None and not changed.intersection(('title', 'content')):
+            return
+        fields = []
+        for field in ('title', 'content'):
+            tokens = _words.findall(normalize(doc.get(field) or ''))
+            fields.append((Counter(tokens), len(tokens)))
+            for token in tokens:
+                self._words[token].add(doc['_id'])
+        self._term_counts[doc['_id']] = fields
+
+    def _unindex_doc(self, doc, changed=None):
+        super()._unindex_doc(doc, changed)
+        if changed is not None and not changed.intersection(('title', 'content')):
+            return
+        for counts, _ in self._term_counts.pop(doc['_id'], []):
+            for token in counts:
+                ids = self._words.get(token)
+                if ids is not None:
+                    ids.discard(doc['_id'])
+                    if not ids:
+                        del self._words[token]
+
+    def _listing_candidates(self, filters, grams=True):
+        """
+        Ids allowed by the gram, tag and category indexes, or None for all posts.
+        Relevance search matches any word of q, so it skips the grams.
+        """
+        sets = []
+        if grams and filters.get('q'):
+            grams = query_grams(filters['q'])
+            sets.extend(self._index['search_grams'].get(gram, set()) for gram in grams)
+        if filters.get('tags'):
+            tag_sets = [self._index['tags'].get(tag, set()) for tag in filters['tags']]
+            if filters.get('require_all_tags'):
+                sets.extend(tag_sets)
+            else:
+                sets.append(set().union(*tag_sets))
+        if filters.get('category'):
+            sets.append(self._index['category'].get(filters['category'], set()))
+        if not sets:
+            return None
+        sets.sort(key=len)
+        result = set(sets[0])
+        for ids in sets[1:]:
+            result &= ids
+        return result
+
+    def _relevance_keys(self, query, candidates):
+        """
+        Sorted (score, _id) keys of the posts containing any query word.
+        The score approximates MongoDB's textScore (term frequency per field,
+        damped by field length); there is no stemming or stop word list.
+        """
+        terms = set(_words.findall(normalize(query)))
+        ids = set().union(*(self._words.get(term, set()) for term in terms)) if terms else set()
+        if candidates is not None:
+            ids &= candidates
+        keys = []
+        for doc_id in ids:
+            score = 0.0
+            for counts, total in self._term_counts[doc_id]:
+                for term in terms:
+                    if counts[term]:
+                        score += 0.5 + 0.5 * counts[term] / total
+            keys.append((sort_key(score), doc_id))
+        keys.sort()
+        return keys
+
+    def find_page(self, filters, sort, after=None, before=None, page_size=DEFAULT_PAGE_SIZE, projection=None):
+        """
+        One keyset page of posts matching the listing filters (q, tags,
+        require_all_tags, category), ordered by sort descending then _id.
+        sort is a post field or 'relevance', which ranks by text score.
+        """
+        with self.lock:
+            candidates = self._listing_candidates(filters, grams=sort != 'relevance')
+            # Confirm substring matches like contains_filter's regex
+            pattern = re.compile(re.escape(filters['q']), re.IGNORECASE) if filters.get('q') else None
+            if sort == 'relevance':
+                field = 'score'
+                keys = self._relevance_keys(filters['q'], candidates)
+                candidates = pattern = None
+            elif sort in self.sorted:
+                field = sort
+                keys = self.sorted[sort].keys
+                if candidates is not None and len(candidates) * 16 < len(keys):
+                    # Few matches: sort just those instead of scanning the index
+                    key_of = self.sorted[sort].key_of
+                    keys = sorted(key_of[doc_id] for doc_id in candidates)
+                    candidates = None
+            else:
+                raise ValueError(f"Unsupported sort: {sort}")
+
+            scores = {key[1]: key[0][1] for key in keys} if field == 'score' else None
+            docs = []
+            for doc_id in walk(keys, after=after, before=before):
+                if candidates is not None and doc_id not in candidates:
+                    continue
+                doc = self.docs[doc_id]
+                if pattern is not None and not (pattern.search(doc.get('title') or '')
+                                                or pattern.search(doc.get('content') or '')):
+                    continue
+                item = project(doc, projection)
+                if scores is not None:
+                    item['score'] = scores[doc_id]
+                docs.append(item)
+                if len(docs) > page_size:
+                    break
+        return finish_page(docs, field, page_size, after=after, before=before)
+
+    def get_view(self, post_id, projection=None, comments_page_size=DEFAULT_PAGE_SIZE):
+        """
+        A post with its creator's username as 'creator' and the first page of
+        its comments as 'comment_page'. None if missing.
+        """
+        with self.lock:
+            doc = self.docs.get(post_id)
+            if doc is None:
+                return None
+            post = project(doc, projection)
+            try:
+                creator = self.storage.users.docs.get(ObjectId(doc.get('creator_id')))
+            except (InvalidId, TypeError):
+                creator = None
+            post['creator'] = creator.get('username') if creator else None
+            post['comment_page'] = self.storage.comments.find_page(post_id, page_size=comments_page_size)
+        return post
+
+
+class MemoryComments(MemoryRepository):
+    indexed = ('post_id',)
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+            # Each post's comments in (created_at, _id) order
+            self._threads = defaultdict(lambda: SortedIndex('created_at'))
+
+    def _index_doc(self, doc, changed=None):
+        super()._index_doc(doc, changed)
+        if changed is None or changed.intersection(('post_id', 'created_at')):
+            self._threads[doc.get('post_id')].add(doc)
+
+    def _unindex_doc(self, doc, changed=None):
+        super()._unindex_doc(doc, changed)
+        if changed is not None and not changed.intersection(('post_id', 'created_at')):
+            return
+        thread = self._threads.get(doc.get('post_id'))
+        if thread is not None:
+            thread.remove(doc['_id'])
+            if not len(thread):
+                del self._threads[doc.get('post_id')]
+
+    def find_page(self, post_id, after=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        One page of a post's comments, oldest first, with commenter usernames
+        """
+        users = self.storage.users.docs
+        with self.lock:
+            thread = self._threads.get(post_id)
+            docs = []
+            for doc_id in walk(thread.keys if thread else [], after=after, descending=False):
+                comment = self.docs[doc_id]
+                item = {'_id': doc_id, 'content': comment.get('comment'),
+                        'created_at': comment.get('created_at'), 'user_id': comment.get('creator_id')}
+                creator = users.get(comment.get('creator_id'))
+                if creator is not None and 'username' in creator:
+                    item['username'] = creator['username']
+                docs.append(item)
+                if len(docs) > page_size:
+                    break
+        return finish_page(docs, 'created_at', page_size, after=after)
+
+
+class MemoryLikes(MemoryRepository):
+    unique = (('post_id', 'user_id'),)
+    indexed = ('post_id',)
+
+    def add(self, post_id, user_id):
+        """
+        Record a like; returns False if the user already liked the post
+        """
+        try:
+            self.insert({'post_id': post_id, 'user_id': user_id})
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def remove(self, post_id, user_id):
+        """
+        Remove a like; returns whether there was one
+        """
+        with self.lock:
+            doc_id = self._unique[('post_id', 'user_id')].get((post_id, user_id))
+            return self.delete(doc_id) if doc_id is not None else False
+
+
+class MemoryUsers(MemoryRepository):
+    unique = (('username',), ('email',), ('username_lower',), ('email_lower',))
+
+    def find_by_keys(self, username_key=None, email_key=None, username=None, email=None):
+        """
+        The user whose normalized username or email matches.
+        Users not yet given the normalized keys (see migrate-users) are
+        matched on the exact username or email instead.
+        """
+        with self.lock:
+            doc_id = self._unique[('username_lower',)].get((username_key,)) \
+                or self._unique[('email_lower',)].get((email_key,)) \
+                or (username is not None and self._unique[('username',)].get((username,))) \
+                or (email is not None and self._unique[('email',)].get((email,)))
+            return self.get(doc_id) if doc_id else None
+
+
+class MemoryCategories(MemoryRepository):
+    unique = (('name',),)
+
+    def all(self):
+        return self.find()
+
+    def ensure(self, categories):
+        """
+        Insert the categories that don't exist yet and return their names
+        """
+        inserted = []
+        with self.lock:
+            for category in categories:
+                if (category['name'],) not in self._unique[('name',)]:
+                    self.insert(dict(category))
+                    inserted.append(category['name'])
+        return inserted
+
+
+class MemoryTagStats(MemoryRepository):
+    unique = (('tag', 'category'),)
+    indexed = ('tag', 'category')
+
+
+class MemoryCategoryStats(MemoryRepository):
+    unique = (('category',),)
+    indexed = ('category',)
+
+
+class MemoryGenerations:
+    def __init__(self, storage):
+        self.lock = storage.lock
+        self.clear()
+
+    def clear(self):
+        self.values = {}
+
+    def get(self, name):
+        return self.values.get(name, 0)
+
+    def bump(self, name):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + 1
+            return self.values[name]
+
+    def all(self):
+        return dict(self.values)
+
+    def raise_to(self, name, value):
+        """
+        Move a generation up to at least value
+        """
+        with self.lock:
+            self.values[name] = max(self.values.get(name, 0), value)
+
+
+class MemoryStorage:
+    """
+    Storage held in this process's memory.
+    Every repository shares one re-entrant lock, so operations that span
+    collections (the post view, like toggles) see a consistent state.
+    """
+    backend = 'memory'
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.name = f"memory-{id(self):x}"
+        self.users = MemoryUsers(self)
+        self.posts = MemoryPosts(self)
+        self.comments = MemoryComments(self)
+        self.likes = MemoryLikes(self)
+        self.categories = MemoryCategories(self)
+        self.tag_stats = MemoryTagStats(self)
+        self.category_stats = MemoryCategoryStats(self)
+        self.terms = MemoryRepository(self)
+        self.generations = MemoryGenerations(self)
+
+    def init(self):
+        """
+        Nothing to create; the indexes are part of the repositories
+        """
+
+    def drop(self):
+        """
+        Remove all data
+        """
+        with self.lock:
+            for repository in (self.users, self.posts, self.comments, self.likes, self.categories,
+                               self.tag_stats, self.category_stats, self.terms, self.generations):
+                repository.clear()
+
+    @contextmanager
+    def snapshot(self, queries, batch_size=None):
+        """
+        Read the documents matching {collection: query}, in _id order, as of
+        one point in time: every collection is copied under the storage lock.
+        Yields ({collection: documents}, True).
+        """
+        with self.lock:
+            docs = {name: getattr(self, name).find(query, sort=[('_id', 1)]) for name, query in queries.items()}
+        yield docs, True
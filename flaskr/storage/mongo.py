@@ -0,0 +1,478 @@
+"""
+MongoDB storage: the repositories run their queries through pymongo on the
+pooled client from flaskr.db.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+from flaskr.db import ensure_indexes
+from flaskr.pagination import DEFAULT_PAGE_SIZE, finish_page, keyset_match, page_pipeline
+from flaskr.search import contains_filter
+from flaskr.trending import trending_expression
+
+BATCH_SIZE = 500
+
+
+class MongoRepository:
+    """
+    Repository backed by one MongoDB collection
+    """
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get(self, doc_id, projection=None):
+        return self.collection.find_one({'_id': doc_id}, projection)
+
+    def find_one(self, query=None, projection=None):
+        return self.collection.find_one(query or {}, projection)
+
+    def find(self, query=None, projection=None, sort=None, limit=0, batch_size=BATCH_SIZE, session=None):
+        cursor = self.collection.find(query or {}, projection, batch_size=batch_size, session=session)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    def count(self, query=None, limit=0):
+        options = {'limit': limit} if limit else {}
+        return self.collection.count_documents(query or {}, **options)
+
+    def exists(self, doc_id):
+        return self.count({'_id': doc_id}, limit=1) > 0
+
+    def insert(self, doc):
+        """
+        Insert a document and return its _id (also set on doc).
+        Raises DuplicateKeyError when a unique index is violated.
+        """
+        return self.collection.insert_one(doc).inserted_id
+
+    def insert_many(self, docs, ordered=True, batch_size=BATCH_SIZE):
+        """
+        Insert documents in batches and return how many were inserted.
+        Unordered inserts carry on past failed documents and raise one
+        BulkWriteError at the end, with nInserted and the writeErrors'
+        indexes counted over all of docs.
+        """
+        inserted = 0
+        write_errors = []
+        start = 0
+        batch = []
+
+        def insert_batch():
+            nonlocal inserted
+            try:
+                inserted += len(self.collection.insert_many(batch, ordered=ordered).inserted_ids)
+            except BulkWriteError as e:
+                if ordered:
+                    raise
+                inserted += e.details['nInserted']
+                write_errors.extend({**error, 'index': start + error['index']} for error in e.details['writeErrors'])
+
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                insert_batch()
+                start += len(batch)
+                batch = []
+        if batch:
+            insert_batch()
+        if write_errors:
+            raise BulkWriteError({'nInserted': inserted, 'writeErrors': write_errors})
+        return inserted
+
+    def update(self, doc_id, fields):
+        """
+        Set fields on a document; returns whether it exists
+        """
+        return self.collection.update_one({'_id': doc_id}, {'$set': fields}).matched_count > 0
+
+    def update_many(self, updates, batch_size=BATCH_SIZE):
+        """
+        Apply (doc_id, fields) updates with batched bulk writes.
+        Returns the number of documents modified.
+        """
+        return self._bulk_write((UpdateOne({'_id': doc_id}, {'$set': fields}) for doc_id, fields in updates),
+                                batch_size)
+
+    def upsert_many(self, docs, batch_size=BATCH_SIZE):
+        """
+        Insert or replace documents by _id with batched bulk writes.
+        Returns the number of documents inserted or changed.
+        """
+        return self._bulk_write((ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in docs), batch_size)
+
+    def increment(self, doc_id, deltas, touch=None):
+        """
+        Add deltas to counter fields, setting the `touch` date field to now.
+        Returns whether the document exists.
+        """
+        return self.collection.update_one({'_id': doc_id}, _inc(deltas, touch)).matched_count > 0
+
+    def increment_many(self, items, touch=None, batch_size=BATCH_SIZE):
+        """
+        Apply (doc_id, deltas) increments with batched bulk writes
+        """
+        return self._bulk_write((UpdateOne({'_id': doc_id}, _inc(deltas, touch)) for doc_id, deltas in items),
+                                batch_size)
+
+    def upsert_counts(self, items, batch_size=BATCH_SIZE):
+        """
+        Apply (key, deltas) increments to the document matching the key fields,
+        creating it when missing, with batched bulk writes
+        """
+        return self._bulk_write((UpdateOne(key, {'$inc': deltas}, upsert=True) for key, deltas in items),
+                                batch_size)
+
+    def upsert_fields(self, items, batch_size=BATCH_SIZE):
+        """
+        Set fields on the document matching the key fields of each (key, fields)
+        pair, creating it when missing, with batched bulk writes
+        """
+        return self._bulk_write((UpdateOne(key, {'$set': fields}, upsert=True) for key, fields in items),
+                                batch_size)
+
+    def delete(self, doc_id):
+        return self.collection.delete_one({'_id': doc_id}).deleted_count > 0
+
+    def delete_many(self, query, limit=0):
+        """
+        Delete the documents matching query, at most `limit` of them when given.
+        Returns the number deleted.
+        """
+        if not limit:
+            return self.collection.delete_many(query).deleted_count
+        ids = [doc['_id'] for doc in self.find(query, {'_id': 1}, limit=limit)]
+        if not ids:
+            return 0
+        return self.collection.delete_many({'_id': {'$in': ids}}).deleted_count
+
+    def count_by(self, field):
+        """
+        Number of documents per value of field
+        """
+        return {doc['_id']: doc['count'] for doc in self.collection.aggregate([
+            {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}}
+        ])}
+
+    def stats(self):
+        """
+        Document count and the bytes used by the documents and by the indexes
+        """
+        stats = self.collection.database.command('collStats', self.collection.name)
+        return {'count': stats.get('count', 0), 'size': stats.get('size', 0),
+                'index_size': stats.get('totalIndexSize', 0)}
+
+    def _bulk_write(self, ops, batch_size):
+        modified = 0
+        batch = []
+        for op in ops:
+            batch.append(op)
+            if len(batch) >= batch_size:
+                modified += self._write_batch(batch)
+                batch = []
+        if batch:
+            modified += self._write_batch(batch)
+        return modified
+
+    def _write_batch(self, batch):
+        result = self.collection.bulk_write(batch, ordered=False)
+        return result.modified_count + result.upserted_count
+
+
+def _inc(deltas, touch):
+    update = {'$inc': deltas}
+    if touch:
+        update['$currentDate'] = {touch: True}
+    return update
+
+
+def _rescored_inc(deltas, touch, half_life):
+    """
+    Pipeline update adding deltas to counter fields and recomputing the
+    post's trending score from the new values, in one write
+    """
+    fields = {field: {'$add': [{'$ifNull': [f'${field}', 0]}, delta]} for field, delta in deltas.items()}
+    if touch:
+        fields[touch] = datetime.now(timezone.utc)
+    return [{'$set': fields}, {'$set': {'trending': trending_expression(half_life)}}]
+
+
+def listing_filter(filters):
+    """
+    Build the posts filter for a listing from its search filters
+    """
+    query = {}
+    if filters.get('q'):
+        # Narrowed by the gram index, then confirmed by regex on the candidates
+        query.update(contains_filter(filters['q']))
+    if filters.get('tags'):
+        query['tags'] = {'$all' if filters.get('require_all_tags') else '$in': filters['tags']}
+    if filters.get('category'):
+        query['category'] = filters['category']
+    return query
+
+
+class MongoPosts(MongoRepository):
+    def increment(self, doc_id, deltas, touch=None, half_life=None):
+        """
+        Add deltas to counter fields, setting the `touch` date field to now.
+        With half_life the trending score is recomputed in the same update.
+        Returns whether the post exists.
+        """
+        if half_life is None:
+            return super().increment(doc_id, deltas, touch)
+        return self.collection.update_one({'_id': doc_id}, _rescored_inc(deltas, touch, half_life)).matched_count > 0
+
+    def increment_many(self, items, touch=None, half_life=None, batch_size=BATCH_SIZE):
+        """
+        Apply (doc_id, deltas) increments with batched bulk writes, rescoring
+        each post in the same update when half_life is given
+        """
+        if half_life is None:
+            return super().increment_many(items, touch, batch_size)
+        return self._bulk_write((UpdateOne({'_id': doc_id}, _rescored_inc(deltas, touch, half_life))
+                                 for doc_id, deltas in items), batch_size)
+
+    def find_page(self, filters, sort, after=None, before=None, page_size=DEFAULT_PAGE_SIZE, projection=None):
+        """
+        One keyset page of posts matching the listing filters (q, tags,
+        require_all_tags, category), ordered by sort descending then _id.
+        sort is a post field or 'relevance', which ranks by $text score.
+        """
+        query = listing_filter(filters)
+        add_fields = None
+        field = sort
+        if sort == 'relevance':
+            # $or condition CANNOT be used with $text search in MongoDB
+            query.pop('$or', None)
+            query.pop('search_grams', None)
+            query['$text'] = {'$search': filters['q']}
+            field = 'score'
+            add_fields = {'score': {'$meta': 'textScore'}}
+        pipeline = page_pipeline(query, field, -1, page_size, after=after, before=before,
+                                 add_fields=add_fields, projection=projection)
+        return finish_page(self.collection.aggregate(pipeline), field, page_size, after=after, before=before)
+
+    def get_view(self, post_id, projection=None, comments_page_size=DEFAULT_PAGE_SIZE):
+        """
+        A post with its creator's username as 'creator' and the first page of
+        its comments as 'comment_page', in one aggregation. None if missing.
+        """
+        pipeline = [{'$match': {'_id': post_id}}]
+        if projection:
+            pipeline.append({'$project': projection})
+        pipeline += [
+            {
+                '$lookup': {
+                    'from': 'users',
+                    # creator_id is stored as a string, users are keyed by ObjectId
+                    'let': {'creator_id': {'$convert': {'input': '$creator_id', 'to': 'objectId',
+                                                        'onError': None, 'onNull': None}}},
+                    'pipeline': [
+                        {'$match': {'$expr': {'$eq': ['$_id', '$$creator_id']}}},
+                        {'$project': {'username': 1}}
+                    ],
+                    'as': 'creator'
+                }
+            },
+            {
+                '$lookup': {
+                    'from': 'comments',
+                    'let': {'post_id': '$_id'},
+                    'pipeline': [
+                        {'$match': {'$expr': {'$eq': ['$post_id', '$$post_id']}}}
+                    ] + comment_page_stages(comments_page_size),
+                    'as': 'comment_page'
+                }
+            }
+        ]
+        post = next(self.collection.aggregate(pipeline), None)
+        if post is None:
+            return None
+        creator = post['creator']
+        post['creator'] = creator[0].get('username') if creator else None
+        post['comment_page'] = finish_page(post['comment_page'], 'created_at', comments_page_size)
+        return post
+
+
+def comment_page_stages(page_size):
+    """
+    Aggregation stages that turn matched comments into one page (plus one extra
+    to detect a next page) ordered by (created_at, _id), with the commenter's username.
+    """
+    return [
+        {'$sort': {'created_at': 1, '_id': 1}},
+        {'$limit': page_size + 1},
+        {
+            '$lookup': {
+                'from': 'users',
+                'localField': 'creator_id',
+                'foreignField': '_id',
+                'as': 'creator'
+            }
+        },
+        {
+            '$unwind': {
+                'path': '$creator',
+                'preserveNullAndEmptyArrays': True  # Keep the comment even if there's no user match
+            }
+        },
+        {
+            '$project': {
+                'username': '$creator.username',
+                'content': '$comment',
+                'created_at': '$created_at',
+                'user_id': '$creator_id',
+            }
+        }
+    ]
+
+
+class MongoComments(MongoRepository):
+    def find_page(self, post_id, after=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        One page of a post's comments, oldest first, with commenter usernames
+        """
+        match = {'post_id': post_id}
+        if after is not None:
+            match.update(keyset_match('created_at', 1, after))
+        return finish_page(self.collection.aggregate([{'$match': match}] + comment_page_stages(page_size)),
+                           'created_at', page_size, after=after)
+
+
+class MongoLikes(MongoRepository):
+    def add(self, post_id, user_id):
+        """
+        Record a like; returns False if the user already liked the post.
+        The unique (post_id, user_id) index makes this safe under concurrent clicks.
+        """
+        try:
+            self.collection.insert_one({'post_id': post_id, 'user_id': user_id})
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def remove(self, post_id, user_id):
+        """
+        Remove a like; returns whether there was one
+        """
+        return self.collection.delete_one({'post_id': post_id, 'user_id': user_id}).deleted_count > 0
+
+
+class MongoUsers(MongoRepository):
+    def find_by_keys(self, username_key=None, email_key=None, username=None, email=None):
+        """
+        The user whose normalized username or email matches.
+        Users not yet given the normalized keys (see migrate-users) are
+        matched on the exact username or email instead.
+        """
+        clauses = [{"username_lower": username_key}, {"email_lower": email_key}]
+        if username is not None:
+            clauses.append({"username": username})
+        if email is not None:
+            clauses.append({"email": email})
+        return self.collection.find_one({"$or": clauses})
+
+
+class MongoCategories(MongoRepository):
+    def all(self):
+        return list(self.collection.find())
+
+    def ensure(self, categories):
+        """
+        Insert the categories that don't exist yet and return their names
+        """
+        inserted = []
+        for category in categories:
+            if self.collection.count_documents({"name": category["name"]}) == 0:
+                self.collection.insert_one(dict(category))
+                inserted.append(category['name'])
+        return inserted
+
+
+class MongoGenerations:
+    """
+    Change generations, stored in the database so every worker process sees the same value
+    """
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get(self, name):
+        doc = self.collection.find_one({'_id': name})
+        return doc['value'] if doc else 0
+
+    def bump(self, name):
+        doc = self.collection.find_one_and_update({'_id': name}, {'$inc': {'value': 1}},
+                                                  upsert=True, return_document=ReturnDocument.AFTER)
+        return doc['value']
+
+    def all(self):
+        return {doc['_id']: doc['value'] for doc in self.collection.find()}
+
+    def raise_to(self, name, value):
+        """
+        Move a generation up to at least value
+        """
+        self.collection.update_one({'_id': name}, {'$max': {'value': value}}, upsert=True)
+
+
+class MongoStorage:
+    """
+    Storage on a MongoDB database
+    """
+    backend = 'mongo'
+
+    def __init__(self, db):
+        self.db = db
+        self.name = db.name
+        self.users = MongoUsers(db.users)
+        self.posts = MongoPosts(db.posts)
+        self.comments = MongoComments(db.comments)
+        self.likes = MongoLikes(db.likes)
+        self.categories = MongoCategories(db.categories)
+        self.tag_stats = MongoRepository(db.tag_stats)
+        self.category_stats = MongoRepository(db.category_stats)
+        self.terms = MongoRepository(db.terms)
+        self.generations = MongoGenerations(db.generations)
+
+    def init(self):
+        """
+        Create the collections and indexes
+        """
+        ensure_indexes(self.db)
+
+    def drop(self):
+        """
+        Remove all data
+        """
+        self.db.client.drop_database(self.db.name)
+
+    @contextmanager
+    def snapshot(self, queries, batch_size=BATCH_SIZE):
+        """
+        Read the documents matching {collection: query}, in _id order, as of
+        one point in time. Yields ({collection: cursor}, consistent): the
+        cursors share a snapshot session, so writes made while they are read
+        aren't seen. A server without snapshot reads (a standalone mongod)
+        falls back to plain reads and consistent is False.
+        """
+        session = None
+        try:
+            session = self.db.client.start_session(snapshot=True)
+            # Standalone servers only reject snapshot reads once one is run
+            self.db.generations.find_one({}, session=session)
+        except (NotImplementedError, PyMongoError):
+            if session is not None:
+                session.end_session()
+            session = None
+        try:
+            yield ({name: getattr(self, name).find(query, sort=[('_id', 1)], batch_size=batch_size, session=session)
+                    for name, query in queries.items()}, session is not None)
+        finally:
+            if session is not None:
+                session.end_session()
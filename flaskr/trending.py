@@ -0,0 +1,97 @@
+"""
+Trending order for the post index.
+
+A post's trending score is log2 of its engagement (likes, plus comments
+weighted extra) plus its age in half-lives since a fixed epoch: a post needs
+twice the engagement to rank with one a half-life newer. Older posts decay
+without their stored score ever changing, so the score is an ordinary
+indexed field, kept current whenever a post's counters move and recomputed
+in bulk by `flask rescore-trending`.
+"""
+import math
+from datetime import datetime, timezone
+
+import click
+from flask import current_app
+
+from flaskr.db import POSTS_GENERATION, bump_generation
+from flaskr.storage import get_storage
+
+# Hours for a post's engagement to count half as much
+HALF_LIFE = 24
+COMMENT_WEIGHT = 2
+EPOCH = datetime(2025, 1, 1)
+RESCORE_BATCH_SIZE = 1000
+SCORE_PROJECTION = {'likes': 1, 'comments': 1, 'created_at': 1}
+
+
+def get_half_life(app=None):
+    app = app or current_app
+    return app.config.get('TRENDING_HALF_LIFE', HALF_LIFE)
+
+
+def trending_score(post, half_life=HALF_LIFE):
+    """
+    The trending score of a post from its counters and creation time
+    """
+    engagement = max(post.get('likes') or 0, 0) + COMMENT_WEIGHT * max(post.get('comments') or 0, 0)
+    created_at = post.get('created_at') or EPOCH
+    # Stored dates are naive UTC, truncated to milliseconds, so score whole
+    # seconds to give the same result before and after a round trip
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    created_at = created_at.replace(microsecond=0)
+    age = (created_at - EPOCH).total_seconds() / 3600 / half_life
+    return round(math.log2(1 + engagement) + age, 9)
+
+
+def trending_expression(half_life=HALF_LIFE):
+    """
+    trending_score as an aggregation expression over the post's own fields,
+    so an update can move a counter and rescore the post in the same write
+    """
+    def counter(field):
+        return {'$max': [{'$ifNull': [f'${field}', 0]}, 0]}
+
+    engagement = {'$add': [counter('likes'), {'$multiply': [COMMENT_WEIGHT, counter('comments')]}]}
+    # Dates subtract to milliseconds; floor to whole seconds like trending_score
+    seconds = {'$floor': {'$divide': [{'$subtract': [{'$ifNull': ['$created_at', EPOCH]}, EPOCH]}, 1000]}}
+    age = {'$divide': [{'$divide': [seconds, 3600]}, half_life]}
+    return {'$round': [{'$add': [{'$log': [{'$add': [1, engagement]}, 2]}, age]}, 9]}
+
+
+def rescore_trending(storage=None, half_life=None, batch_size=RESCORE_BATCH_SIZE):
+    """
+    Recompute every post's trending score, writing only the ones that changed.
+    Returns the number of posts rescored.
+    """
+    half_life = half_life or get_half_life()
+    storage = storage or get_storage()
+
+    def changed():
+        for post in storage.posts.find({}, {**SCORE_PROJECTION, 'trending': 1}, batch_size=batch_size):
+            score = trending_score(post, half_life)
+            if post.get('trending') != score:
+                yield post['_id'], {'trending': score}
+
+    rescored = storage.posts.update_many(changed(), batch_size=batch_size)
+    if rescored:
+        bump_generation(POSTS_GENERATION, storage)
+    return rescored
+
+
+@click.command('rescore-trending')
+@click.option('--batch-size', type=int, default=RESCORE_BATCH_SIZE, show_default=True)
+def rescore_trending_command(batch_size):
+    """
+    Command line interface to recompute the trending scores of all posts
+    """
+    rescored = rescore_trending(batch_size=batch_size)
+    click.echo(f"Rescored {rescored} posts.")
+
+
+def init_app(app):
+    """
+    Initialize the Flask application with the trending rescore command
+    """
+    app.cli.add_command(rescore_trending_command)
@@ -6,12 +6,17 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import pytest
 from flaskr import create_app
-from flaskr.db import get_db
+from flaskr.storage import get_storage
+
+# Tests run on the in-memory storage unless STUDYSHARE_TEST_BACKEND=mongo
+TEST_BACKEND = os.environ.get('STUDYSHARE_TEST_BACKEND', 'memory')
 
 @pytest.fixture
 def app():
-    app = create_app()
+    # Tests build the autocomplete index themselves, from the data they create
+    app = create_app({'AUTOCOMPLETE_PRELOAD': False})
     app.config['TESTING'] = True
+    app.config['STORAGE_BACKEND'] = TEST_BACKEND
     app.config['MONGO_URI'] = 'mongodb://localhost:27017/test_studyshare'
     app.config['DB_NAME'] = 'test_studyshare'
     app.config['SECRET_KEY'] = 'abcdef12345678901'
@@ -22,10 +27,19 @@ def app():
 def client(app):
     return app.test_client()
 
+@pytest.fixture
+def mongo_backend(app):
+    """
+    Skip tests of MongoDB-specific behaviour (live indexes, explain plans)
+    unless running against a MongoDB server. They are opt-in locally with
+    STUDYSHARE_TEST_BACKEND=mongo and always run in CI.
+    """
+    if app.config['STORAGE_BACKEND'] != 'mongo':
+        pytest.skip("needs STUDYSHARE_TEST_BACKEND=mongo")
+
 @pytest.fixture(autouse=True)
 def clear_db(app):
     with app.app_context():
-        db = get_db()
-        db.client.drop_database('test_studyshare')  # Clear the test database before each test
+        get_storage().drop()  # Clear the test database before each test
         from flaskr.db import init_db
-        init_db()
\ No newline at end of file
+        init_db()
@@ -0,0 +1,143 @@
+import asyncio
+
+from bson.objectid import ObjectId
+
+from flask import session
+
+from flaskr.asgi import AsyncApp, create_asgi_app
+from flaskr.storage import get_storage
+from test_post import create_posts, login
+
+
+def asgi_request(asgi, method, path, query=b'', headers=(), body=b''):
+    """
+    Send one HTTP request through the ASGI app and return (status, headers, body).
+    """
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+             'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+             'http_version': '1.1', 'scheme': 'http', 'server': ('localhost', 80)}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi(scope, receive, send))
+    response_headers = {name.decode(): value.decode() for name, value in sent[0]['headers']}
+    return sent[0]['status'], response_headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+def session_cookie(client):
+    return [('Cookie', f"session={client.get_cookie('session').value}")]
+
+def test_async_view_matches_sync(app, client):
+    """
+    Test that the async view renders the same page as the Flask view.
+    """
+    app.config['ASYNC_RENDER_WORKERS'] = 0
+    user_id = login(client)
+    with app.app_context():
+        get_storage().users.insert({'_id': ObjectId(user_id), 'username': 'testuser', 'email': 'test@example.com'})
+    client.post('/post/create', data={'title': 'Async post', 'content': '# Heading', 'tags': '', 'category': 'General'})
+    with app.app_context():
+        post_id = str(get_storage().posts.find_one({'title': 'Async post'})['_id'])
+    for i in range(3):
+        client.post(f'/post/{post_id}/comment', data={'comment': f'Comment number {i}'})
+    client.get(f'/post/{post_id}/view')  # Consume the flash messages
+    app.config['COMMENTS_PER_PAGE'] = 2
+
+    expected = client.get(f'/post/{post_id}/view')
+    status, headers, body = asgi_request(create_asgi_app(app), 'GET', f'/post/{post_id}/view',
+                                         headers=session_cookie(client))
+    assert status == 200
+    assert body == expected.data
+    assert b'Created by: testuser' in body
+    assert headers['etag'] == expected.headers['ETag']
+
+    status, _, _ = asgi_request(create_asgi_app(app), 'GET', f'/post/{post_id}/view',
+                                headers=session_cookie(client) + [('If-None-Match', headers['etag'])])
+    assert status == 304
+
+    status, _, _ = asgi_request(create_asgi_app(app), 'GET', f'/post/{ObjectId()}/view')
+    assert status == 404
+
+def test_async_index_matches_sync(app, client):
+    """
+    Test that the async index renders the same listing page, flashes included.
+    """
+    create_posts(app, 5)
+    asgi = create_asgi_app(app)
+    for query in (b'', b'sort=title&per_page=2', b'sort=bogus'):
+        expected = client.get('/post/?' + query.decode())
+        status, _, body = asgi_request(asgi, 'GET', '/post/', query=query)
+        assert status == 200
+        assert body == expected.data
+
+def test_async_renders_stale_html_in_pool(app, client):
+    """
+    Test that a post without stored HTML is rendered on the render pool and written back.
+    """
+    from flaskr.render import RENDERER_VERSION, html_cache
+    app.config['ASYNC_RENDER_WORKERS'] = 1
+    create_posts(app, 1)
+    html_cache.clear()
+    with app.app_context():
+        post_id = get_storage().posts.find_one()['_id']
+
+    asgi = create_asgi_app(app)
+    status, _, body = asgi_request(asgi, 'GET', f'/post/{post_id}/view')
+    assert status == 200
+    assert b'<p>Content of post 0</p>' in body
+    with app.app_context():
+        assert get_storage().posts.get(post_id)['renderer_version'] == RENDERER_VERSION
+    app.extensions.pop('asgi_pools').shutdown()
+
+def test_asgi_passes_writes_to_flask(app, client):
+    """
+    Test that routes without a coroutine, like a form POST, run the Flask app.
+    """
+    login(client)
+    body = b'title=Posted+over+ASGI&content=Body&tags=&category=General'
+    status, headers, _ = asgi_request(create_asgi_app(app), 'POST', '/post/create',
+                                      headers=session_cookie(client) + [
+                                          ('Content-Type', 'application/x-www-form-urlencoded'),
+                                          ('Content-Length', str(len(body)))],
+                                      body=body)
+    assert status == 302
+    assert headers['location'] == '/post/'
+    with app.app_context():
+        assert get_storage().posts.find_one({'title': 'Posted over ASGI'}) is not None
+
+    status, _, _ = asgi_request(create_asgi_app(app), 'GET', '/post')
+    assert status == 308
+
+def test_async_dispatch_errors_teardown_and_session(app):
+    """
+    Test that coroutine views get Flask's error handling, teardown callbacks and session save.
+    """
+    async def broken():
+        raise RuntimeError('boom')
+
+    async def remember(post_id):
+        session['seen'] = post_id
+        return 'remembered'
+
+    torn_down = []
+    app.teardown_request(torn_down.append)
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    asgi = AsyncApp(app, views={'post.index': broken, 'post.view': remember})
+
+    status, _, _ = asgi_request(asgi, 'GET', '/post/')
+    assert status == 500
+    assert isinstance(torn_down[-1], RuntimeError)
+
+    post_id = str(ObjectId())
+    status, headers, body = asgi_request(asgi, 'GET', f'/post/{post_id}/view')
+    assert status == 200
+    assert body == b'remembered'
+    assert torn_down[-1] is None
+    cookie = headers['set-cookie'].split(';')[0]
+    with app.test_request_context(headers={'Cookie': cookie}):
+        assert session['seen'] == post_id
@@ -116,8 +116,8 @@ def test_register(client):
     
     # Test standard exception handling
     from unittest.mock import patch
-    with patch('flaskr.auth.get_db') as mock_get_db:
-        mock_get_db.return_value.users.insert_one.side_effect = Exception("Database error")
+    with patch('flaskr.auth.get_storage') as mock_get_storage:
+        mock_get_storage.return_value.users.insert.side_effect = Exception("Database error")
         
         response = client.post('/auth/register', data={
             'username': 'erroruser',
@@ -128,8 +128,8 @@ def test_register(client):
         assert b"An unknown error occurred." in response.data
     
     # Unknown Duplicate error handling
-    with patch('flaskr.auth.get_db') as mock_get_db:
-        mock_get_db.return_value.users.insert_one.side_effect = DuplicateKeyError("Duplicate key error")
+    with patch('flaskr.auth.get_storage') as mock_get_storage:
+        mock_get_storage.return_value.users.insert.side_effect = DuplicateKeyError("Duplicate key error")
         
         response = client.post('/auth/register', data={
             'username': 'duplicateusernow',
@@ -158,4 +158,54 @@ def test_logout(client):
     with client.session_transaction() as session:
         assert 'user_id' not in session
         assert 'username' not in session
-        assert 'logged_in' not in session
\ No newline at end of file
+        assert 'logged_in' not in session
+def test_login_case_insensitive(client):
+    """
+    Test that login matches usernames and emails case-insensitively through the normalized keys.
+    """
+    client.post('/auth/register', data={
+        'username': 'CaseUser',
+        'email': 'CaseUser@Example.com',
+        'password': 'password123'
+    })
+    response = client.post('/auth/login', data={'username': 'caseuser', 'password': 'password123'})
+    assert response.status_code == 302
+    response = client.post('/auth/login', data={'username': 'CASEUSER@example.COM', 'password': 'password123'})
+    assert response.status_code == 302
+
+    response = client.post('/auth/register', data={
+        'username': 'caseUSER',
+        'email': 'other@example.com',
+        'password': 'password123'
+    })
+    assert b"Username or email already exists." in response.data
+
+def test_migrate_users_command(app):
+    """
+    Test that existing users get normalized lookup keys.
+    """
+    from flaskr.storage import get_storage
+    with app.app_context():
+        users = get_storage().users
+        users.insert({'username': 'OldUser', 'email': 'Old@Example.com', 'password': 'x'})
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['migrate-users'])
+        assert 'Migrated 1 users.' in result.output
+        user = users.find_one({'username': 'OldUser'})
+        assert user['username_lower'] == 'olduser'
+        assert user['email_lower'] == 'old@example.com'
+
+def test_login_before_migration(app, client):
+    """
+    Test that users without normalized keys can still log in and can't be registered twice.
+    """
+    from flaskr.storage import get_storage
+    from werkzeug.security import generate_password_hash
+    with app.app_context():
+        get_storage().users.insert({'username': 'OldUser', 'email': 'old@example.com',
+                                    'password': generate_password_hash('password123')})
+    response = client.post('/auth/login', data={'username': 'OldUser', 'password': 'password123'})
+    assert response.headers['Location'] == '/post/'
+    response = client.post('/auth/register', data={
+        'username': 'OldUser', 'email': 'new@example.com', 'password': 'password123'})
+    assert b"Username or email already exists." in response.data
@@ -0,0 +1,88 @@
+import time
+
+from flaskr import autocomplete
+from flaskr.autocomplete import PrefixIndex, get_autocomplete
+from flaskr.facets import rebuild_facets
+from flaskr.storage import get_storage
+from test_post import create_posts, login
+
+
+def test_prefix_index_ranks_and_bounds():
+    """
+    Test that completions are ranked by weight and the index stays within max_entries.
+    """
+    index = PrefixIndex(max_entries=3)
+    index.build([('python', 'python', 5), ('pytest', 'pytest', 2), ('pandas', 'pandas', 9), ('java', 'java', 1)])
+    assert len(index) == 3
+    assert index.evicted == 1
+    assert index.complete('p') == [('pandas', 9), ('python', 5), ('pytest', 2)]
+    assert index.complete('py', limit=1) == [('python', 5)]
+
+    index.add('pygame', 'pygame', 1)  # lighter than everything kept
+    assert index.complete('pyg') == []
+    index.add('pytorch', 'pytorch', 3)
+    assert index.complete('py') == [('python', 5), ('pytorch', 3)]
+    index.add('python', 'python', -5)
+    assert index.complete('py') == [('pytorch', 3)]
+    # Eviction follows weights changed after they were pushed
+    index.add('pandas', 'pandas', -8)
+    index.add('rust', 'rust', 2)
+    index.add('go', 'go', 2)
+    assert index.complete('pa') == []
+    assert index.complete('go') == [('go', 2)]
+    assert index.bytes > 0
+
+def test_autocomplete_endpoint(app, client):
+    """
+    Test that suggestions are built from the posts and follow create, edit and delete.
+    """
+    create_posts(app, 2)
+    with app.app_context():
+        rebuild_facets()
+        get_autocomplete().build()
+    response = client.get('/post/autocomplete?q=Te')
+    assert response.json == {'tags': [{'tag': 'test', 'count': 2}], 'titles': []}
+    assert [item['title'] for item in client.get('/post/autocomplete?q=post 00&kind=titles').json['titles']] == \
+        ['Post 000', 'Post 001']
+    # Titles are found from any of their first words
+    assert len(client.get('/post/autocomplete?q=001&kind=titles').json['titles']) == 1
+
+    login(client, 'someone')
+    client.post('/post/create', data={'title': 'Testing tips', 'content': 'Body', 'tags': 'Testing, test',
+                                      'category': 'General'})
+    response = client.get('/post/autocomplete?q=test')
+    assert response.json['tags'] == [{'tag': 'test', 'count': 3}, {'tag': 'testing', 'count': 1}]
+    assert response.json['titles'][0]['title'] == 'Testing tips'
+
+    with app.app_context():
+        post_id = get_storage().posts.find_one({'title': 'Testing tips'})['_id']
+    client.post(f'/post/{post_id}/edit', data={'title': 'Debugging tips', 'content': 'Body', 'tags': 'debugging',
+                                               'category': 'General'})
+    assert client.get('/post/autocomplete?q=testing').json == {'tags': [], 'titles': []}
+    assert client.get('/post/autocomplete?q=deb&kind=tags').json == {'tags': [{'tag': 'debugging', 'count': 1}]}
+    client.post(f'/post/{post_id}/delete')
+    assert client.get('/post/autocomplete?q=d').json == {'tags': [], 'titles': []}
+
+    with app.app_context():
+        stats = get_autocomplete().stats()
+    assert stats['builds'] == 1
+    assert stats['tag_entries'] == 1
+    app.config['METRICS_TOKEN'] = 'scrape-me'
+    assert b'studyshare_autocomplete_bytes' in client.get('/metrics', headers={'Authorization': 'Bearer scrape-me'}).data
+
+def test_autocomplete_builds_at_startup(app, client):
+    """
+    Test that AUTOCOMPLETE_PRELOAD builds the index in the background, before any request.
+    """
+    create_posts(app, 2)
+    with app.app_context():
+        rebuild_facets()
+    app.config['AUTOCOMPLETE_PRELOAD'] = True
+    autocomplete.init_app(app)
+    index = get_autocomplete(app)
+    deadline = time.monotonic() + 5
+    while index.built_at is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert index.stats()['builds'] == 1
+    assert client.get('/post/autocomplete?q=te&kind=tags').json == {'tags': [{'tag': 'test', 'count': 2}]}
+    assert index.stats()['builds'] == 1
@@ -0,0 +1,88 @@
+import threading
+import time
+
+from werkzeug.datastructures import MultiDict
+
+from flaskr.cache import ResponseCache, SQLiteCache, listing_key
+
+
+def test_listing_key_normalizes_args():
+    assert listing_key(MultiDict([('sort', 'created_at'), ('q', ' notes ')])) == 'q=notes'
+    assert listing_key(MultiDict([('utm', 'x'), ('tags', 'a'), ('tags', ' b ')])) == 'tags=a,b'
+    assert listing_key(MultiDict()) == ''
+
+def test_response_cache_tiers(tmp_path):
+    shared = SQLiteCache(str(tmp_path / 'cache.db'))
+    first = ResponseCache(shared=shared)
+    second = ResponseCache(shared=shared)
+
+    assert first.get_or_compute('key', lambda: ('page', True)) == 'page'
+    assert first.get_or_compute('key', lambda: ('other', True)) == 'page'
+    # A second worker picks the entry up from the shared tier
+    assert second.get_or_compute('key', lambda: ('other', True)) == 'page'
+    assert first.stats()['local_hits'] == 1
+    assert second.stats()['shared_hits'] == 1
+
+    assert first.get_or_compute('flashed', lambda: ('error page', False)) == 'error page'
+    assert first.get_or_compute('flashed', lambda: ('page', True)) == 'page'
+
+def test_response_cache_stampede():
+    cache = ResponseCache()
+    calls = []
+    started = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.wait(0.2)
+        return 'page', True
+
+    threads = [threading.Thread(target=cache.get_or_compute, args=('cold', compute)) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    started.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert cache._key_locks == {}
+
+def test_response_cache_uncacheable_misses_queue():
+    """
+    Test that uncacheable misses for one key run one at a time, and that the
+    key's lock is dropped once nobody holds or waits for it.
+    """
+    cache = ResponseCache()
+    running = []
+    overlaps = []
+    lock = threading.Lock()
+
+    def compute():
+        with lock:
+            running.append(1)
+            overlaps.append(len(running))
+        time.sleep(0.005)
+        with lock:
+            running.pop()
+        return 'private page', False
+
+    def request():
+        for _ in range(5):
+            cache.get_or_compute('user-page', compute)
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(overlaps) == 40
+    assert max(overlaps) == 1
+    assert cache._key_locks == {}
+
+def test_index_served_from_cache(app, client):
+    from flaskr.cache import get_response_cache
+    assert client.get('/post/').status_code == 200
+    assert client.get('/post/').status_code == 200
+    with app.app_context():
+        stats = get_response_cache().stats()
+    assert stats['misses'] == 1
+    assert stats['local_hits'] == 1
@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+
+from bson.objectid import ObjectId
+
+from flaskr.cleanup import get_cleanup_queue
+from flaskr.flusher import _flushers
+from flaskr.storage import get_storage
+from test_post import create_posts, login
+
+
+def add_thread(app, post_id, comments, likes):
+    with app.app_context():
+        storage = get_storage()
+        now = datetime.now(timezone.utc)
+        storage.comments.insert_many([{'post_id': post_id, 'creator_id': 'someone', 'comment': f'Comment {i}',
+                                       'created_at': now} for i in range(comments)])
+        storage.likes.insert_many([{'post_id': post_id, 'user_id': f'user{i}'} for i in range(likes)])
+
+def dependents(app, post_id):
+    with app.app_context():
+        storage = get_storage()
+        return storage.comments.count({'post_id': post_id}), storage.likes.count({'post_id': post_id})
+
+def test_delete_removes_comments_and_likes(app, client):
+    """
+    Test that deleting a post deletes its comments and likes in batches, and nothing else.
+    """
+    app.config['CASCADE_DELETE_BATCH_SIZE'] = 3
+    create_posts(app, 2)
+    with app.app_context():
+        deleted, kept = [post['_id'] for post in get_storage().posts.find({}, sort=[('title', 1)])]
+    add_thread(app, deleted, comments=10, likes=7)
+    add_thread(app, kept, comments=2, likes=1)
+
+    login(client, 'someone')
+    assert client.post(f'/post/{deleted}/delete').status_code == 302
+    assert dependents(app, deleted) == (0, 0)
+    assert dependents(app, kept) == (2, 1)
+
+def test_delete_through_queue(app, client):
+    """
+    Test that with CASCADE_DELETE_QUEUE the dependents are deleted by the queue, not the request.
+    """
+    app.config['CASCADE_DELETE_QUEUE'] = True
+    app.config['CASCADE_DELETE_INTERVAL'] = 60
+    create_posts(app, 1)
+    with app.app_context():
+        post_id = get_storage().posts.find_one()['_id']
+    add_thread(app, post_id, comments=5, likes=5)
+
+    login(client, 'someone')
+    assert client.post(f'/post/{post_id}/delete').status_code == 302
+    assert dependents(app, post_id) == (5, 5)
+    with app.app_context():
+        queue = get_cleanup_queue()
+        assert queue.flush() == 10
+        # Cleaned up at exit by the shared exit hook until stopped
+        assert queue in _flushers
+        queue.stop()
+        assert queue not in _flushers
+    assert dependents(app, post_id) == (0, 0)
+
+def test_gc_orphans_command(app, tmp_path):
+    """
+    Test that gc-orphans reports, then deletes, the dependents of missing posts.
+    """
+    create_posts(app, 1)
+    with app.app_context():
+        post_id = get_storage().posts.find_one()['_id']
+    add_thread(app, post_id, comments=2, likes=2)
+    orphaned = [ObjectId(), ObjectId()]
+    for orphan in orphaned:
+        add_thread(app, orphan, comments=3, likes=1)
+
+    runner = app.test_cli_runner()
+    with app.app_context():
+        result = runner.invoke(args=['gc-orphans', '--dry-run'])
+        assert 'comments: 6 orphans of 2 deleted posts.' in result.output
+        assert get_storage().comments.count() == 8
+
+        result = runner.invoke(args=['gc-orphans', '--batch-size', '2'])
+        assert 'comments: deleted 6 orphans of 2 deleted posts, reclaimed ' in result.output
+        assert 'likes: deleted 2 orphans of 2 deleted posts' in result.output
+    assert dependents(app, post_id) == (2, 2)
+    assert sum(sum(dependents(app, orphan)) for orphan in orphaned) == 0
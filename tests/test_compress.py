@@ -0,0 +1,58 @@
+import gzip
+
+import pytest
+
+from flaskr.compress import get_compressor
+
+
+def test_pages_are_compressed_when_accepted(app, client):
+    """
+    Test that large HTML responses are gzipped for clients that accept it,
+    that the compressed body is reused, and that revalidation still works.
+    """
+    plain = client.get('/')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain.data
+    assert int(response.headers['Content-Length']) == len(response.data) < len(plain.data)
+    assert response.headers['ETag'].startswith('W/')
+
+    client.get('/', headers={'Accept-Encoding': 'gzip'})
+    with app.app_context():
+        assert get_compressor().stats()['cache_hits'] >= 1
+    assert client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']}) \
+        .status_code == 304
+
+    # Small responses and clients refusing gzip get the body as is
+    assert 'Content-Encoding' not in client.get('/post/autocomplete?q=x', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in client.get('/', headers={'Accept-Encoding': 'gzip;q=0'}).headers
+
+def test_brotli_is_preferred(client):
+    """
+    Test that brotli is chosen over gzip when the brotli package is installed.
+    """
+    brotli = pytest.importorskip('brotli')
+    plain = client.get('/')
+    response = client.get('/', headers={'Accept-Encoding': 'gzip, deflate, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == plain.data
+
+def test_static_urls_are_fingerprinted(client):
+    """
+    Test that static files are linked by content hash and served as immutable
+    at their current hash only.
+    """
+    page = client.get('/').get_data(as_text=True)
+    url = page.split('<link rel="stylesheet" href="')[1].split('"')[0]
+    assert url.startswith('/static/style.css?v=')
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 365 * 24 * 3600
+    assert not response.cache_control.no_cache
+
+    assert not client.get('/static/style.css?v=stale').cache_control.immutable
@@ -1,4 +1,5 @@
 from flaskr.db import get_db, close_db, init_db
+from flaskr.storage import get_storage
 from flask import g
 
 def test_close_db(app):
@@ -13,4 +14,73 @@ def test_init_db_command(app):
         runner = app.test_cli_runner()
         result = runner.invoke(args=['init-db', '--test'])
         assert 'Initialized the database.' in result.output
-    
\ No newline at end of file
+    
+def test_get_db_reuses_pooled_client(app):
+    with app.app_context():
+        first = get_db().client
+        close_db()
+    with app.app_context():
+        second = get_db().client
+        assert first is second
+
+def test_pool_stats(app):
+    from flaskr.db import get_pool_stats
+    with app.app_context():
+        get_db()
+        stats = get_pool_stats()
+        assert stats['clients'] >= 1
+        assert 'checked_out' in stats
+        assert 'wait_time_avg_ms' in stats
+
+def test_reconcile_counters_command(app):
+    from bson.objectid import ObjectId
+    with app.app_context():
+        storage = get_storage()
+        post_id = storage.posts.insert({'title': 'Drifted', 'likes': 7, 'comments': 0})
+        storage.likes.insert_many([{'post_id': post_id, 'user_id': str(ObjectId())} for _ in range(2)])
+        storage.comments.insert({'post_id': post_id, 'creator_id': ObjectId(), 'comment': 'hi'})
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['reconcile-counters'])
+        assert 'Reconciled counters on 1 posts.' in result.output
+        post = storage.posts.get(post_id)
+        assert post['likes'] == 2
+        assert post['comments'] == 1
+
+def test_categories_cache(app):
+    from flaskr.db import get_categories, invalidate_categories, get_generation
+    with app.app_context():
+        storage = get_storage()
+        categories = get_categories()
+        assert 'General' in [category['name'] for category in categories]
+
+        # Served from memory until invalidated
+        storage.categories.insert({'name': 'Economics', 'description': 'Discussions about economics.'})
+        assert 'Economics' not in [category['name'] for category in get_categories()]
+
+        generation = get_generation('categories')
+        invalidate_categories()
+        assert get_generation('categories') == generation + 1
+        assert 'Economics' in [category['name'] for category in get_categories()]
+
+def test_init_db_index_spec(app, mongo_backend):
+    from flaskr.db import INDEXES, index_name
+    with app.app_context():
+        db = get_db()
+        for collection, indexes in INDEXES.items():
+            live = db[collection].index_information()
+            for index in indexes:
+                assert index_name(index['keys']) in live
+        # Indexes that serve no query are gone
+        assert 'content_1' not in db.posts.index_information()
+        assert 'password_1' not in db.users.index_information()
+
+def test_index_advisor_command(app, mongo_backend):
+    with app.app_context():
+        db = get_db()
+        db.posts.create_index([('content', 1)])
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['index-advisor', '--drop'])
+        assert 'post.index newest' in result.output
+        assert 'Index not in spec: posts.content_1' in result.output
+        assert 'content_1' not in db.posts.index_information()
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+from flaskr.facets import get_facets, rebuild_facets
+from flaskr.storage import get_storage
+from test_post import create_posts, login
+
+
+def create(client, title, tags, category):
+    client.post('/post/create', data={'title': title, 'content': 'Body', 'tags': tags, 'category': category})
+
+def facet_rows(app):
+    with app.app_context():
+        storage = get_storage()
+        tags = {(row['tag'], row['category']): row['count'] for row in storage.tag_stats.find({})}
+        categories = {row['category']: row['count'] for row in storage.category_stats.find({})}
+        return tags, categories
+
+def test_facets_follow_create_edit_delete(app, client):
+    """
+    Test that post writes keep the counts equal to a rebuild from the posts.
+    """
+    login(client)
+    create(client, 'Sorting', 'Python, algorithms', 'Technology')
+    create(client, 'Graphs', 'algorithms', 'Math')
+    create(client, 'Flask', 'python', 'Technology')
+    tags, categories = facet_rows(app)
+    assert tags[('python', None)] == 2
+    assert tags[('algorithms', 'Math')] == 1
+    assert categories == {'Technology': 2, 'Math': 1}
+
+    with app.app_context():
+        post_id = get_storage().posts.find_one({'title': 'Sorting'})['_id']
+    client.post(f'/post/{post_id}/edit', data={'title': 'Sorting', 'content': 'Body', 'tags': 'Algorithms, heaps',
+                                               'category': 'Math'})
+    with app.app_context():
+        graphs_id = get_storage().posts.find_one({'title': 'Graphs'})['_id']
+    client.post(f'/post/{graphs_id}/delete')
+
+    tags, categories = facet_rows(app)
+    assert tags == {('python', 'Technology'): 1, ('python', None): 1, ('algorithms', 'Math'): 1,
+                    ('algorithms', None): 1, ('heaps', 'Math'): 1, ('heaps', None): 1}
+    assert categories == {'Technology': 1, 'Math': 1}
+    with app.app_context():
+        storage = get_storage()
+        storage.tag_stats.insert({'tag': 'stale', 'category': None, 'count': 3})
+        row_id = storage.tag_stats.find_one({'tag': 'python', 'category': None})['_id']
+        rebuild_facets()
+        # Rows are rewritten in place and rows no post backs are dropped
+        assert storage.tag_stats.find_one({'tag': 'python', 'category': None})['_id'] == row_id
+    assert facet_rows(app) == (tags, categories)
+
+def test_facets_endpoint(app, client):
+    """
+    Test the facet JSON for no filter, a category and a tag, and its ETag.
+    """
+    create_posts(app, 3)
+    with app.app_context():
+        storage = get_storage()
+        storage.posts.insert({'title': 'Other', 'category': 'Math', 'tags': ['test', 'proofs'], 'creator_id': 'x',
+                              'created_at': datetime(2024, 1, 1), 'updated_at': datetime(2024, 1, 1)})
+        assert rebuild_facets() == (5, 2)
+
+    response = client.get('/post/facets')
+    assert response.json == {'tags': [{'tag': 'test', 'count': 4}, {'tag': 'proofs', 'count': 1}],
+                             'categories': [{'category': 'General', 'count': 3}, {'category': 'Math', 'count': 1}],
+                             'total': 4, 'exact': True}
+    assert client.get('/post/facets', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    response = client.get('/post/facets?category=Math&limit=1')
+    assert response.json['tags'] == [{'tag': 'proofs', 'count': 1}]
+    assert response.json['total'] == 1
+
+    response = client.get('/post/facets?tags=proofs')
+    assert response.json['categories'] == [{'category': 'Math', 'count': 1}]
+    with app.app_context():
+        assert get_facets({'q': 'proof', 'tags': ['test']})['exact'] is False
+
+    page = client.get('/post/').data
+    assert b'General (3)' in page
+    assert b'href="/post/?tags=proofs"' in page
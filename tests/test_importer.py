@@ -0,0 +1,113 @@
+import zipfile
+
+from pymongo.errors import BulkWriteError
+
+from flaskr.importer import import_notes, parse_front_matter
+from flaskr.render import RENDERER_VERSION
+from flaskr.storage import get_storage
+
+
+def write_course(root):
+    week1 = root / 'course' / 'week1'
+    week1.mkdir(parents=True)
+    (week1 / 'limits.md').write_text('---\ntitle: "Limits"\ntags: [Calculus, limits]\ncategory: Math\n'
+                                     'date: 2024-09-01\n---\n# Limits\n\nEpsilon-delta.\n')
+    (week1 / 'derivatives.md').write_text('---\ntags:\n  - calculus\n---\n# Derivatives\n\nSlopes.\n')
+    (root / 'course' / 'untitled.markdown').write_text('Just text.\n')
+    (root / 'course' / 'readme.txt').write_text('Not a note.\n')
+    (root / 'course' / '.draft.md').write_text('Hidden.\n')
+    return root / 'course'
+
+def test_parse_front_matter():
+    fields, body = parse_front_matter('---\ntitle: Sets\ntags:\n- a\n- "b"\n---\nBody\n')
+    assert fields == {'title': 'Sets', 'tags': ['a', 'b']}
+    assert body == 'Body\n'
+    assert parse_front_matter('No front-matter\n---\n') == ({}, 'No front-matter\n---\n')
+
+def test_import_directory_resumes(app, tmp_path):
+    """
+    Test that notes are imported with their front-matter and a second run skips them.
+    """
+    course = write_course(tmp_path)
+    with app.app_context():
+        counts = import_notes(str(course), 'someone', workers=0, batch_size=2)
+        assert counts == {'found': 3, 'imported': 3, 'skipped': 0, 'failed': 0}
+
+        posts = get_storage().posts
+        limits = posts.find_one({'import_key': 'course:week1/limits.md'})
+        assert limits['title'] == 'Limits'
+        assert limits['tags'] == ['calculus', 'limits']
+        assert limits['category'] == 'Math'
+        assert limits['created_at'].year == 2024
+        assert '<h1>Limits</h1>' in limits['content_html']
+        assert limits['renderer_version'] == RENDERER_VERSION
+        assert limits['search_grams']
+        derivatives = posts.find_one({'import_key': 'course:week1/derivatives.md'})
+        assert (derivatives['title'], derivatives['tags'], derivatives['category']) == \
+            ('Derivatives', ['calculus'], 'General')
+        assert posts.find_one({'import_key': 'course:untitled.markdown'})['title'] == 'untitled'
+
+        counts = import_notes(str(course), 'someone', workers=0)
+        assert counts == {'found': 3, 'imported': 0, 'skipped': 3, 'failed': 0}
+        assert posts.count() == 3
+
+def test_import_counts_notes_inserted_meanwhile(app, tmp_path, monkeypatch):
+    """
+    Test that notes another import inserts after the resume check count as skipped.
+    """
+    from flaskr import importer
+    course = write_course(tmp_path)
+    prepare_note = importer.prepare_note
+
+    def racing_prepare_note(note):
+        if note[0] == 'course:week1/limits.md':
+            get_storage().posts.insert({'import_key': note[0], 'title': 'Limits', 'creator_id': 'someone',
+                                        'tags': ['calculus', 'limits'], 'category': 'Math'})
+        return prepare_note(note)
+
+    monkeypatch.setattr(importer, 'prepare_note', racing_prepare_note)
+    with app.app_context():
+        counts = import_notes(str(course), 'someone', workers=0)
+        assert counts == {'found': 3, 'imported': 2, 'skipped': 1, 'failed': 0}
+        assert get_storage().posts.count() == 3
+        # The other import counts its own notes in the facets
+        tags = {row['tag'] for row in get_storage().tag_stats.find({'category': None})}
+        assert tags == {'calculus'}
+
+def test_import_counts_rejected_notes_as_failed(app, tmp_path, monkeypatch, capsys):
+    """
+    Test that write errors other than duplicate keys count as failed and are reported.
+    """
+    course = write_course(tmp_path)
+    with app.app_context():
+        posts_class = type(get_storage().posts)
+        insert_many = posts_class.insert_many
+
+        def rejecting_insert_many(self, docs, ordered=True, batch_size=None):
+            docs = list(docs)
+            rejected = next(index for index, doc in enumerate(docs) if doc['import_key'] == 'course:week1/limits.md')
+            inserted = insert_many(self, docs[:rejected] + docs[rejected + 1:], ordered=ordered)
+            raise BulkWriteError({'nInserted': inserted, 'writeErrors': [
+                {'index': rejected, 'code': 121, 'errmsg': 'Document failed validation'}]})
+
+        monkeypatch.setattr(posts_class, 'insert_many', rejecting_insert_many)
+        counts = import_notes(str(course), 'someone', workers=0)
+        assert counts == {'found': 3, 'imported': 2, 'skipped': 0, 'failed': 1}
+        assert 'Failed course:week1/limits.md: Document failed validation' in capsys.readouterr().err
+
+def test_import_notes_command_from_zip(app, client, tmp_path):
+    """
+    Test the CLI on a zip archive, rendering in a worker process.
+    """
+    archive = tmp_path / 'bio101.zip'
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('bio101/cells.md', '---\ncategory: Biology\n---\n# Cells\n\n```python\nprint(1)\n```\n')
+        zf.writestr('bio101/bad.md', b'\xff\xfe\x00bad')
+    with app.app_context():
+        get_storage().users.insert({'username': 'Teacher', 'username_lower': 'teacher',
+                                    'email': 'teacher@example.com', 'email_lower': 'teacher@example.com'})
+        result = app.test_cli_runner().invoke(args=['import-notes', str(archive), '--user', 'TEACHER',
+                                                    '--workers', '1'])
+    assert 'Imported 1 notes, skipped 0 already imported, 1 failed.' in result.output
+    response = client.get('/post/?category=Biology')
+    assert b'Cells' in response.data
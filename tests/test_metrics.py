@@ -0,0 +1,41 @@
+import queue
+
+from flaskr.metrics import SlowQueryLog, command_shape, query_shape
+
+
+def test_query_shape():
+    assert query_shape({'tags': {'$in': ['a', 'b']}, 'category': 'Math'}) == \
+        {'tags': {'$in': '?'}, 'category': '?'}
+    assert command_shape('find', {'find': 'posts', 'filter': {'_id': 1}, 'sort': {'created_at': -1}}) == \
+        '{"filter": {"_id": "?"}, "sort": ["created_at"]}'
+
+TOKEN = {'Authorization': 'Bearer scrape-me'}
+
+def test_metrics_endpoint(app, client):
+    app.config['METRICS_TOKEN'] = 'scrape-me'
+    client.get('/post/')
+    response = client.get('/metrics', headers=TOKEN)
+    assert response.status_code == 200
+    assert b'studyshare_request_seconds_count{endpoint="post.index",method="GET"}' in response.data
+    assert b'studyshare_request_template_seconds_sum{endpoint="post.index"' in response.data
+    assert b'studyshare_mongo_pool_checked_out' in response.data
+
+def test_metrics_need_token(app, client):
+    assert client.get('/metrics').status_code == 404
+    app.config['METRICS_TOKEN'] = 'scrape-me'
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics/slow-queries', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape-m\u00e9'}).status_code == 403
+    assert client.get('/metrics/slow-queries', headers=TOKEN).get_json() == []
+
+def test_slow_query_log_bounds_explained_shapes(app):
+    class Event:
+        command_name = 'find'
+        database_name = 'test'
+
+    slow_log = SlowQueryLog(app, 0, max_shapes=2)
+    # The explain thread is already waiting on the old queue, so nothing gets explained
+    slow_log._queue = queue.Queue()
+    for shape in ('a', 'b', 'a', 'c'):
+        slow_log.check(Event, {'collection': 'posts', 'shape': shape, 'command': {}}, 1.0)
+    assert list(slow_log._explained) == [('posts', 'a'), ('posts', 'c')]
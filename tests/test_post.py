@@ -0,0 +1,416 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from bson.objectid import ObjectId
+
+from flaskr.storage import get_storage
+from flaskr.pagination import decode_cursor, encode_cursor
+from flaskr.post import fetch_posts_page
+
+
+def create_posts(app, count):
+    with app.app_context():
+        storage = get_storage()
+        now = datetime.now(timezone.utc)
+        storage.posts.insert_many([{
+            'title': f'Post {i:03d}',
+            'content': f'Content of post {i}',
+            'category': 'General',
+            'creator_id': 'someone',
+            'created_at': now - timedelta(minutes=i),
+            'updated_at': now - timedelta(minutes=i),
+            'tags': ['test'],
+            'likes': 0,
+            'comments': 0
+        } for i in range(count)])
+
+def test_cursor_round_trip():
+    """
+    Test that cursors survive encoding and decoding.
+    """
+    created_at = datetime(2025, 4, 30, 12, 0, 0)
+    doc_id = ObjectId()
+    assert decode_cursor(encode_cursor(created_at, doc_id)) == (created_at, doc_id)
+    assert decode_cursor(encode_cursor('Title', doc_id)) == ('Title', doc_id)
+    assert decode_cursor('') is None
+
+def test_index_pagination(app, client):
+    """
+    Test that the index pages through posts with next/prev cursors.
+    """
+    create_posts(app, 5)
+
+    response = client.get('/post/?per_page=2')
+    assert response.status_code == 200
+    assert b'Post 000' in response.data
+    assert b'Post 001' in response.data
+    assert b'Post 002' not in response.data
+    assert b'Next' in response.data
+    assert b'Previous' not in response.data
+
+    with app.test_request_context('/post/?per_page=2'):
+        posts = get_storage().posts
+        first = fetch_posts_page(posts, {}, 'created_at', None, None, 2)
+        second = fetch_posts_page(posts, {}, 'created_at', decode_cursor(first['next']), None, 2)
+        assert [p['title'] for p in second['items']] == ['Post 002', 'Post 003']
+        assert all('content' not in p for p in second['items'])
+        back = fetch_posts_page(posts, {}, 'created_at', None, decode_cursor(second['prev']), 2)
+        assert [p['title'] for p in back['items']] == ['Post 000', 'Post 001']
+        assert back['prev'] is None
+
+def test_index_invalid_cursor(client):
+    """
+    Test that a malformed cursor falls back to the first page.
+    """
+    response = client.get('/post/?after=not-a-cursor')
+    assert response.status_code == 200
+    assert b'Invalid page cursor.' in response.data
+
+def login(client, user_id=None):
+    """
+    Put a logged-in user straight into the session.
+    """
+    user_id = user_id or str(ObjectId())
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['username'] = 'testuser'
+        session['logged_in'] = True
+        session['user_data'] = {'username': 'testuser', 'email': 'test@example.com', 'user_id': user_id}
+    return user_id
+
+def test_create_stores_rendered_html(app, client):
+    """
+    Test that posts are rendered once on create and the view serves the stored HTML.
+    """
+    from flaskr.render import RENDERER_VERSION, content_hash, html_cache
+    login(client)
+    client.post('/post/create', data={
+        'title': 'Markdown post',
+        'content': '# Heading\n\n```python\nprint("hi")\n```',
+        'tags': 'python',
+        'category': 'General'
+    })
+    with app.app_context():
+        post = get_storage().posts.find_one({'title': 'Markdown post'})
+    assert '<h1>Heading</h1>' in post['content_html']
+    assert post['content_hash'] == content_hash(post['content'])
+    assert post['renderer_version'] == RENDERER_VERSION
+
+    html_cache.clear()
+    response = client.get(f"/post/{post['_id']}/view")
+    assert b'<h1>Heading</h1>' in response.data
+    assert html_cache.get(post['content_hash']) == post['content_html']
+
+def test_render_cache_evicts_by_size():
+    """
+    Test that the render cache stays under its byte budget.
+    """
+    from flaskr.render import RenderCache
+    cache = RenderCache(10)
+    cache.put('a', 'aaaa')
+    cache.put('b', 'bbbb')
+    cache.get('a')
+    cache.put('c', 'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'aaaa'
+    assert cache.stats()['bytes'] <= 10
+
+RENDER_CASES = [
+    "# Notes\n\nIntro *text*\n\n```python\ndef f():\n    return 1\n```\n\n- a\n- b\n\n```\nplain\n```\n",
+    "- item\n```python\nx = 1\n```\ntext\n\n> quote\n```\nz\n```\n> quote again",
+    "Intro\n\n````\n```\nnested\n```\n````\n\n| a | b |\n| - | - |\n| 1 | 2 |\n\nend\t\ttab\r\nline",
+    "Term\n\n```\nx\n```\n\n: definition",
+    "See [the docs][docs].\n\n```python\ny = 2\n```\n\n[docs]: https://example.com",
+    "<div>\n\n```\nraw\n```\n\n</div>",
+]
+
+def test_render_by_blocks_matches_whole_render():
+    """
+    Test that block-by-block rendering is byte-identical to rendering the whole
+    note, and that an edit only re-renders the blocks it changed.
+    """
+    import markdown
+    from flaskr.render import MARKDOWN_EXTENSIONS, block_cache, render_markdown
+    for content in RENDER_CASES:
+        assert render_markdown(content) == markdown.markdown(content, extensions=MARKDOWN_EXTENSIONS)
+
+    block_cache.clear()
+    note = '\n\n'.join(f"Part {i}\n\n```python\nprint({i})\n```" for i in range(5))
+    render_markdown(note)
+    misses = block_cache.stats()['misses']
+    edited = note.replace('print(3)', 'print(33)')
+    assert render_markdown(edited) == markdown.markdown(edited, extensions=MARKDOWN_EXTENSIONS)
+    assert block_cache.stats()['misses'] == misses + 1
+
+def test_render_pool_matches_whole_render():
+    """
+    Test that blocks rendered in the process pool give the same HTML.
+    """
+    import markdown
+    from flaskr.render import MARKDOWN_EXTENSIONS, block_cache, render_markdown, render_pool
+    note = '\n\n'.join(f"## Part {i}\n\n```python\nfor n in range({i}):\n    print(n)\n```" for i in range(8))
+    block_cache.clear()
+    workers, render_pool.workers = render_pool.workers, 2
+    try:
+        assert render_markdown(note) == markdown.markdown(note, extensions=MARKDOWN_EXTENSIONS)
+        assert render_pool.executor is not None
+    finally:
+        render_pool.shutdown()
+        render_pool.workers = workers
+
+def test_render_posts_command(app):
+    """
+    Test that render-posts re-renders posts from an older renderer.
+    """
+    create_posts(app, 3)
+    with app.app_context():
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['render-posts'])
+        assert 'Re-rendered 3 posts' in result.output
+        post = get_storage().posts.find_one({'title': 'Post 000'})
+    assert post['content_html'] == '<p>Content of post 0</p>'
+
+def test_index_popularity_sort(app, client):
+    """
+    Test that popularity sorts on the likes counter.
+    """
+    create_posts(app, 3)
+    with app.app_context():
+        posts = get_storage().posts
+        posts.update(posts.find_one({'title': 'Post 002'})['_id'], {'likes': 5})
+    response = client.get('/post/?sort=popularity')
+    assert response.status_code == 200
+    assert response.data.index(b'Post 002') < response.data.index(b'Post 000')
+
+def test_search_grams(app, client):
+    """
+    Test that substring search goes through the gram index with contains semantics.
+    """
+    from flaskr.search import contains_filter, query_grams, tokenize
+    assert tokenize('Photo') == {'pho', 'hot', 'oto'}
+    assert query_grams('Graph') == ['gra', 'rap', 'aph']
+    assert 'search_grams' not in contains_filter('ab')
+
+    login(client)
+    client.post('/post/create', data={'title': 'Photography basics', 'content': 'Aperture', 'tags': '', 'category': 'General'})
+    client.post('/post/create', data={'title': 'Stoichiometry notes', 'content': 'Moles', 'tags': '', 'category': 'General'})
+    response = client.get('/post/?q=GRAPH')
+    assert b'Photography basics' in response.data
+    assert b'Stoichiometry notes' not in response.data
+    # Shorter than a trigram: regex only
+    response = client.get('/post/?q=hY')
+    assert b'Photography basics' in response.data
+    assert b'Stoichiometry notes' not in response.data
+
+def test_init_db_indexes_old_posts(app, client):
+    """
+    Test that init-db builds the grams of posts saved without them.
+    """
+    with app.app_context():
+        get_storage().posts.insert({'title': 'Legacy thermodynamics', 'content': 'Entropy', 'category': 'General',
+                                    'creator_id': 'someone', 'tags': [], 'likes': 0, 'comments': 0,
+                                    'created_at': datetime.now(), 'updated_at': datetime.now()})
+    assert b'Legacy thermodynamics' not in client.get('/post/?q=thermo').data
+    with app.app_context():
+        assert 'Indexed 1 posts for search.' in app.test_cli_runner().invoke(args=['init-db']).output
+    assert b'Legacy thermodynamics' in client.get('/post/?q=thermo').data
+
+def test_view_paginates_comments(app, client):
+    """
+    Test that the view shows the first page of comments and the JSON endpoint the rest.
+    """
+    user_id = login(client)
+    with app.app_context():
+        get_storage().users.insert({'_id': ObjectId(user_id), 'username': 'testuser', 'email': 'test@example.com'})
+    client.post('/post/create', data={'title': 'Busy thread', 'content': 'Discuss', 'tags': '', 'category': 'General'})
+    with app.app_context():
+        post_id = str(get_storage().posts.find_one({'title': 'Busy thread'})['_id'])
+    for i in range(5):
+        client.post(f'/post/{post_id}/comment', data={'comment': f'Comment number {i}'})
+
+    app.config['COMMENTS_PER_PAGE'] = 2
+    response = client.get(f'/post/{post_id}/view')
+    assert b'Created by: testuser' in response.data
+    assert b'Comment number 1' in response.data
+    assert b'Comment number 2' not in response.data
+    assert b'Load more comments' in response.data
+
+    page = client.get(f'/post/{post_id}/comments?per_page=2').get_json()
+    assert [c['content'] for c in page['comments']] == ['Comment number 0', 'Comment number 1']
+    page = client.get(page['next']).get_json()
+    assert [c['content'] for c in page['comments']] == ['Comment number 2', 'Comment number 3']
+    page = client.get(page['next']).get_json()
+    assert [c['content'] for c in page['comments']] == ['Comment number 4']
+    assert page['next'] is None
+    assert page['comments'][0]['username'] == 'testuser'
+
+def test_like_toggle(app, client):
+    """
+    Test that liking twice toggles the like and keeps the counter in step.
+    """
+    login(client)
+    create_posts(app, 1)
+    with app.app_context():
+        storage = get_storage()
+        post_id = storage.posts.find_one()['_id']
+
+    client.post(f'/post/{post_id}/like')
+    with app.app_context():
+        assert storage.posts.get(post_id)['likes'] == 1
+        assert storage.likes.count({'post_id': post_id}) == 1
+
+    client.post(f'/post/{post_id}/like')
+    with app.app_context():
+        assert storage.posts.get(post_id)['likes'] == 0
+        assert storage.likes.count({'post_id': post_id}) == 0
+
+    response = client.post(f'/post/{ObjectId()}/like')
+    assert response.status_code == 404
+
+def test_like_buffered(app, client):
+    """
+    Test that buffered likes are coalesced and written on flush.
+    """
+    from flaskr.counters import get_counter_buffer
+    from flaskr.flusher import _flushers
+    app.config['COUNTER_BUFFER'] = True
+    app.config['COUNTER_BUFFER_INTERVAL'] = 3600
+    create_posts(app, 1)
+    with app.app_context():
+        storage = get_storage()
+        post_id = storage.posts.find_one()['_id']
+
+    for _ in range(3):
+        login(client)
+        client.post(f'/post/{post_id}/like')
+    with app.app_context():
+        assert storage.posts.get(post_id)['likes'] == 0
+        buffer = get_counter_buffer()
+        assert buffer.pending('posts', post_id, 'likes') == 3
+        assert buffer.flush() == 1
+        assert storage.posts.get(post_id)['likes'] == 3
+        # Flushed at exit by the module's one atexit hook until stopped
+        assert buffer in _flushers
+        buffer.stop()
+        assert buffer not in _flushers
+
+def test_concurrent_unlikes_count_once(app, monkeypatch):
+    """
+    Test that two clicks on a liked post that both find the like already there leave no like and a count of 0.
+    """
+    create_posts(app, 1)
+    user_id = str(ObjectId())
+    clients = [app.test_client() for _ in range(2)]
+    for client in clients:
+        login(client, user_id)
+    with app.app_context():
+        storage = get_storage()
+        post_id = storage.posts.find_one()['_id']
+        likes_class = type(storage.likes)
+    clients[0].post(f'/post/{post_id}/like')
+
+    # Hold both requests after their like attempt, so both go on to unlike
+    barrier = threading.Barrier(2)
+    add = likes_class.add
+
+    def racing_add(self, post_id, user_id):
+        added = add(self, post_id, user_id)
+        barrier.wait(timeout=5)
+        return added
+
+    monkeypatch.setattr(likes_class, 'add', racing_add)
+    threads = [threading.Thread(target=client.post, args=(f'/post/{post_id}/like',)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        assert storage.likes.count({'post_id': post_id}) == 0
+        assert storage.posts.get(post_id)['likes'] == 0
+
+def test_flush_keeps_written_counts(app, client, monkeypatch):
+    """
+    Test that a failure after the counters are written doesn't requeue them.
+    """
+    from flaskr import counters
+    app.config['COUNTER_BUFFER'] = True
+    app.config['COUNTER_BUFFER_INTERVAL'] = 3600
+    create_posts(app, 1)
+    login(client)
+    with app.app_context():
+        storage = get_storage()
+        post_id = storage.posts.find_one()['_id']
+    client.post(f'/post/{post_id}/like')
+
+    def failing_bump(*args, **kwargs):
+        raise RuntimeError('generation store unavailable')
+
+    monkeypatch.setattr(counters, 'bump_generation', failing_bump)
+    with app.app_context():
+        buffer = counters.get_counter_buffer()
+        assert buffer.flush() == 1
+        assert buffer.pending('posts', post_id, 'likes') == 0
+        assert storage.posts.get(post_id)['likes'] == 1
+        buffer.stop()
+
+def test_view_conditional_get(app, client):
+    """
+    Test that an unchanged post answers revalidation with 304 and a new comment invalidates it.
+    """
+    login(client)
+    create_posts(app, 1)
+    with app.app_context():
+        post_id = get_storage().posts.find_one()['_id']
+
+    response = client.get(f'/post/{post_id}/view')
+    etag = response.headers['ETag']
+    assert response.last_modified is not None
+
+    response = client.get(f'/post/{post_id}/view', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    client.post(f'/post/{post_id}/comment', data={'comment': 'New comment'})
+    client.get(f'/post/{post_id}/view')  # Consume the flash message
+    response = client.get(f'/post/{post_id}/view', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_index_conditional_get(app, client):
+    """
+    Test that listings revalidate on the posts generation.
+    """
+    response = client.get('/post/')
+    etag = response.headers['ETag']
+    assert client.get('/post/', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/post/?sort=title', headers={'If-None-Match': etag}).status_code == 200
+
+    login(client)
+    client.post('/post/create', data={'title': 'New post', 'content': '', 'tags': '', 'category': 'General'})
+    client.get('/post/')  # Consume the flash message
+    with client.session_transaction() as session:
+        session.clear()
+    assert client.get('/post/', headers={'If-None-Match': etag}).status_code == 200
+
+def test_first_requests_after_login(app, client):
+    """
+    Test that the listing and a post view render on the first requests after
+    logging in, before the session holds a copy of the user.
+    """
+    from werkzeug.security import generate_password_hash
+    create_posts(app, 1)
+    with app.app_context():
+        storage = get_storage()
+        storage.users.insert({'username': 'testuser', 'username_lower': 'testuser', 'email': 'test@example.com',
+                              'email_lower': 'test@example.com', 'password': generate_password_hash('secret')})
+        post_id = storage.posts.find_one({'title': 'Post 000'})['_id']
+    assert client.post('/auth/login', data={'username': 'testuser', 'password': 'secret'}).status_code == 302
+
+    response = client.get('/post/')
+    assert response.status_code == 200
+    assert 'ETag' in response.headers
+    with client.session_transaction() as session:
+        del session['user_data']
+    response = client.get(f'/post/{post_id}/view')
+    assert response.status_code == 200
+    assert 'ETag' in response.headers
@@ -0,0 +1,92 @@
+import pytest
+
+from flaskr.related import build_related, post_vector, stored_vector, update_related
+from flaskr.storage import get_storage
+from test_post import login
+
+TOPICS = {
+    'Eigenvalues': ('matrix eigenvalue eigenvector determinant', 'math'),
+    'Diagonalization': ('matrix eigenvalue diagonal similarity', 'math'),
+    'Photosynthesis': ('chlorophyll light glucose plant', 'biology'),
+    'Cell respiration': ('glucose mitochondria plant energy', 'biology'),
+    'Recursion': ('function stack recursion base case', 'python'),
+    'Closures': ('function scope closure variable', 'python'),
+}
+
+
+def create(client, title, content, tags):
+    client.post('/post/create', data={'title': title, 'content': content, 'tags': tags, 'category': 'General'})
+
+def post_ids(app):
+    with app.app_context():
+        return {post['title']: post['_id'] for post in get_storage().posts.find({}, {'title': 1})}
+
+def test_build_related_and_view(app, client):
+    """
+    Test that the batch job pairs posts on the same topic, stores vectors the
+    incremental path reproduces, and that the view lists the related notes.
+    """
+    pytest.importorskip('scipy')
+    login(client)
+    for title, (content, tags) in TOPICS.items():
+        create(client, title, f'{content} notes', tags)
+    ids = post_ids(app)
+
+    with app.app_context():
+        storage = get_storage()
+        # Before the first build there is no idf, so nothing is related yet
+        assert storage.posts.get(ids['Eigenvalues'])['related'] == []
+        assert build_related(storage) == (6, storage.terms.count())
+
+        post = storage.posts.get(ids['Eigenvalues'])
+        assert post['related'][0]['_id'] == ids['Diagonalization']
+        assert all(entry['_id'] != ids['Eigenvalues'] for entry in post['related'])
+        assert 'notes' not in post['related_terms']
+        vector = post_vector(storage, {'title': 'Eigenvalues', 'content': f"{TOPICS['Eigenvalues'][0]} notes",
+                                       'tags': ['math']})
+        assert vector == pytest.approx(stored_vector(post), abs=1e-5)
+
+        # A rebuild overwrites the idf table in place and drops terms that went away
+        idf = storage.terms.get('matrix')['idf']
+        storage.terms.insert({'_id': 'obsolete', 'idf': 1.0})
+        assert build_related(storage)[1] == storage.terms.count()
+        assert storage.terms.get('obsolete') is None
+        assert storage.terms.get('matrix')['idf'] == idf
+
+    response = client.get(f"/post/{ids['Eigenvalues']}/view")
+    assert b'Related notes' in response.data
+    assert f"/post/{ids['Diagonalization']}/view".encode() in response.data
+    assert client.get(f"/post/{ids['Eigenvalues']}/view", headers={'If-None-Match': response.headers['ETag']}) \
+        .status_code == 304
+
+def test_new_and_deleted_posts_update_neighbours(app, client):
+    """
+    Test that a new post is placed among its neighbours without a rebuild and
+    that deleted posts drop out of the related notes.
+    """
+    pytest.importorskip('scipy')
+    login(client)
+    for title, (content, tags) in TOPICS.items():
+        create(client, title, content, tags)
+    with app.app_context():
+        build_related(get_storage())
+
+    create(client, 'Spectral theorem', 'symmetric matrix eigenvalue eigenvector', 'math')
+    ids = post_ids(app)
+    with app.app_context():
+        storage = get_storage()
+        new_post = storage.posts.get(ids['Spectral theorem'])
+        assert new_post['related'][0]['_id'] == ids['Eigenvalues']
+        assert ids['Spectral theorem'] in [entry['_id'] for entry in storage.posts.get(ids['Eigenvalues'])['related']]
+        assert not any(entry['_id'] == ids['Spectral theorem']
+                       for entry in storage.posts.get(ids['Closures'])['related'])
+
+        # Editing the post to another topic moves it
+        update_related(storage, ids['Spectral theorem'], {'title': 'Closures again',
+                                                          'content': 'function scope closure', 'tags': ['python']})
+        assert storage.posts.get(ids['Spectral theorem'])['related'][0]['_id'] in (ids['Closures'], ids['Recursion'])
+
+    client.post(f"/post/{ids['Spectral theorem']}/delete")
+    response = client.get(f"/post/{ids['Closures']}/view")
+    assert response.status_code == 200
+    assert f"/post/{ids['Spectral theorem']}/view".encode() not in response.data
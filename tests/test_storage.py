@@ -0,0 +1,144 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from flaskr.pagination import decode_cursor
+from flaskr.storage import get_storage
+
+TAGS = ['python', 'math', 'exam', 'lab']
+
+def seed_posts(storage, count=40):
+    start = datetime(2025, 1, 1)
+    storage.posts.insert_many([{
+        'title': f"{['Algebra', 'Biology', 'Calculus'][i % 3]} notes {i:02d}",
+        'content': f"Notes {i} about {'matrix' if i % 4 == 0 else 'cells'}",
+        'category': ['General', 'Math'][i % 2],
+        'creator_id': 'someone',
+        'created_at': start + timedelta(minutes=i // 2),  # Ties break on _id
+        'updated_at': start,
+        'tags': [TAGS[i % 4], TAGS[(i + 1) % 4]],
+        'likes': i % 5,
+        'comments': 0,
+        'search_grams': sorted({text[j:j + 3] for text in [f"notes {i} about {'matrix' if i % 4 == 0 else 'cells'}"]
+                                for j in range(len(text) - 2)}),
+    } for i in range(count)])
+
+def all_pages(posts, filters, sort, page_size=7):
+    """
+    Walk forward through every page, then back again from the last one.
+    """
+    pages = [posts.find_page(filters, sort, page_size=page_size)]
+    while pages[-1]['next']:
+        pages.append(posts.find_page(filters, sort, after=decode_cursor(pages[-1]['next']), page_size=page_size))
+    forward = [post['_id'] for page in pages for post in page['items']]
+    backward = []
+    page = pages[-1]
+    while page['prev']:
+        page = posts.find_page(filters, sort, before=decode_cursor(page['prev']), page_size=page_size)
+        backward = [post['_id'] for post in page['items']] + backward
+    return forward, backward + [post['_id'] for post in pages[-1]['items']]
+
+@pytest.mark.parametrize('filters', [
+    {},
+    {'category': 'Math'},
+    {'tags': ['python', 'lab']},
+    {'tags': ['python', 'math'], 'require_all_tags': True},
+    {'q': 'matrix'},
+    {'q': 'MATRIX', 'category': 'General'},
+])
+@pytest.mark.parametrize('sort', ['created_at', 'title', 'likes'])
+def test_find_page_matches_full_sort(app, filters, sort):
+    with app.app_context():
+        posts = get_storage().posts
+        seed_posts(get_storage())
+        everything = posts.find({})
+
+        def wanted(post):
+            if filters.get('category') and post['category'] != filters['category']:
+                return False
+            if filters.get('tags'):
+                test = all if filters.get('require_all_tags') else any
+                if not test(tag in post['tags'] for tag in filters['tags']):
+                    return False
+            return not filters.get('q') or filters['q'].lower() in post['content'].lower()
+
+        expected = [post['_id'] for post in sorted((post for post in everything if wanted(post)),
+                                                   key=lambda post: (post[sort], post['_id']), reverse=True)]
+        forward, backward = all_pages(posts, filters, sort)
+        assert expected
+        assert forward == expected
+        assert backward == expected
+
+def test_find_applies_portable_filters(app):
+    with app.app_context():
+        posts = get_storage().posts
+        seed_posts(get_storage(), 10)
+        assert posts.count({'likes': {'$gte': 3}}) == 4
+        assert posts.count({'tags': 'lab'}) == 4
+        assert posts.count({'tags': {'$all': ['python', 'math']}}) == 3
+        assert posts.count({'$or': [{'likes': 0}, {'category': 'Math'}]}) == 6
+        assert posts.count({'title': {'$regex': '^algebra', '$options': 'i'}}) == 4
+        assert posts.count({'missing': {'$exists': False}}) == 10
+        titles = [post['title'] for post in posts.find({'likes': {'$in': [1, 2]}}, {'title': 1},
+                                                       sort=[('likes', -1), ('title', 1)])]
+        assert titles == ['Biology notes 07', 'Calculus notes 02', 'Algebra notes 06', 'Biology notes 01']
+
+def test_relevance_matches_any_word(app):
+    """
+    Test that relevance search matches posts with any word of the query, like
+    $text, rather than only posts containing the whole query string.
+    """
+    with app.app_context():
+        posts = get_storage().posts
+        seed_posts(get_storage(), 20)
+        page = posts.find_page({'q': 'matrix cells', 'category': 'Math'}, 'relevance', page_size=50)
+        assert len(page['items']) == 10
+        assert all(post['category'] == 'Math' for post in page['items'])
+        assert posts.find_page({'q': 'matrix cells'}, 'created_at', page_size=50)['items'] == []
+
+def test_unique_constraints(app):
+    with app.app_context():
+        users = get_storage().users
+        users.insert({'username': 'a', 'email': 'a@example.com', 'username_lower': 'a', 'email_lower': 'a@example.com'})
+        with pytest.raises(DuplicateKeyError):
+            users.insert({'username': 'b', 'email': 'b@example.com', 'username_lower': 'a', 'email_lower': 'b@example.com'})
+        assert users.find_by_keys('a', 'a')['username'] == 'a'
+        assert users.find_by_keys('x', 'a@example.com')['username'] == 'a'
+        assert users.count() == 1
+
+def test_unordered_insert_many_reports_failures(app):
+    with app.app_context():
+        users = get_storage().users
+        users.insert({'username': 'b', 'email': 'b@example.com'})
+        with pytest.raises(BulkWriteError) as e:
+            users.insert_many([{'username': name, 'email': f'{name}@example.com'} for name in 'abcd'],
+                              ordered=False, batch_size=2)
+        assert e.value.details['nInserted'] == 3
+        assert [error['index'] for error in e.value.details['writeErrors']] == [1]
+        assert users.count() == 4
+
+def test_concurrent_like_toggles(app):
+    with app.app_context():
+        storage = get_storage()
+        post_id = storage.posts.insert({'title': 'Hot', 'likes': 0})
+    user_ids = [str(ObjectId()) for _ in range(20)]
+
+    def like_twice(user_id):
+        with app.app_context():
+            likes = get_storage().likes
+            for _ in range(3):
+                likes.add(post_id, user_id)  # Only the first add counts
+            likes.remove(post_id, user_id)
+            likes.add(post_id, user_id)
+
+    threads = [threading.Thread(target=like_twice, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with app.app_context():
+        assert get_storage().likes.count({'post_id': post_id}) == len(user_ids)
+        assert get_storage().likes.count_by('post_id') == {post_id: len(user_ids)}
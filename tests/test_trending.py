@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone
+
+from flaskr.pagination import decode_cursor
+from flaskr.storage import get_storage
+from flaskr.trending import HALF_LIFE, rescore_trending, trending_score
+from test_post import login
+
+
+def add_post(storage, title, age_hours, likes=0, comments=0):
+    created_at = datetime.now(timezone.utc) - timedelta(hours=age_hours)
+    post = {'title': title, 'content': 'Body', 'category': 'General', 'creator_id': 'someone',
+            'created_at': created_at, 'updated_at': created_at, 'tags': ['test'],
+            'likes': likes, 'comments': comments}
+    post['trending'] = trending_score(post)
+    return storage.posts.insert(post)
+
+def test_trending_score_decays_with_age():
+    """
+    Test that doubling engagement makes up for one half-life of age.
+    """
+    now = datetime(2026, 1, 1)
+    fresh = trending_score({'likes': 3, 'created_at': now})
+    day_old = trending_score({'likes': 7, 'created_at': now - timedelta(hours=HALF_LIFE)})
+    assert abs(fresh - day_old) < 1e-6
+    assert trending_score({'likes': 1, 'comments': 1, 'created_at': now}) > \
+        trending_score({'likes': 2, 'created_at': now})
+    # Aware and naive UTC datetimes score the same
+    assert trending_score({'created_at': now}) == trending_score({'created_at': now.replace(tzinfo=timezone.utc)})
+
+def test_trending_sort_follows_likes_and_comments(app, client):
+    """
+    Test that likes and comments rescore a post, that the trending listing
+    pages with keyset cursors, and that rescore-trending repairs drift.
+    """
+    with app.app_context():
+        storage = get_storage()
+        old_id = add_post(storage, 'Old classic', 24 * 30, likes=500)
+        post_ids = [add_post(storage, f'Fresh {i}', i) for i in range(4)]
+
+    response = client.get('/post/?sort=trending&per_page=2')
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert page.index('Fresh 0') < page.index('Fresh 1')
+    assert 'Old classic' not in page
+
+    login(client)
+    client.post(f'/post/{post_ids[3]}/like')
+    client.post(f'/post/{post_ids[3]}/comment', data={'comment': 'Great notes'})
+    with app.app_context():
+        storage = get_storage()
+        post = storage.posts.get(post_ids[3])
+        assert post['trending'] == trending_score(post)
+        first = storage.posts.find_page({}, 'trending', page_size=2)
+        assert first['items'][0]['_id'] == post_ids[3]
+        second = storage.posts.find_page({}, 'trending', after=decode_cursor(first['next']), page_size=2)
+        third = storage.posts.find_page({}, 'trending', after=decode_cursor(second['next']), page_size=2)
+        assert [post['_id'] for post in second['items']] == [post_ids[1], post_ids[2]]
+        assert [post['_id'] for post in third['items']] == [old_id]
+        assert third['next'] is None
+
+        storage.posts.update(old_id, {'trending': 0})
+        runner = app.test_cli_runner()
+        assert 'Rescored 1 posts.' in runner.invoke(args=['rescore-trending']).output
+        assert rescore_trending() == 0